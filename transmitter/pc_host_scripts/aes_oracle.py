@@ -0,0 +1,495 @@
+import argparse
+import asyncio
+import collections
+import itertools
+import mmap
+import os
+import serial
+import struct
+import sys
+import time
+
+import numpy as np
+
+from aes_reference import RTL_KEY, decrypt_blocks
+from serial_transport import DEFAULT_PORT, AES_RESPONSE_SIZE, build_packet, get_transport, close_all
+from payload_reader import iter_payloads
+
+# Ciphertext that makes the AES top level modulate the decrypted key
+TRIGGER_WORD = 0x12341234123412341234123412341234
+
+# Log layout: 16-byte header, then fixed-size little-endian records
+LOG_MAGIC = b"AESORACL"
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct("<8sII")
+LOG_RECORD = struct.Struct("<16s16sQHH")  # ciphertext, plaintext, latency_ns, status, flags
+LOG_DTYPE = np.dtype([('ciphertext', 'u1', 16), ('plaintext', 'u1', 16), ('latency_ns', '<u8'),
+                      ('status', '<u2'), ('flags', '<u2')])
+LOG_FLAGS = struct.Struct("<H")
+LOG_FLAGS_OFFSET = LOG_DTYPE.fields['flags'][1]
+
+# Record flags
+FLAG_TIMEOUT = 0x0001    # no 0xAAAA response before the deadline, plaintext is zero
+FLAG_REJECTED = 0x0002   # responses with another status word were skipped before this one
+FLAG_TRIGGER = 0x0004    # ciphertext was the trigger word, the board modulated the key
+FLAG_MISMATCH = 0x0008   # plaintext differs from the reference decryption
+
+VERIFY_BATCH = 4096
+
+
+class OracleLog:
+    """
+    Append-only binary log of oracle queries
+
+    The file starts with LOG_HEADER and continues with LOG_RECORD entries of
+    44 bytes each. Records are buffered and flushed + fsync'ed every
+    `fsync_every` records or `fsync_interval` seconds, whichever comes
+    first, so a crash loses at most that window. Opening an existing log
+    truncates a partially written last record; `count` is then the number
+    of complete records, i.e. how many input ciphertexts to skip on resume.
+    set_flags() rewrites the flags of a logged record in place, for checks
+    that complete after the record was appended.
+    """
+
+    def __init__(self, path, fsync_every=256, fsync_interval=5.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        # Not opened in append mode, which would send the set_flags() rewrites to the end of the file
+        self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            self._file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, LOG_RECORD.size))
+            self._sync()
+            size = LOG_HEADER.size
+        else:
+            self._file.seek(0)
+            magic, version, record_size = LOG_HEADER.unpack(self._file.read(LOG_HEADER.size))
+            if magic != LOG_MAGIC or version != LOG_VERSION or record_size != LOG_RECORD.size:
+                self._file.close()
+                raise ValueError(f"{path} is not a version {LOG_VERSION} oracle log")
+        self.count = (size - LOG_HEADER.size) // LOG_RECORD.size
+        complete = LOG_HEADER.size + self.count * LOG_RECORD.size
+        if size != complete:
+            self._file.truncate(complete)
+            self._sync()
+        self._file.seek(complete)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, ciphertext, plaintext, latency_ns, status, flags):
+        self._file.write(LOG_RECORD.pack(ciphertext, plaintext, latency_ns, status, flags))
+        self.count += 1
+        self._unsynced += 1
+        if (self._unsynced >= self.fsync_every
+                or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def set_flags(self, index, flags):
+        """Rewrite the flags of record `index`; the change is synced with the following appends"""
+        self._file.seek(LOG_HEADER.size + index * LOG_RECORD.size + LOG_FLAGS_OFFSET)
+        self._file.write(LOG_FLAGS.pack(flags))
+        self._file.seek(0, os.SEEK_END)
+        self._unsynced += 1
+
+    def sync(self):
+        if self._unsynced:
+            self._sync()
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_oracle_log(path):
+    """
+    Yield the complete records of an oracle log
+    Yields: (ciphertext bytes, plaintext bytes, latency_ns, status, flags)
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < LOG_HEADER.size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            magic, version, record_size = LOG_HEADER.unpack_from(m, 0)
+            if magic != LOG_MAGIC or version != LOG_VERSION or record_size != LOG_RECORD.size:
+                raise ValueError(f"{path} is not a version {LOG_VERSION} oracle log")
+            for offset in range(LOG_HEADER.size, size - LOG_RECORD.size + 1, LOG_RECORD.size):
+                yield LOG_RECORD.unpack_from(m, offset)
+
+
+def load_oracle_log(path):
+    """Memory-map the complete records of an oracle log as a LOG_DTYPE structured array"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.read(LOG_HEADER.size)
+    if len(header) < LOG_HEADER.size:
+        return np.zeros(0, dtype=LOG_DTYPE)
+    magic, version, record_size = LOG_HEADER.unpack(header)
+    if magic != LOG_MAGIC or version != LOG_VERSION or record_size != LOG_DTYPE.itemsize:
+        raise ValueError(f"{path} is not a version {LOG_VERSION} oracle log")
+    count = (size - LOG_HEADER.size) // LOG_DTYPE.itemsize
+    if not count:
+        return np.zeros(0, dtype=LOG_DTYPE)
+    return np.memmap(path, dtype=LOG_DTYPE, mode='r', offset=LOG_HEADER.size, shape=(count,))
+
+
+def check_plaintexts(ciphertexts, plaintexts, key=RTL_KEY):
+    """
+    Compare board plaintexts with the reference decryption, in one batch
+
+    Args:
+        ciphertexts, plaintexts: (N, 16) uint8 arrays
+        key: AES-128 key loaded by the RTL
+
+    Returns:
+        Boolean array, True where the plaintext is wrong
+    """
+    return np.any(decrypt_blocks(ciphertexts, key) != plaintexts, axis=1)
+
+
+def classify_faults(records, key=RTL_KEY):
+    """
+    Sort the wrong answers of a batch of LOG_DTYPE records into known fault patterns
+
+    The AES top level clears its ciphertext and key registers once the UART
+    reply has been sent, so a reply latched late decrypts under a zeroed
+    register; with a window > 1 a lost packet shifts every reply by one query.
+
+    Returns: dict of pattern -> count, plus 'wrong_bytes', a histogram of the
+             number of wrong bytes per mismatching block (index 0..16)
+    """
+    ciphertexts = np.ascontiguousarray(records['ciphertext'])
+    plaintexts = np.ascontiguousarray(records['plaintext'])
+    answered = (records['flags'] & FLAG_TIMEOUT) == 0
+    expected = decrypt_blocks(ciphertexts, key)
+    wrong = np.any(expected != plaintexts, axis=1) & answered
+    zero_block = decrypt_blocks(bytes(16), key)[0]
+    patterns = {
+        'checked': int(answered.sum()),
+        'timeouts': int((~answered).sum()),
+        'mismatches': int(wrong.sum()),
+        'zero_plaintext': int((wrong & ~np.any(plaintexts, axis=1)).sum()),
+        'echoed_ciphertext': int((wrong & np.all(plaintexts == ciphertexts, axis=1)).sum()),
+        'zero_key': int((wrong & np.all(plaintexts == decrypt_blocks(ciphertexts, bytes(16)), axis=1)).sum()),
+        'zero_ciphertext': int((wrong & np.all(plaintexts == zero_block, axis=1)).sum()),
+        'previous_query': int((wrong[1:] & np.all(plaintexts[1:] == expected[:-1], axis=1)).sum()),
+    }
+    patterns['wrong_bytes'] = np.bincount((expected != plaintexts)[wrong].sum(axis=1), minlength=17)
+    return patterns
+
+
+def read_ciphertexts(path, raw=False):
+    """
+    Lazily read ciphertexts, skipping invalid lines
+
+    Args:
+        path: Text file with one binary/hex value per line ('-' for stdin),
+              or with raw=True a binary file of concatenated 16-byte blocks
+    Yields: 16-byte ciphertexts
+    """
+    if raw:
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(16)
+                if len(block) < 16:
+                    if block:
+                        print(f"Warning: Ignoring {len(block)} trailing bytes in {path}")
+                    return
+                yield block
+    for line_no, value, error in iter_payloads(path):
+        if error is not None:
+            print(f"Line {line_no}: {error} (skipped)")
+            continue
+        yield value.to_bytes(16, byteorder='big')
+
+
+async def run_oracle(transport, ciphertexts, log, symbol_time_cycles, window=1, ack_timeout=2.0,
+                     limit=None, key=RTL_KEY):
+    """
+    Pipeline ciphertexts to the AES top level and log every reply
+
+    Up to `window` packets are written ahead of the oldest unanswered one.
+    All transport calls run in order on the port's worker thread, so the
+    next packets are already on the wire while the oldest reply is read.
+    The board only accepts a packet while idle and replies right
+    after decrypting, so window=1 (write on the previous reply) is always
+    safe; larger windows keep the UART busy but rely on the board never
+    dropping a packet, as responses are matched to queries in order. The
+    pipeline is drained around the trigger word, which keeps the board busy
+    for the modulation airtime.
+
+    Every reply is logged as soon as it arrives, so the fsync window of the
+    log bounds what a crash can lose. With a `key`, the logged replies are
+    then checked against the reference decryption in one vectorized call
+    per batch of up to VERIFY_BATCH (and no more than the log's
+    fsync_every), and mismatching records get FLAG_MISMATCH set in place;
+    a crash before that check only loses the flag, which `verify`
+    recomputes from the log anyway.
+
+    Returns: dict of queries/timeouts/rejected/mismatches counters, latencies (ns) and elapsed seconds
+    """
+    airtime = symbol_time_cycles * 128 / 12_000_000
+    stats = {'queries': 0, 'timeouts': 0, 'rejected': 0, 'mismatches': 0, 'latencies': []}
+    batch = []  # (log index, ciphertext, plaintext, flags) of logged replies waiting for verification
+    batch_size = min(VERIFY_BATCH, log.fsync_every)
+    inflight = collections.deque()  # (ciphertext, write done ns, trigger)
+    pending = iter(ciphertexts)
+    remaining = limit
+    start_time = time.perf_counter()
+    last_report = start_time
+
+    def next_ciphertext():
+        nonlocal remaining
+        if remaining is not None:
+            if remaining <= 0:
+                return None
+            remaining -= 1
+        return next(pending, None)
+
+    def flush_batch():
+        if not batch:
+            return
+        ciphertexts = np.frombuffer(b''.join(record[1] for record in batch), dtype=np.uint8).reshape(-1, 16)
+        plaintexts = np.frombuffer(b''.join(record[2] for record in batch), dtype=np.uint8).reshape(-1, 16)
+        mismatches = check_plaintexts(ciphertexts, plaintexts, key)
+        for index in np.flatnonzero(mismatches).tolist():
+            query, _, plaintext, flags = batch[index]
+            log.set_flags(query, flags | FLAG_MISMATCH)
+            stats['mismatches'] += 1
+            print(f"⚠️  Query {query}: plaintext {plaintext.hex().upper()} does not match the reference")
+        batch.clear()
+
+    def record(ciphertext, plaintext, latency_ns, status, flags):
+        log.append(ciphertext, plaintext, latency_ns, status, flags)
+        if key is not None and not flags & FLAG_TIMEOUT:
+            batch.append((log.count - 1, ciphertext, plaintext, flags))
+            if len(batch) >= batch_size:
+                flush_batch()
+
+    exhausted = False
+    while True:
+        while not exhausted and len(inflight) < window and not (inflight and inflight[-1][2]):
+            ciphertext = next_ciphertext()
+            if ciphertext is None:
+                exhausted = True
+                break
+            trigger = int.from_bytes(ciphertext, byteorder='big') == TRIGGER_WORD
+            if trigger and inflight:
+                # Drain before the trigger word so its airtime does not swallow queued packets
+                pending = itertools.chain([ciphertext], pending)
+                if remaining is not None:
+                    remaining += 1
+                break
+            packet = build_packet(int.from_bytes(ciphertext, byteorder='big'), symbol_time_cycles, 1)
+            _, write_done_ns = await transport.send_packet(packet)
+            inflight.append((ciphertext, write_done_ns, trigger))
+        if not inflight:
+            break
+
+        ciphertext, write_done_ns, trigger = inflight.popleft()
+        response, rejected = await transport.wait_completion(AES_RESPONSE_SIZE, ack_timeout)
+        latency_ns = time.monotonic_ns() - write_done_ns
+        flags = (FLAG_TRIGGER if trigger else 0) | (FLAG_REJECTED if rejected else 0)
+        stats['rejected'] += len(rejected)
+        if response is None:
+            flags |= FLAG_TIMEOUT
+            stats['timeouts'] += 1
+            print(f"❌ Query {log.count}: no response from the board!")
+            record(ciphertext, bytes(16), latency_ns, 0, flags)
+        else:
+            record(ciphertext, response[:16], latency_ns, int.from_bytes(response[16:], byteorder='big'), flags)
+            stats['latencies'].append(latency_ns)
+        stats['queries'] += 1
+        if trigger:
+            await asyncio.sleep(airtime)
+
+        now = time.perf_counter()
+        if now - last_report >= 5:
+            last_report = now
+            flush_batch()
+            print(f"[{now - start_time:8.1f} s] {log.count} records, "
+                  f"{stats['queries'] / (now - start_time):.1f} queries/s")
+
+    flush_batch()
+    stats['elapsed'] = time.perf_counter() - start_time
+    return stats
+
+
+def print_summary(stats, log):
+    latencies = sorted(stats['latencies'])
+    rate = stats['queries'] / stats['elapsed'] if stats['elapsed'] > 0 else 0.0
+    print(f"\n{'='*60}")
+    print(f"ORACLE SUMMARY")
+    print(f"{'='*60}")
+    print(f"Queries this run: {stats['queries']} in {stats['elapsed']:.3f} seconds ({rate:.1f} queries/s)")
+    print(f"Timeouts: {stats['timeouts']}, rejected responses: {stats['rejected']}, "
+          f"reference mismatches: {stats['mismatches']}")
+    if latencies:
+        p99 = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]
+        print(f"Latency: min {latencies[0] / 1e6:.3f} ms, mean {sum(latencies) / len(latencies) / 1e6:.3f} ms, "
+              f"p99 {p99 / 1e6:.3f} ms, max {latencies[-1] / 1e6:.3f} ms")
+    print(f"Log: {log.path} now holds {log.count} records")
+
+
+async def run(args):
+    symbol_time_cycles = int(args.symbol_time_ms * 12000)  # 12000 cycles per ms at 12MHz
+    if symbol_time_cycles > 65535:
+        print(f"Error: Symbol time too large. Maximum is {65535/12000:.1f} ms")
+        sys.exit(1)
+    if args.window < 1:
+        print("Error: Window must be at least 1")
+        sys.exit(1)
+    key = None if args.no_verify else parse_key(args.key)
+
+    try:
+        log = OracleLog(args.log, args.fsync_every, args.fsync_interval)
+    except (OSError, ValueError) as e:
+        print(f"Error opening log: {e}")
+        sys.exit(1)
+
+    with log:
+        ciphertexts = read_ciphertexts(args.ciphertexts, args.raw)
+        if log.count:
+            print(f"Resuming after {log.count} logged queries")
+            for _ in range(log.count):
+                if next(ciphertexts, None) is None:
+                    print("Input already fully processed")
+                    return
+
+        try:
+            transport = await get_transport(args.port, timeout=10)
+        except serial.SerialException as e:
+            print(f"Error opening serial port: {e}")
+            sys.exit(1)
+        try:
+            stats = await run_oracle(transport, ciphertexts, log, symbol_time_cycles, args.window,
+                                     args.ack_timeout, args.limit, key)
+        finally:
+            await close_all()
+        print_summary(stats, log)
+
+    if stats['timeouts']:
+        sys.exit(1)
+
+
+def parse_key(key_hex):
+    try:
+        key = bytes.fromhex(key_hex)
+    except ValueError:
+        key = b''
+    if len(key) != 16:
+        print(f"Error: Key must be 32 hex digits, got '{key_hex}'")
+        sys.exit(1)
+    return key
+
+
+def verify(args):
+    """Re-check every record of a log against the reference model and report the fault patterns"""
+    key = parse_key(args.key)
+    records = load_oracle_log(args.log)
+    start_time = time.perf_counter()
+    totals = None
+    for offset in range(0, len(records), args.chunk):
+        patterns = classify_faults(records[offset:offset + args.chunk], key)
+        if totals is None:
+            totals = patterns
+        else:
+            for name, count in patterns.items():
+                totals[name] = totals[name] + count
+    elapsed = time.perf_counter() - start_time
+
+    print(f"\n{'='*60}")
+    print(f"ORACLE VERIFICATION: {args.log}")
+    print(f"{'='*60}")
+    if totals is None:
+        print("Log holds no records")
+        return True
+    print(f"Records: {len(records)}, checked {totals['checked']} in {elapsed:.3f} seconds "
+          f"({len(records) / elapsed if elapsed > 0 else 0:,.0f} records/s)")
+    print(f"Timeouts: {totals['timeouts']}")
+    print(f"Mismatches: {totals['mismatches']}")
+    for name in ('zero_plaintext', 'echoed_ciphertext', 'zero_key', 'zero_ciphertext', 'previous_query'):
+        if totals[name]:
+            print(f"  {name.replace('_', ' ')}: {totals[name]}")
+    if totals['mismatches']:
+        histogram = ", ".join(f"{n}: {count}" for n, count in enumerate(totals['wrong_bytes'].tolist()) if count)
+        print(f"  wrong bytes per block: {histogram}")
+        print("❌ Board answers differ from the reference model")
+        return False
+    print("✅ All answered queries match the reference model")
+    return True
+
+
+def dump(args):
+    for index, (ciphertext, plaintext, latency_ns, status, flags) in enumerate(read_oracle_log(args.log)):
+        if args.limit is not None and index >= args.limit:
+            break
+        print(f"{index} {ciphertext.hex().upper()} {plaintext.hex().upper()} "
+              f"{latency_ns / 1e6:.3f}ms {status:04X} {flags:04X}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the AES key leaking architecture as a decryption oracle')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    query = subparsers.add_parser('run', help='Stream ciphertexts to the board, appending replies to a log')
+    query.add_argument('ciphertexts', help='Ciphertext file, one binary/hex value per line (- for stdin)')
+    query.add_argument('log', help='Binary oracle log, resumed if it exists')
+    query.add_argument('-p', '--port', default=DEFAULT_PORT,
+                       help=f'Serial port of the FPGA board (default: {DEFAULT_PORT})')
+    query.add_argument('--raw', action='store_true', help='Ciphertext file holds raw concatenated 16-byte blocks')
+    query.add_argument('-w', '--window', type=int, default=1,
+                       help='Packets written ahead of the oldest unanswered one (default: 1)')
+    query.add_argument('--symbol-time-ms', type=float, default=1.0,
+                       help='Symbol time sent with each packet, only used by the trigger word (default: 1.0)')
+    query.add_argument('--ack-timeout', type=float, default=2.0,
+                       help='Seconds to wait for each reply (default: 2)')
+    query.add_argument('--limit', type=int, default=None, help='Stop after this many queries')
+    query.add_argument('--fsync-every', type=int, default=256,
+                       help='Records between fsyncs of the log (default: 256)')
+    query.add_argument('--fsync-interval', type=float, default=5.0,
+                       help='Maximum seconds between fsyncs of the log (default: 5)')
+
+    query.add_argument('--key', default=RTL_KEY.hex().upper(),
+                       help='Key used to check the replies (default: the key in the RTL)')
+    query.add_argument('--no-verify', action='store_true', help='Do not check replies against the reference model')
+
+    check = subparsers.add_parser('verify', help='Check a log against the reference model and report fault patterns')
+    check.add_argument('log', help='Binary oracle log')
+    check.add_argument('--key', default=RTL_KEY.hex().upper(),
+                       help='Key loaded by the RTL (default: AADEADBEEFCAFEBABE1234567890ABCD)')
+    check.add_argument('--chunk', type=int, default=1 << 20, help='Records checked per batch (default: 1048576)')
+
+    show = subparsers.add_parser('dump', help='Print the records of an oracle log')
+    show.add_argument('log', help='Binary oracle log')
+    show.add_argument('--limit', type=int, default=None, help='Print at most this many records')
+
+    args = parser.parse_args()
+    if args.command in ('dump', 'verify'):
+        try:
+            ok = verify(args) if args.command == 'verify' else True
+            if args.command == 'dump':
+                dump(args)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        if not ok:
+            sys.exit(1)
+        return
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import argparse
+import functools
+import sys
+import time
+
+import numpy as np
+
+# Key hard-wired in singing_fpga_top_aes_fsk_modulation.v
+RTL_KEY = bytes.fromhex("AADEADBEEFCAFEBABE1234567890ABCD")
+
+ROUNDS = 10  # AES-128
+
+
+def _gf_mul(a, b):
+    """Multiply two bytes in GF(2^8) modulo x^8 + x^4 + x^3 + x + 1"""
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        a = ((a << 1) ^ 0x11B) if a & 0x80 else (a << 1)
+        b >>= 1
+    return result
+
+
+def _build_sbox():
+    """FIPS-197 5.1.1: multiplicative inverse followed by the affine transformation"""
+    inverse = [0] * 256
+    for a in range(1, 256):
+        for b in range(1, 256):
+            if _gf_mul(a, b) == 1:
+                inverse[a] = b
+                break
+    sbox = np.empty(256, dtype=np.uint8)
+    for a in range(256):
+        x = inverse[a]
+        s = x
+        for shift in range(1, 5):
+            s ^= ((x << shift) | (x >> (8 - shift))) & 0xFF
+        sbox[a] = s ^ 0x63
+    return sbox
+
+
+SBOX = _build_sbox()
+INV_SBOX = np.argsort(SBOX).astype(np.uint8)
+
+# GF(2^8) multiplication tables used by (Inv)MixColumns
+MUL = {factor: np.array([_gf_mul(a, factor) for a in range(256)], dtype=np.uint8)
+       for factor in (2, 3, 9, 11, 13, 14)}
+
+# Bytes are stored column-major as in FIPS-197 (byte i is row i % 4, column i // 4).
+# ShiftRows moves row r left by r columns, i.e. new[r + 4c] = old[r + 4((c + r) % 4)]
+SHIFT_ROWS = np.array([r + 4 * ((c + r) % 4) for c in range(4) for r in range(4)])
+INV_SHIFT_ROWS = np.argsort(SHIFT_ROWS)
+
+_RCON = (0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80, 0x1B, 0x36)
+
+
+def _t_tables(sbox, coefficients):
+    """
+    Round lookup tables: T[r][x] is the output column contributed by input row r
+
+    Each entry packs (SubBytes then MixColumns coefficient of rows 0..3) into a
+    little-endian uint32, so the XOR of four lookups is a whole output column.
+    """
+    tables = []
+    for r in range(4):
+        column = [MUL[coefficients[(row - r) % 4]][sbox] if coefficients[(row - r) % 4] != 1 else sbox
+                  for row in range(4)]
+        tables.append(sum(c.astype('<u4') << (8 * row) for row, c in enumerate(column)).astype('<u4'))
+    return tables
+
+
+# First column of the (Inv)MixColumns matrix, each following row rotated right by one
+TE = _t_tables(SBOX, (2, 1, 1, 3))
+TD = _t_tables(INV_SBOX, (14, 9, 13, 11))
+
+# Source byte of row r for each output column after (Inv)ShiftRows, shape (4 rows, 4 columns)
+_ENC_ROWS = SHIFT_ROWS.reshape(4, 4).T.copy()
+_DEC_ROWS = INV_SHIFT_ROWS.reshape(4, 4).T.copy()
+
+
+@functools.lru_cache(maxsize=64)
+def expand_key(key):
+    """
+    AES-128 key schedule (FIPS-197 5.2), cached per key
+
+    Args:
+        key: 16-byte key (bytes)
+
+    Returns:
+        (encryption round keys, decryption round keys) - read-only (11, 16) uint8
+        arrays, the latter for the equivalent inverse cipher (FIPS-197 5.3.5)
+    """
+    if len(key) != 16:
+        raise ValueError(f"AES-128 key must be 16 bytes, got {len(key)}")
+    words = [list(key[i:i + 4]) for i in range(0, 16, 4)]
+    for i in range(4, 4 * (ROUNDS + 1)):
+        temp = list(words[i - 1])
+        if i % 4 == 0:
+            temp = [int(SBOX[b]) for b in temp[1:] + temp[:1]]
+            temp[0] ^= _RCON[i // 4 - 1]
+        words.append([a ^ b for a, b in zip(words[i - 4], temp)])
+    round_keys = np.array(words, dtype=np.uint8).reshape(ROUNDS + 1, 16)
+    inverse_keys = round_keys[::-1].copy()
+    inverse_keys[1:ROUNDS] = _inv_mix_columns(inverse_keys[1:ROUNDS])
+    round_keys.flags.writeable = False
+    inverse_keys.flags.writeable = False
+    return round_keys, inverse_keys
+
+
+def as_blocks(data):
+    """View bytes, a list of 16-byte blocks or an array as an (N, 16) uint8 array"""
+    if isinstance(data, np.ndarray):
+        return data.reshape(-1, 16).astype(np.uint8, copy=False)
+    if isinstance(data, (list, tuple)):
+        data = b''.join(data)
+    if len(data) % 16:
+        raise ValueError(f"Data length {len(data)} is not a multiple of 16 bytes")
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, 16)
+
+
+def _inv_mix_columns(state):
+    a = state.reshape(-1, 4, 4)
+    a0, a1, a2, a3 = a[:, :, 0], a[:, :, 1], a[:, :, 2], a[:, :, 3]
+    m9, m11, m13, m14 = MUL[9], MUL[11], MUL[13], MUL[14]
+    out = np.empty_like(a)
+    out[:, :, 0] = m14[a0] ^ m11[a1] ^ m13[a2] ^ m9[a3]
+    out[:, :, 1] = m9[a0] ^ m14[a1] ^ m11[a2] ^ m13[a3]
+    out[:, :, 2] = m13[a0] ^ m9[a1] ^ m14[a2] ^ m11[a3]
+    out[:, :, 3] = m11[a0] ^ m13[a1] ^ m9[a2] ^ m14[a3]
+    return out.reshape(-1, 16)
+
+
+def _rounds(blocks, round_keys, tables, rows, sbox):
+    """
+    Run the 10 rounds on a batch
+
+    A middle round is four table gathers over (N, 4) byte columns XORed
+    together, i.e. (Inv)SubBytes, (Inv)ShiftRows and (Inv)MixColumns in one
+    pass, so the Python overhead is paid per round, not per block.
+    """
+    keys = round_keys.view('<u4')
+    state = as_blocks(blocks) ^ round_keys[0]
+    for rnd in range(1, ROUNDS):
+        columns = (tables[0][state.take(rows[0], axis=1)] ^ tables[1][state.take(rows[1], axis=1)]
+                   ^ tables[2][state.take(rows[2], axis=1)] ^ tables[3][state.take(rows[3], axis=1)]
+                   ^ keys[rnd])
+        state = columns.view(np.uint8)
+    return sbox[state.take(rows.T.reshape(-1), axis=1)] ^ round_keys[ROUNDS]
+
+
+def encrypt_blocks(blocks, key=RTL_KEY):
+    """
+    AES-128 encrypt a batch of blocks
+
+    Args:
+        blocks: (N, 16) uint8 array (or bytes, see as_blocks)
+        key: 16-byte key
+
+    Returns:
+        (N, 16) uint8 array of ciphertexts
+    """
+    round_keys, _ = expand_key(bytes(key))
+    return _rounds(blocks, round_keys, TE, _ENC_ROWS, SBOX)
+
+
+def decrypt_blocks(blocks, key=RTL_KEY):
+    """
+    AES-128 decrypt a batch of blocks, the operation of AES_Decrypt.v
+
+    Args:
+        blocks: (N, 16) uint8 array (or bytes, see as_blocks)
+        key: 16-byte key
+
+    Returns:
+        (N, 16) uint8 array of plaintexts
+    """
+    _, inverse_keys = expand_key(bytes(key))
+    return _rounds(blocks, inverse_keys, TD, _DEC_ROWS, INV_SBOX)
+
+
+def self_test():
+    """Check the FIPS-197 appendix C.1 AES-128 vector both ways"""
+    key = bytes.fromhex("000102030405060708090a0b0c0d0e0f")
+    plaintext = bytes.fromhex("00112233445566778899aabbccddeeff")
+    ciphertext = bytes.fromhex("69c4e0d86a7b0430d8cdb78070b4c55a")
+    return (encrypt_blocks(plaintext, key).tobytes() == ciphertext
+            and decrypt_blocks(ciphertext, key).tobytes() == plaintext)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch AES-128 reference model of the AES RTL')
+    parser.add_argument('--bench', type=int, default=0, metavar='N',
+                       help='Measure encrypt/decrypt throughput on N random blocks')
+    parser.add_argument('--decrypt', metavar='HEX', help='Decrypt one block under --key and print it')
+    parser.add_argument('--key', default=RTL_KEY.hex().upper(), help='Key in hex (default: the RTL key)')
+
+    args = parser.parse_args()
+
+    if not self_test():
+        print("❌ FIPS-197 self test failed")
+        sys.exit(1)
+    print("✅ FIPS-197 self test passed")
+
+    try:
+        key = bytes.fromhex(args.key)
+        if args.decrypt:
+            print(decrypt_blocks(bytes.fromhex(args.decrypt), key).tobytes().hex().upper())
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.bench > 0:
+        blocks = np.random.default_rng().integers(0, 256, size=(args.bench, 16), dtype=np.uint8)
+        for name, func in (("encrypt", encrypt_blocks), ("decrypt", decrypt_blocks)):
+            start_time = time.perf_counter()
+            result = func(blocks, key)
+            elapsed = time.perf_counter() - start_time
+            print(f"{name}: {args.bench} blocks in {elapsed:.3f} seconds ({args.bench / elapsed:,.0f} blocks/s)")
+        if not np.array_equal(decrypt_blocks(encrypt_blocks(blocks, key), key), blocks):
+            print("❌ Round trip mismatch")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from fsk_acquire import MIN_SCORE, PREAMBLE, acquire, frame_powers, otsu_threshold, soft_frames
+from fsk_decode import MESSAGE_BITS, combine_copies, extract_interleaved
+from fsk_demod import CENTER_FREQ, BAND_CENTER_MHZ, BANDWIDTH_MHZ, RAW_FORMATS, Capture, FskDemodulator
+from fsk_timing import band_envelope, fpga_symbol_time, matched_filter, recover_symbols
+from payload_reader import parse_payload
+
+CAPTURE_PATTERNS = ("*.wav", "*.cu8", "*.cs8", "*.cs16", "*.cf32")
+MAX_PAIRWISE = 2048  # largest message count for which the full Hamming distance matrix is built
+EPS = np.finfo(float).eps
+
+REPORT_COLUMNS = ["variant", "capture", "messages", "copies", "total_bits", "bit_errors", "ber",
+                  "ber_msg_mean", "ber_msg_std", "ber_msg_min", "ber_msg_max",
+                  "p_error_sent0", "p_error_sent1", "symmetry_diff", "channel_symmetry",
+                  "bursts", "burst_mean", "burst_max", "burst_std", "burstiness", "gap_mean", "gap_max",
+                  "position_ber_std", "worst_positions", "worst_position_ber",
+                  "inter_message_corr", "hamming_mean", "hamming_min",
+                  "capacity", "copy_success_rate", "runs", "expected_runs", "channel_model",
+                  "margin_mean", "error_margin_mean",
+                  "decoded_bit_errors", "decoded_ber", "decoded_success_rate",
+                  "threshold_db", "elapsed_s", "error"]
+
+
+def _std(values):
+    """Sample standard deviation like MATLAB std(), 0 for fewer than two values"""
+    return float(np.std(values, ddof=1)) if len(values) > 1 else 0.0
+
+
+def run_lengths(mask):
+    """
+    Lengths of the runs of True in each row of a boolean matrix
+
+    Every row is padded with False on both sides, so the run starts and ends
+    are the +1 and -1 steps of one diff over the whole matrix.
+    """
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    steps = np.diff(padded, axis=1).ravel()
+    return np.flatnonzero(steps == -1) - np.flatnonzero(steps == 1)
+
+
+def hamming_matrix(bits):
+    """Pairwise Hamming distances of (K, 128) bit rows as two matrix products"""
+    ones = bits.astype(np.float32)
+    return (ones @ (1 - ones).T + (1 - ones) @ ones.T).astype(np.int32)
+
+
+def characterize(messages, ref_bits):
+    """
+    Vectorized channel_characterization_func() of Receiver_Code.m
+
+    Like the MATLAB function, which is given the repeat copies pulled out by
+    extract5Messages, this measures the channel itself: pass the raw copies
+    of every message (extract_interleaved()), not the decoded messages.
+
+    Args:
+        messages: (K, 128) uint8 array of received copies
+        ref_bits: (128,) uint8 array of the reference bits
+
+    Returns:
+        dict of the statistics, keyed as REPORT_COLUMNS; the per-position
+        error counts are under "position_errors"
+    """
+    errors = messages != ref_bits
+    count, width = errors.shape
+    stats = {"copies": count, "total_bits": errors.size, "position_errors": errors.sum(axis=0)}
+    if count == 0:
+        return stats
+
+    # 1. Bit error rate
+    ber_per_msg = errors.mean(axis=1)
+    stats.update(bit_errors=int(errors.sum()), ber=float(errors.mean()), ber_msg_mean=float(ber_per_msg.mean()),
+                 ber_msg_std=_std(ber_per_msg), ber_msg_min=float(ber_per_msg.min()),
+                 ber_msg_max=float(ber_per_msg.max()))
+
+    # 2. Error probability per sent bit value: bincount of (sent bit, error) pairs
+    pairs = np.bincount((2 * np.broadcast_to(ref_bits, errors.shape) + errors).ravel(), minlength=4)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p0 = pairs[1] / (pairs[0] + pairs[1])
+        p1 = pairs[3] / (pairs[2] + pairs[3])
+    stats.update(p_error_sent0=float(p0), p_error_sent1=float(p1), symmetry_diff=float(abs(p0 - p1)),
+                 channel_symmetry="symmetric" if abs(p0 - p1) < 0.01 else "asymmetric")
+
+    # 3. Bursts (runs of errors) and error-free gaps
+    bursts = run_lengths(errors)
+    gaps = run_lengths(~errors)
+    if len(bursts):
+        burst_mean = float(bursts.mean())
+        stats.update(bursts=len(bursts), burst_mean=burst_mean, burst_max=int(bursts.max()), burst_std=_std(bursts),
+                     burstiness="random" if burst_mean < 1.5 else "moderate" if burst_mean < 3 else "high")
+    else:
+        stats.update(bursts=0)
+    if len(gaps):
+        stats.update(gap_mean=float(gaps.mean()), gap_max=int(gaps.max()))
+
+    # 4. Position-dependent errors
+    position_ber = stats["position_errors"] / count
+    # 1-based like MATLAB; left empty when no position has errors
+    worst = np.flatnonzero(position_ber == position_ber.max()) + 1 if position_ber.max() > 0 else []
+    stats.update(position_ber_std=_std(position_ber), worst_positions=" ".join(map(str, worst)),
+                 worst_position_ber=float(position_ber.max()))
+
+    # 5. Inter-message error correlation: mean off-diagonal Pearson correlation of the error rows.
+    # With z the centered unit-norm rows, the off-diagonal sum of the Gram matrix z z^T is
+    # |sum z|^2 - (number of rows); rows without variance are NaN in MATLAB and left out
+    centered = errors - errors.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(centered, axis=1)
+    z = centered[norms > 0] / norms[norms > 0, None]
+    if len(z) > 1:
+        total = z.sum(axis=0)
+        stats["inter_message_corr"] = float((total @ total - len(z)) / (len(z) * (len(z) - 1)))
+    # Similarity of the received messages: mean pairwise Hamming distance from the per-position
+    # ones counts (sum over pairs of c1 * (K - c1)), the full matrix only for moderate K
+    if count > 1:
+        ones = messages.sum(axis=0, dtype=np.int64)
+        stats["hamming_mean"] = float((ones * (count - ones)).sum() / (count * (count - 1) / 2))
+        if count <= MAX_PAIRWISE:
+            distances = hamming_matrix(messages)
+            stats["hamming_min"] = int(distances[~np.eye(count, dtype=bool)].min())
+
+    # 6. BSC capacity and message success
+    def binary_entropy(p):
+        return -p * np.log2(p + EPS) - (1 - p) * np.log2(1 - p + EPS)
+    capacity = 1 - (binary_entropy(p0) + binary_entropy(p1)) / 2
+    stats.update(capacity=float(capacity), copy_success_rate=float((ber_per_msg == 0).mean()))
+
+    # 7. Runs test over errors(:), i.e. column-major as MATLAB flattens it
+    flat = errors.T.ravel()
+    runs = 1 + int(np.count_nonzero(flat[1:] != flat[:-1]))
+    total_errors = stats["bit_errors"]
+    expected = 2 * total_errors * (flat.size - total_errors) / flat.size + 1
+    stats.update(runs=runs, expected_runs=float(expected),
+                 channel_model="BSC" if abs(runs - expected) < np.sqrt(expected) else "memory")
+    return stats
+
+
+def residual(decoded, ref_bits):
+    """Errors left after majority/soft decoding, as REPORT_COLUMNS decoded_* entries"""
+    errors = decoded != ref_bits
+    if not len(errors):
+        return {}
+    return {"decoded_bit_errors": int(errors.sum()), "decoded_ber": float(errors.mean()),
+            "decoded_success_rate": float((~errors.any(axis=1)).mean())}
+
+
+def margin_sums(margins, copy_errors):
+    """(sum, count) of the absolute frame margins, of all copy bits and of the wrong ones"""
+    margins = np.abs(margins)
+    return np.array([margins.sum(), margins.size, margins[copy_errors].sum(), copy_errors.sum()], dtype=np.float64)
+
+
+def margin_stats(sums):
+    """Mean absolute frame margin of all copy bits and of the wrong ones, from margin_sums()"""
+    stats = {}
+    if sums[1]:
+        stats["margin_mean"] = float(sums[0] / sums[1])
+    if sums[3]:
+        stats["error_margin_mean"] = float(sums[2] / sums[3])
+    return stats
+
+
+def decode_capture(path, options):
+    """
+    Demodulate a capture and extract the repeat copies of every message, as fsk_acquire.py / fsk_timing.py
+
+    Returns:
+        ((K, n, 128) uint8 copies (hard frame decisions), (K, n, 128) float32
+        frame margins, (K, 128) uint8 decoded messages, threshold in dB)
+    """
+    capture = Capture(path, options["format"], options["fs"], options["iq"])
+    repetition = options["repetition"]
+    threshold = options["trigger"]
+    if options["symbol_time_ms"]:
+        power_db, samples_per_symbol, _ = band_envelope(capture, fpga_symbol_time(options["symbol_time_ms"]),
+                                                        center_freq=options["center_freq"],
+                                                        band_center_mhz=options["band"])
+        if threshold is None:
+            threshold, _ = otsu_threshold(power_db)
+        symbols, _ = recover_symbols(matched_filter(soft_frames(power_db, threshold), samples_per_symbol),
+                                     samples_per_symbol, transition_density=0.5 / repetition)
+        result = acquire(symbols, repetition, options["preamble"], threshold=0.0, min_score=options["min_score"])
+    else:
+        demod = FskDemodulator(capture.fs, capture.is_complex, options["center_freq"], options["band"],
+                               options["bandwidth"])
+        result = acquire(frame_powers(capture, demod), repetition, options["preamble"], threshold=threshold,
+                         min_score=options["min_score"])
+        threshold = result["threshold"]
+    copies = extract_interleaved(result["bits"], result["starts"], repetition)
+    margins = extract_interleaved(result["margins"], result["starts"], repetition)
+    if options["soft"]:
+        decoded = combine_copies(extract_interleaved(result["soft"], result["starts"], repetition), soft=True)
+    else:
+        decoded = combine_copies(copies)
+    return copies, margins, decoded, threshold
+
+
+def analyze_capture(path, variant, options):
+    """
+    Process pool task: characterize the raw copies of one capture
+
+    Returns:
+        (report row, packed (K * n, 16) copy error matrix and packed (K, 16)
+        decoded error matrix for the aggregates)
+    """
+    start_time = time.perf_counter()
+    ref_bits = options["ref_bits"]
+    row = {"variant": variant, "capture": path, "messages": 0, "_margins": np.zeros(4)}
+    copy_errors = decoded_errors = np.zeros((0, MESSAGE_BITS // 8), dtype=np.uint8)
+    try:
+        copies, margins, decoded, threshold = decode_capture(path, options)
+        copies = copies.reshape(-1, MESSAGE_BITS)
+        errors = copies != ref_bits
+        row["_margins"] = margin_sums(margins.reshape(-1, MESSAGE_BITS), errors)
+        row.update(characterize(copies, ref_bits), messages=len(decoded), threshold_db=threshold,
+                   **margin_stats(row["_margins"]), **residual(decoded, ref_bits))
+        copy_errors = np.packbits(errors, axis=1)
+        decoded_errors = np.packbits(decoded != ref_bits, axis=1)
+    except (OSError, ValueError) as e:
+        row["error"] = str(e)
+    row["elapsed_s"] = round(time.perf_counter() - start_time, 3)
+    return row, copy_errors, decoded_errors
+
+
+def find_captures(root, patterns):
+    """Captures under root, grouped as {variant (subdirectory relative to root): [paths]}"""
+    variants = {}
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(root, "**", pattern), recursive=True):
+            variant = os.path.relpath(os.path.dirname(path), root)
+            variants.setdefault(variant, set()).add(path)
+    return {variant: sorted(paths) for variant, paths in sorted(variants.items())}
+
+
+def write_report(path, rows):
+    """Write the report rows as Parquet (.parquet, needs pyarrow) or CSV"""
+    if path.endswith('.parquet'):
+        table = pyarrow.Table.from_pylist([{c: row.get(c) for c in REPORT_COLUMNS} for row in rows])
+        pyarrow.parquet.write_table(table, path)
+        return
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_positions(path, rows):
+    """Write the error count of every bit position per capture and aggregate as CSV"""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["variant", "capture", "copies"] + [f"pos_{i}" for i in range(1, MESSAGE_BITS + 1)])
+        for row in rows:
+            if "position_errors" in row:
+                writer.writerow([row["variant"], row["capture"], row["copies"]] + row["position_errors"].tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel channel characterization of a capture archive')
+    parser.add_argument('root', help='Directory of captures; each subdirectory is reported as one variant')
+    parser.add_argument('--ref', required=True, help='Transmitted message (hex/binary)')
+    parser.add_argument('--pattern', action='append',
+                       help=f'Capture file pattern, repeatable (default: {" ".join(CAPTURE_PATTERNS)})')
+    parser.add_argument('--format', choices=['wav'] + list(RAW_FORMATS), help='Capture format (default: from extension)')
+    parser.add_argument('--fs', type=float, help='Sample rate in Hz (raw captures)')
+    parser.add_argument('--iq', action='store_true', help='Use 2-channel WAVs as I/Q instead of averaging to mono')
+    parser.add_argument('--center-freq', type=float, default=CENTER_FREQ,
+                       help=f'SDR center frequency in Hz (default: {CENTER_FREQ:g})')
+    parser.add_argument('--band', type=float, default=BAND_CENTER_MHZ,
+                       help=f'Mark tone band center in MHz (default: {BAND_CENTER_MHZ})')
+    parser.add_argument('--bandwidth', type=float, default=BANDWIDTH_MHZ,
+                       help=f'Band width in MHz (default: {BANDWIDTH_MHZ})')
+    parser.add_argument('--trigger', type=float, default=None,
+                       help='Fixed threshold in dB instead of the automatic one')
+    parser.add_argument('--symbol-time-ms', type=float, default=None,
+                       help='Recover the symbol timing for this symbol time (see fsk_timing.py) instead of 5 ms frames')
+    parser.add_argument('-n', '--repetition', type=int, default=5, help='Repetition factor (default: 5)')
+    parser.add_argument('--preamble', default=PREAMBLE, help=f'Message start pattern (default: {PREAMBLE})')
+    parser.add_argument('--min-score', type=float, default=MIN_SCORE,
+                       help=f'Normalized correlation needed to accept a preamble (default: {MIN_SCORE})')
+    parser.add_argument('--soft-decode', action='store_true',
+                       help='Soft-combine the repeats for the decoded_* columns (the channel statistics always use the hard copies)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                       help='Worker processes (default: number of CPUs)')
+    parser.add_argument('-o', '--output', default='channel_report.csv',
+                       help='Report file, .csv or .parquet (default: channel_report.csv)')
+    parser.add_argument('--positions', help='Also write per-position error counts as CSV to this file')
+
+    args = parser.parse_args()
+
+    if args.output.endswith('.parquet') and pyarrow is None:
+        print("Error: Parquet output needs pyarrow (pip install pyarrow), or use a .csv report")
+        sys.exit(1)
+    try:
+        reference = parse_payload(args.ref)[0]
+    except ValueError as e:
+        print(f"Error: Invalid --ref: {e}")
+        sys.exit(1)
+    if not os.path.isdir(args.root):
+        print(f"Error: {args.root} is not a directory")
+        sys.exit(1)
+
+    variants = find_captures(args.root, args.pattern or CAPTURE_PATTERNS)
+    total = sum(len(paths) for paths in variants.values())
+    if not total:
+        print(f"Error: No captures found under {args.root}")
+        sys.exit(1)
+
+    ref_bits = np.unpackbits(np.frombuffer(reference.to_bytes(MESSAGE_BITS // 8, 'big'), dtype=np.uint8))
+    options = {"format": args.format, "fs": args.fs, "iq": args.iq, "center_freq": args.center_freq,
+               "band": args.band, "bandwidth": args.bandwidth, "trigger": args.trigger,
+               "symbol_time_ms": args.symbol_time_ms, "repetition": args.repetition, "preamble": args.preamble,
+               "min_score": args.min_score, "soft": args.soft_decode, "ref_bits": ref_bits}
+
+    print(f"Characterizing {total} capture(s) in {len(variants)} variant(s) with {args.jobs} worker(s)")
+    start_time = time.perf_counter()
+    rows = []
+    errors_by_variant = {variant: [] for variant in variants}
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(analyze_capture, path, variant, options)
+                   for variant, paths in variants.items() for path in paths]
+        for done, future in enumerate(as_completed(futures), start=1):
+            row, copy_errors, decoded_errors = future.result()
+            rows.append(row)
+            errors_by_variant[row["variant"]].append((row, copy_errors, decoded_errors))
+            if row.get("error"):
+                status = f"❌ {row['error']}"
+            elif not row["messages"]:
+                status = "⚠️  no messages found"
+            else:
+                status = (f"✅ {row['messages']} messages, raw BER {row['ber']:.6f}, "
+                          f"decoded BER {row['decoded_ber']:.6f}")
+            print(f"[{done}/{total}] {row['capture']}: {status} ({row['elapsed_s']:.2f} s)")
+
+    def aggregate(variant, results):
+        # Error patterns are what the statistics need; received bits are rebuilt from the reference
+        copy_errors = np.unpackbits(np.concatenate([r[1] for r in results]), axis=1).astype(bool)
+        decoded_errors = np.unpackbits(np.concatenate([r[2] for r in results]), axis=1).astype(bool)
+        sums = np.sum([r[0]["_margins"] for r in results], axis=0)
+        return {"variant": variant, "capture": "*", "messages": len(decoded_errors),
+                **characterize(copy_errors ^ ref_bits.astype(bool), ref_bits), **margin_stats(sums),
+                **residual(decoded_errors ^ ref_bits.astype(bool), ref_bits)}
+
+    # Aggregates: the statistics of all messages of a variant (and of the archive) pooled
+    rows.sort(key=lambda row: (row["variant"], row["capture"]))
+    aggregates = [aggregate(variant, results) for variant, results in errors_by_variant.items()]
+    if len(variants) > 1:
+        aggregates.append(aggregate("*", [r for results in errors_by_variant.values() for r in results]))
+    rows.extend(aggregates)
+
+    try:
+        write_report(args.output, rows)
+        if args.positions:
+            write_positions(args.positions, rows)
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    elapsed = time.perf_counter() - start_time
+
+    print(f"\n{'='*60}")
+    print(f"CHANNEL CHARACTERIZATION SUMMARY")
+    print(f"{'='*60}")
+    for row in aggregates:
+        name = "all variants" if row["variant"] == "*" else row["variant"]
+        if not row["messages"]:
+            print(f"{name}: no messages")
+            continue
+        print(f"{name}: {row['messages']} messages ({row['copies']} raw copies), raw BER {row['ber']:.6f}, "
+              f"{100 * row['copy_success_rate']:.2f}% copies error-free, "
+              f"P(err|0) {row['p_error_sent0']:.4f} / P(err|1) {row['p_error_sent1']:.4f}, "
+              f"bursts {row.get('burstiness', 'none')}, model {row['channel_model']}")
+        print(f"{' ' * len(name)}  after decoding: BER {row['decoded_ber']:.6f}, "
+              f"{100 * row['decoded_success_rate']:.2f}% messages error-free")
+    print(f"Report: {args.output}" + (f", positions: {args.positions}" if args.positions else ""))
+    print(f"Elapsed time: {elapsed:.3f} seconds")
+
+if __name__ == "__main__":
+    main()
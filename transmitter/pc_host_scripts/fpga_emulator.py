@@ -0,0 +1,227 @@
+import argparse
+import heapq
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+from aes_reference import RTL_KEY, decrypt_blocks
+from serial_transport import ACK_WORD, CONF_SIZE, PACKET_SIZE, packet_airtime
+
+TRIGGER_WORD = bytes.fromhex("12341234123412341234123412341234")
+
+# Emulated top level -> size of the frames it receives
+MODES = {
+    "multi": CONF_SIZE,     # singing_fpga_top.v (main.py)
+    "sweep": CONF_SIZE,     # singing_fpga_top_sweep.v (main_sweep.py)
+    "basic": CONF_SIZE,     # singing_fpga_top_basic_fsk_modulation.v (main_modulation_bitstring.py on)
+    "key": PACKET_SIZE,     # singing_fpga_top_key_fsk_modulation.v (main_modulation_key.py)
+    "aes": PACKET_SIZE,     # singing_fpga_top_aes_fsk_modulation.v (main_modulation_key.py -aes)
+}
+
+
+def aes_plaintext(ciphertext):
+    """Plaintext returned by the emulated AES top level: the ciphertext decrypted under the RTL key"""
+    return decrypt_blocks(ciphertext, RTL_KEY).tobytes()
+
+
+class FpgaEmulator:
+    """
+    Pseudo-terminal stand-in for a Sakura-G board running one of the top levels
+
+    The slave end of a pty is exposed as `port` and can be opened by the host
+    scripts like COM9. Received bytes are cut into fixed-size frames exactly
+    like fsm_RX does, and answered with the timing of the real firmware:
+
+    - 2-byte modes echo the conf word immediately
+    - key mode answers 0xAAAA once the packet airtime has elapsed
+    - aes mode answers plaintext + 0xAAAA as soon as the block is decrypted;
+      the trigger word additionally keeps the modulator busy for the airtime
+
+    Packets completing while the modulator is busy are dropped, as the top
+    levels only look at the fsm_RX valid pulse in IDLE. POSIX only.
+
+    Args:
+        mode: One of MODES
+        ack_scale: Multiplier applied to the airtime before acking (0 = instant)
+        ack_delay: Extra fixed delay in seconds added to every response
+        drop_rate: Probability of silently dropping a response
+        garbage_rate: Probability of sending random garbage bytes before a response
+        seed: Seed for the fault injection random generator
+        verbose: Print every transaction
+    """
+
+    def __init__(self, mode="key", ack_scale=1.0, ack_delay=0.0, drop_rate=0.0,
+                 garbage_rate=0.0, seed=None, verbose=False):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode '{mode}', expected one of {', '.join(MODES)}")
+        self.mode = mode
+        self.frame_size = MODES[mode]
+        self.ack_scale = ack_scale
+        self.ack_delay = ack_delay
+        self.drop_rate = drop_rate
+        self.garbage_rate = garbage_rate
+        self.verbose = verbose
+        self.rng = random.Random(seed)
+
+        self.stats = {"frames": 0, "responses": 0, "dropped_acks": 0,
+                      "garbage": 0, "busy_drops": 0}
+        self._buffer = b""
+        self._outbox = []          # heap of (due time, sequence, bytes)
+        self._sequence = 0
+        self._busy_until = 0.0
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._stop_r, self._stop_w = None, None
+        self.port = None
+
+    def open(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        return self.port
+
+    def close(self):
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    def start(self):
+        """Open the pty and serve it from a background thread"""
+        if self._master is None:
+            self.open()
+        self._stop_r, self._stop_w = os.pipe()
+        self._thread = threading.Thread(target=self.serve_forever, name="fpga-emulator", daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        if self._thread is not None:
+            os.write(self._stop_w, b"x")
+            self._thread.join()
+            os.close(self._stop_r)
+            os.close(self._stop_w)
+            self._thread = None
+        self.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _log(self, message):
+        if self.verbose:
+            print(f"[emulator {time.monotonic():.6f}] {message}", flush=True)
+
+    def _schedule(self, due, data):
+        heapq.heappush(self._outbox, (due, self._sequence, data))
+        self._sequence += 1
+
+    def _respond(self, now, delay, data):
+        if self.rng.random() < self.drop_rate:
+            self.stats["dropped_acks"] += 1
+            self._log("response dropped")
+            return
+        due = now + delay + self.ack_delay
+        if self.rng.random() < self.garbage_rate:
+            garbage = bytes(self.rng.randrange(256) for _ in range(self.rng.randint(1, self.frame_size)))
+            self.stats["garbage"] += 1
+            self._log(f"garbage {garbage.hex().upper()}")
+            self._schedule(due, garbage)
+        self._schedule(due, data)
+
+    def handle_frame(self, frame, now):
+        """Emulate the top level's reaction to one complete fsm_RX frame"""
+        self.stats["frames"] += 1
+        if self.frame_size == CONF_SIZE:
+            self._log(f"conf {frame.hex().upper()}")
+            self._respond(now, 0.0, frame)
+            return
+
+        if now < self._busy_until:
+            self.stats["busy_drops"] += 1
+            self._log(f"packet {frame.hex().upper()} dropped, modulator busy")
+            return
+
+        airtime = packet_airtime(frame) * self.ack_scale
+        self._log(f"packet {frame.hex().upper()} airtime {airtime * 1000:.3f} ms")
+        status = ACK_WORD.to_bytes(2, byteorder='big')
+        if self.mode == "key":
+            self._busy_until = now + airtime
+            self._respond(now, airtime, status)
+        else:
+            if frame[:16] == TRIGGER_WORD:
+                self._busy_until = now + airtime
+            self._respond(now, 0.0, aes_plaintext(frame[:16]) + status)
+
+    def serve_forever(self):
+        stop_fds = [self._stop_r] if self._stop_r is not None else []
+        while True:
+            now = time.monotonic()
+            while self._outbox and self._outbox[0][0] <= now:
+                _, _, data = heapq.heappop(self._outbox)
+                os.write(self._master, data)
+                self.stats["responses"] += 1
+
+            timeout = max(0.0, self._outbox[0][0] - now) if self._outbox else None
+            readable, _, _ = select.select([self._master] + stop_fds, [], [], timeout)
+            if self._stop_r in readable:
+                return
+            if self._master in readable:
+                try:
+                    self._buffer += os.read(self._master, 4096)
+                except OSError:
+                    # Raised on some platforms while no process holds the slave end open
+                    time.sleep(0.01)
+                    continue
+                now = time.monotonic()
+                while len(self._buffer) >= self.frame_size:
+                    frame, self._buffer = self._buffer[:self.frame_size], self._buffer[self.frame_size:]
+                    self.handle_frame(frame, now)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pseudo-terminal emulator of the FPGA UART protocols')
+    parser.add_argument('mode', choices=sorted(MODES), help='Top level to emulate')
+    parser.add_argument('--ack-scale', type=float, default=1.0,
+                       help='Multiplier on the real airtime before the ack (0 = instant, default: 1)')
+    parser.add_argument('--ack-delay-ms', type=float, default=0.0,
+                       help='Extra delay added to every response in milliseconds')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='Probability of dropping a response')
+    parser.add_argument('--garbage-rate', type=float, default=0.0,
+                       help='Probability of sending garbage bytes before a response')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for fault injection')
+    parser.add_argument('--link', help='Create a symlink to the pty at this path (e.g. /tmp/fpga0)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print every transaction')
+
+    args = parser.parse_args()
+
+    emulator = FpgaEmulator(args.mode, args.ack_scale, args.ack_delay_ms / 1000, args.drop_rate,
+                            args.garbage_rate, args.seed, args.verbose)
+    port = emulator.open()
+    if args.link:
+        if os.path.islink(args.link):
+            os.unlink(args.link)
+        os.symlink(port, args.link)
+        port = args.link
+
+    print(f"Emulating '{args.mode}' top level on {port}", flush=True)
+    print(f"Use it with e.g.: python main_modulation_key.py key.txt 1.0 -p {port}", flush=True)
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.close()
+        if args.link and os.path.islink(args.link):
+            os.unlink(args.link)
+        print(f"\nEmulator stats: {emulator.stats}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from fsk_decode import MESSAGE_BITS, bit_errors, decode_messages, frame_margins
+from fsk_demod import (CENTER_FREQ, BAND_CENTER_MHZ, BANDWIDTH_MHZ, BLOCK_SAMPLES, RATIO_DB, RAW_FORMATS,
+                       SPACE_BAND_MHZ, Capture, FskDemodulator)
+from payload_reader import parse_payload
+from spectrogram_cache import DEFAULT_CACHE_DIR, SpectrogramCache, band_power_from_spectrogram, cached_spectrogram
+
+PREAMBLE = "10101010"  # first byte (0xAA) of the reference key, see trigger_check()
+MIN_SCORE = 0.8        # normalized correlation needed to accept a preamble
+HISTOGRAM_BINS = 256
+
+
+def frame_powers(capture, demod):
+    """
+    Decision value of every frame of a capture, demodulated in blocks of about BLOCK_SAMPLES
+
+    Returns: Mark band power in dB, or the mark/space ratio in dB for a demodulator with ratio_db set
+    """
+    block_samples = max(1, BLOCK_SAMPLES // demod.frame_len) * demod.frame_len
+    return np.concatenate([demod.decision_values(demod.process(block)[1]) for block in capture.blocks(block_samples)]
+                          or [np.zeros(0)])
+
+
+def otsu_threshold(values, bins=HISTOGRAM_BINS):
+    """
+    Pick the threshold that best splits values into two classes (Otsu's method)
+
+    The between-class variance is evaluated for every histogram bin edge at
+    once from cumulative sums.
+
+    Args:
+        values: Frame powers in dB
+        bins: Histogram resolution
+
+    Returns:
+        (threshold, separability) - separability is the between-class share of
+        the total variance, close to 1 for a clean on/off keyed capture
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) < 2 or values.min() == values.max():
+        raise ValueError("Need at least two distinct finite frame powers to pick a threshold")
+    counts, edges = np.histogram(values, bins=bins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    p = counts / counts.sum()
+    w0 = np.cumsum(p)[:-1]
+    mu0_sum = np.cumsum(p * centers)[:-1]
+    total_mean = float((p * centers).sum())
+    w1 = 1.0 - w0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (total_mean * w0 - mu0_sum) ** 2 / (w0 * w1)
+    between[~np.isfinite(between)] = 0.0
+    split = int(np.argmax(between))
+    total_var = float((p * (centers - total_mean) ** 2).sum())
+    return float(edges[split + 1]), float(between[split] / total_var) if total_var > 0 else 0.0
+
+
+def soft_frames(power_db, threshold):
+    """
+    Map frame powers to soft values in [-1, 1]
+
+    Each side of the threshold is scaled by the distance to its class mean,
+    so frames at or beyond a class mean saturate at -1 or +1 even when the
+    threshold is not halfway between the classes.
+    """
+    power_db = np.asarray(power_db, dtype=np.float64)
+    low, high = power_db[power_db <= threshold], power_db[power_db > threshold]
+    low_scale = threshold - low.mean() if len(low) else 1.0
+    high_scale = high.mean() - threshold if len(high) else 1.0
+    offset = power_db - threshold
+    return np.clip(offset / np.where(offset > 0, high_scale, low_scale), -1.0, 1.0)
+
+
+def preamble_template(preamble, repetition):
+    """Expected frame sequence of the preamble as +/-1 values, each bit repeated `repetition` times"""
+    bits = np.frombuffer(preamble.encode('ascii'), dtype=np.uint8) - ord('0')
+    return np.repeat(2.0 * bits - 1.0, repetition)
+
+
+def cross_correlate(stream, template):
+    """
+    Correlate a frame stream with a template at every offset at once
+
+    Computed as a product of real FFTs padded to a power of two, so the cost
+    is O(F log F) for all F offsets instead of O(F * len(template)).
+
+    Returns:
+        Array of len(stream) - len(template) + 1 scores, sum(stream[k + i] * template[i]) / len(template)
+    """
+    stream = np.asarray(stream, dtype=np.float64)
+    length = len(stream) - len(template) + 1
+    if length <= 0:
+        return np.zeros(0)
+    nfft = 1 << int(np.ceil(np.log2(len(stream) + len(template) - 1)))
+    spectrum = np.fft.rfft(stream, nfft) * np.conj(np.fft.rfft(template, nfft))
+    return np.fft.irfft(spectrum, nfft)[:length] / len(template)
+
+
+def find_message_starts(score, repetition, message_frames, min_score=MIN_SCORE):
+    """
+    Pick message start frames from the correlation scores
+
+    Walks through the offsets scoring at least `min_score` in time order,
+    takes the best offset within one repetition of each, then skips the rest
+    of that message so that preamble-like data inside it is not mistaken for
+    a new start.
+
+    Returns: list of 0-based start frame indices
+    """
+    candidates = np.flatnonzero(score >= min_score)
+    starts = []
+    i = 0
+    while i < len(candidates):
+        first = int(candidates[i])
+        start = first + int(np.argmax(score[first:first + repetition]))
+        starts.append(start)
+        i = int(np.searchsorted(candidates, start + message_frames))
+    return starts
+
+
+def acquire(power_db, repetition, preamble=PREAMBLE, message_bits=MESSAGE_BITS, threshold=None,
+            min_score=MIN_SCORE, soft=True):
+    """
+    Acquire the threshold and the message starts of a capture
+
+    Args:
+        power_db: Band power per frame in dB
+        repetition: Repetition factor of the transmitter
+        preamble: Bit pattern starting every message
+        message_bits: Bits per message
+        threshold: Fixed threshold in dB, or None to pick it with otsu_threshold()
+        min_score: Normalized correlation needed to accept a preamble
+        soft: Correlate the soft frame values instead of the hard bits
+
+    Returns:
+        dict with threshold, separability (None for a fixed threshold), bits,
+        margins (frame_margins()), soft (soft_frames() values), score and
+        starts (0-based frame indices of complete messages)
+    """
+    separability = None
+    if threshold is None:
+        threshold, separability = otsu_threshold(power_db)
+    bits = (power_db > threshold).astype(np.uint8)
+    soft_values = soft_frames(power_db, threshold)
+    stream = soft_values if soft else 2.0 * bits - 1.0
+    score = cross_correlate(stream, preamble_template(preamble, repetition))
+    message_frames = message_bits * repetition
+    starts = [s for s in find_message_starts(score, repetition, message_frames, min_score)
+              if s + message_frames <= len(bits)]
+    return {"threshold": threshold, "separability": separability, "bits": bits,
+            "margins": frame_margins(power_db, threshold), "soft": soft_values, "score": score, "starts": starts}
+
+
+def report_messages(result, repetition, reference=None, output=None, soft=False, packed_output=None):
+    """
+    Decode, print and optionally save the messages found by acquire()
+
+    Args:
+        result: acquire() result
+        repetition: Repetition factor
+        reference: Expected 128-bit value to count bit errors against, or None
+        output: Path to write the messages to as JSON lines, or None
+        soft: Soft-combine the repeats instead of majority voting, see fsk_decode.soft_decode()
+        packed_output: Path to write the messages to as consecutive 16-byte records, or None
+
+    Returns:
+        (N, 16) uint8 array of the decoded messages
+    """
+    frames = result["soft"] if soft else result["bits"]
+    decoded = decode_messages(frames, result["starts"], repetition, soft=soft)
+    errors = bit_errors(decoded, reference) if reference is not None else None
+    if packed_output:
+        decoded.tofile(packed_output)
+
+    out = open(output, 'w') if output else None
+    try:
+        for k, start in enumerate(result["starts"]):
+            # start_index in Receiver_Code.m is 1-based
+            record = {"start_index": start + 1, "score": round(float(result["score"][start]), 4),
+                      "message": decoded[k].tobytes().hex().upper()}
+            line = f"  start_index {start + 1:>8} (score {record['score']:.3f}): {record['message']}"
+            if errors is not None:
+                record["bit_errors"] = int(errors[k])
+                line += " ✅" if errors[k] == 0 else f" ❌ {errors[k]} bit errors"
+            print(line)
+            if out is not None:
+                out.write(json.dumps(record) + "\n")
+    finally:
+        if out is not None:
+            out.close()
+
+    if errors is not None and len(errors):
+        checked = len(errors) * MESSAGE_BITS
+        print(f"Bit errors: {int(errors.sum())}/{checked} ({100 * (1 - errors.sum() / checked):.2f}% success), "
+              f"{int((errors == 0).sum())}/{len(errors)} messages error-free ({'soft' if soft else 'hard'} decoding)")
+    return decoded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Automatic threshold and message acquisition for FSK captures')
+    parser.add_argument('capture', help='WAV or raw interleaved IQ capture')
+    parser.add_argument('--format', choices=['wav'] + list(RAW_FORMATS), help='Capture format (default: from extension)')
+    parser.add_argument('--fs', type=float, help='Sample rate in Hz (raw captures)')
+    parser.add_argument('--iq', action='store_true', help='Use a 2-channel WAV as I/Q instead of averaging to mono')
+    parser.add_argument('--center-freq', type=float, default=CENTER_FREQ,
+                       help=f'SDR center frequency in Hz (default: {CENTER_FREQ:g})')
+    parser.add_argument('--band', type=float, default=BAND_CENTER_MHZ,
+                       help=f'Mark tone band center in MHz (default: {BAND_CENTER_MHZ})')
+    parser.add_argument('--bandwidth', type=float, default=BANDWIDTH_MHZ,
+                       help=f'Band width in MHz (default: {BANDWIDTH_MHZ})')
+    parser.add_argument('--trigger', type=float, default=None,
+                       help='Fixed threshold in dB (of the mark/space ratio with --space-band) instead of the automatic one')
+    parser.add_argument('--space-band', type=float, nargs='?', const=SPACE_BAND_MHZ, default=None,
+                       help=f'Decide on the mark/space tone power ratio, with the space band in MHz '
+                            f'(default when given: {SPACE_BAND_MHZ})')
+    parser.add_argument('-n', '--repetition', type=int, default=5, help='Repetition factor (default: 5)')
+    parser.add_argument('--preamble', default=PREAMBLE, help=f'Message start pattern (default: {PREAMBLE})')
+    parser.add_argument('--min-score', type=float, default=MIN_SCORE,
+                       help=f'Normalized correlation needed to accept a preamble (default: {MIN_SCORE})')
+    parser.add_argument('--hard', action='store_true', help='Correlate hard bits instead of soft frame values')
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_DIR, default=None, metavar='DIR',
+                       help=f'Reuse the spectrogram from a persistent cache (default DIR: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--cache-span', type=float, default=None, metavar='MHZ',
+                       help='Cache only the bins within +- MHZ/2 of the center frequency (default: all)')
+    parser.add_argument('--soft-decode', action='store_true',
+                       help='Weight each repeat by its distance from the threshold instead of majority voting')
+    parser.add_argument('--ref', help='Expected message (hex/binary) to count bit errors against')
+    parser.add_argument('-o', '--output', help='Write the messages as JSON lines to this file')
+    parser.add_argument('--packed', help='Write the messages as consecutive 16-byte records to this file')
+
+    args = parser.parse_args()
+
+    if not args.preamble or args.preamble.strip('01'):
+        print("Error: --preamble must be a string of 0/1")
+        sys.exit(1)
+    try:
+        reference = parse_payload(args.ref)[0] if args.ref else None
+        capture = Capture(args.capture, args.format, args.fs, args.iq)
+        ratio_db = RATIO_DB if args.space_band is not None else None
+        demod = FskDemodulator(capture.fs, capture.is_complex, args.center_freq, args.band, args.bandwidth,
+                               space_band_mhz=args.space_band, ratio_db=ratio_db)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    start_time = time.perf_counter()
+    try:
+        if args.cache:
+            spectrum, freqs_mhz, hit = cached_spectrogram(SpectrogramCache(args.cache), capture,
+                                                          center_freq=args.center_freq, span_mhz=args.cache_span)
+            print(f"Spectrogram cache {'hit' if hit else 'miss'}: {spectrum.shape[0]} frames x {spectrum.shape[1]} bins")
+            power_db = band_power_from_spectrogram(spectrum, freqs_mhz, args.band, args.bandwidth)
+            if ratio_db is not None:
+                power_db -= band_power_from_spectrogram(spectrum, freqs_mhz, args.space_band, args.bandwidth)
+        else:
+            power_db = frame_powers(capture, demod)
+        result = acquire(power_db, args.repetition, args.preamble, threshold=args.trigger,
+                         min_score=args.min_score, soft=not args.hard)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    elapsed = time.perf_counter() - start_time
+
+    print(f"Capture: {args.capture}, {capture.fs:g} Hz, {capture.duration:.3f} seconds, {len(power_db)} frames")
+    kind = "mark/space ratio, " if ratio_db is not None else ""
+    if result["separability"] is None:
+        print(f"Threshold: {result['threshold']:.4f} dB ({kind}fixed)")
+    else:
+        print(f"Threshold: {result['threshold']:.4f} dB ({kind}Otsu, separability {result['separability']:.3f})")
+        if result["separability"] < 0.5:
+            print("⚠️  Frame powers are not clearly bimodal, the threshold may be unreliable")
+    print(f"Preamble {args.preamble} x{args.repetition}: {len(result['starts'])} complete message(s)")
+    report_messages(result, args.repetition, reference, args.output, args.soft_decode, args.packed)
+    print(f"Elapsed time: {elapsed:.3f} seconds")
+
+if __name__ == "__main__":
+    main()
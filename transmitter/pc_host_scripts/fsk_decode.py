@@ -0,0 +1,186 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+MESSAGE_BITS = 128
+BATCH_MESSAGES = 1 << 15  # messages gathered per batch, bounds the temporary (batch, 128, n) arrays
+
+# Set bits per byte value, for counting bit errors in packed messages
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def frame_margins(power_db, threshold):
+    """Signed distance of each frame power from the threshold in dB, positive for a 1 decision"""
+    return np.asarray(power_db, dtype=np.float32) - np.float32(threshold)
+
+
+def _group_sums(values, repetition, dtype):
+    """Sum groups of `repetition` consecutive values along the last axis, dropping an incomplete last group"""
+    values = np.asarray(values)
+    usable = values.shape[-1] // repetition * repetition
+    groups = values[..., :usable].reshape(values.shape[:-1] + (-1, repetition))
+    # Adding the n strided slices is several times faster than a sum over a short last axis
+    total = groups[..., 0].astype(dtype)
+    for k in range(1, repetition):
+        total += groups[..., k]
+    return total
+
+
+def majority_decode(bits, repetition):
+    """
+    Majority-decode groups of `repetition` consecutive frame bits (repetition_code_decoder)
+
+    Works on the last axis, so a (N, 128 * n) batch decodes to (N, 128) in
+    one reshape and sum. A trailing incomplete group is ignored; ties decode
+    to 0 as in Receiver_Code.m.
+    """
+    return (2 * _group_sums(bits, repetition, np.int16) > repetition).astype(np.uint8)
+
+
+def soft_decode(values, repetition):
+    """
+    Soft-combine groups of `repetition` consecutive frames
+
+    Each repeat votes with its signed distance from the threshold (frame
+    margins or soft_frames() values) instead of a hard 0/1, so a clear repeat
+    outweighs several that barely crossed the threshold. Sums of exactly 0
+    decode to 0, like hard ties.
+    """
+    return (_group_sums(values, repetition, np.float32) > 0).astype(np.uint8)
+
+
+def gather_messages(frames, starts, repetition, message_bits=MESSAGE_BITS):
+    """
+    Gather the frames of several messages into one array
+
+    Args:
+        frames: Frame bits or soft values
+        starts: 0-based start frame of every message
+        repetition: Repetition factor
+
+    Returns:
+        (len(starts), message_bits * repetition) array
+    """
+    # Row selection on a strided window view copies each message as one contiguous run,
+    # without building an index per frame
+    windows = np.lib.stride_tricks.sliding_window_view(frames, message_bits * repetition)
+    return windows[np.asarray(starts, dtype=np.int64)]
+
+
+def decode_messages(frames, starts, repetition, soft=False, message_bits=MESSAGE_BITS):
+    """
+    Decode many messages to packed bytes
+
+    Messages are gathered and decoded BATCH_MESSAGES at a time, so memory is
+    bounded for millions of messages.
+
+    Args:
+        frames: Frame bits (hard decoding) or signed soft values (soft decoding)
+        starts: 0-based start frame of every message, each with message_bits * repetition frames available
+        repetition: Repetition factor
+        soft: Soft-combine the repeats, see soft_decode()
+
+    Returns:
+        (len(starts), message_bits / 8) uint8 array, MSB first like the modulator
+    """
+    decode = soft_decode if soft else majority_decode
+    starts = np.asarray(starts, dtype=np.int64)
+    packed = np.empty((len(starts), message_bits // 8), dtype=np.uint8)
+    for first in range(0, len(starts), BATCH_MESSAGES):
+        batch = starts[first:first + BATCH_MESSAGES]
+        packed[first:first + len(batch)] = np.packbits(
+            decode(gather_messages(frames, batch, repetition, message_bits), repetition), axis=1)
+    return packed
+
+
+def extract_interleaved(frames, starts, repetition=5, message_bits=MESSAGE_BITS):
+    """
+    Split every message into its `repetition` raw copies (extract5Messages)
+
+    Copy k of the message starting at frame s takes every repetition-th frame
+    from s + k, i.e. bit j of copy k is frame s + j * repetition + k.
+
+    Returns: (len(starts), repetition, message_bits) array
+    """
+    messages = gather_messages(frames, starts, repetition, message_bits)
+    return messages.reshape(len(messages), message_bits, repetition).transpose(0, 2, 1)
+
+
+def combine_copies(copies, soft=False):
+    """
+    Decode messages from several received copies (majority_vote_ecc)
+
+    Args:
+        copies: (..., K, message_bits) bits, or signed soft values with soft=True
+
+    Returns:
+        (..., message_bits) uint8 bits; hard ties decode to 0
+    """
+    copies = np.asarray(copies)
+    if soft:
+        return (copies.sum(axis=-2) > 0).astype(np.uint8)
+    return (2 * copies.sum(axis=-2, dtype=np.int32) > copies.shape[-2]).astype(np.uint8)
+
+
+def bit_errors(packed, reference):
+    """
+    Count bit errors of packed messages
+
+    Args:
+        packed: (N, 16) uint8 array from decode_messages()
+        reference: Expected message as a 128-bit integer or 16 bytes
+
+    Returns:
+        (N,) array of error counts
+    """
+    if isinstance(reference, int):
+        reference = reference.to_bytes(packed.shape[1], byteorder='big')
+    return POPCOUNT[packed ^ np.frombuffer(reference, dtype=np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch hard/soft repetition decoder benchmark')
+    parser.add_argument('--messages', type=int, default=1_000_000, help='Messages to decode (default: 1000000)')
+    parser.add_argument('--sigma', type=float, default=0.6,
+                       help='Noise standard deviation of the +/-1 soft frame values (default: 0.6)')
+    parser.add_argument('--max-repetition', type=int, default=5, help='Largest repetition factor (default: 5)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    args = parser.parse_args()
+
+    if args.messages <= 0 or args.max_repetition <= 0 or args.sigma <= 0:
+        print("Error: --messages, --max-repetition and --sigma must be positive")
+        sys.exit(1)
+
+    rng = np.random.default_rng(args.seed)
+    reference = rng.integers(0, 256, MESSAGE_BITS // 8, dtype=np.uint8)
+    ref_bits = np.unpackbits(reference)
+    print(f"{args.messages} messages of {MESSAGE_BITS} bits, soft frame values +/-1 with noise sigma {args.sigma}")
+    print(f"{'n':>3} {'hard success':>13} {'soft success':>13} {'hard time':>10} {'soft time':>10} "
+          f"{'hard msg/s':>12} {'soft msg/s':>12}")
+    for repetition in range(1, args.max_repetition + 1):
+        frames_per_message = MESSAGE_BITS * repetition
+        chunk = max(1, (1 << 24) // frames_per_message)  # keep the simulated frames around 128 MB
+        hard_ok = soft_ok = 0
+        hard_time = soft_time = 0.0
+        for first in range(0, args.messages, chunk):
+            count = min(chunk, args.messages - first)
+            clean = np.tile(np.repeat(2.0 * ref_bits - 1.0, repetition), count).astype(np.float32)
+            values = clean + rng.standard_normal(len(clean), dtype=np.float32) * np.float32(args.sigma)
+            starts = np.arange(count) * frames_per_message
+            start_time = time.perf_counter()
+            hard = decode_messages((values > 0).astype(np.uint8), starts, repetition)
+            hard_time += time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            soft = decode_messages(values, starts, repetition, soft=True)
+            soft_time += time.perf_counter() - start_time
+            hard_ok += int((bit_errors(hard, reference.tobytes()) == 0).sum())
+            soft_ok += int((bit_errors(soft, reference.tobytes()) == 0).sum())
+        print(f"{repetition:>3} {100 * hard_ok / args.messages:>12.2f}% {100 * soft_ok / args.messages:>12.2f}% "
+              f"{hard_time:>9.2f}s {soft_time:>9.2f}s {args.messages / max(hard_time, 1e-9):>12,.0f} "
+              f"{args.messages / max(soft_time, 1e-9):>12,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,471 @@
+import argparse
+import struct
+import sys
+import time
+
+import numpy as np
+
+# Defaults of receiver/Receiver_Code.m
+CENTER_FREQ = 935.5e6        # SDR center frequency in Hz
+BAND_CENTER_MHZ = 935.502    # bandpass_filter(f_abs_MHz, power_dB(:,k), 935.502, 0.001)
+BANDWIDTH_MHZ = 0.001
+DT_TARGET = 0.005            # 5 ms frames, no overlap
+TRIGGER = -23.7754           # bit = 1 if the band max power exceeds trigger + epsilon (dB)
+EPS = np.finfo(float).eps    # pow2db(P + eps)
+SPACE_BAND_MHZ = 888.0       # space tone of the key/AES top levels (pll_888)
+RATIO_DB = 0.0               # dual-tone mode: bit = 1 if the mark band exceeds the space band by more than this (dB)
+
+DETECTORS = ("goertzel", "fft")
+BLOCK_SAMPLES = 1 << 22      # default processing block, bounds memory at any sample rate
+
+# Interleaved complex raw formats: dtype, offset, scale to [-1, 1)
+RAW_FORMATS = {
+    "cu8": (np.uint8, 127.5, 1 / 127.5),     # rtl_sdr / rtl_tcp
+    "cs8": (np.int8, 0.0, 1 / 128),          # HackRF
+    "cs16": (np.dtype('<i2'), 0.0, 1 / 32768),
+    "cf32": (np.dtype('<f4'), 0.0, 1.0),
+}
+
+
+def raw_to_complex(data, fmt):
+    """
+    Convert interleaved raw IQ bytes to complex samples
+
+    Args:
+        data: bytes-like object holding whole I/Q pairs
+        fmt: One of RAW_FORMATS
+
+    Returns:
+        complex128 array
+    """
+    dtype, offset, scale = RAW_FORMATS[fmt]
+    raw = np.frombuffer(data, dtype=dtype).reshape(-1, 2)
+    samples = np.empty(len(raw), dtype=np.complex128)
+    samples.real = raw[:, 0]
+    samples.imag = raw[:, 1]
+    if offset:
+        samples -= offset * (1 + 1j)
+    samples *= scale
+    return samples
+
+
+def complex_to_raw(samples, fmt):
+    """
+    Convert complex samples to interleaved raw IQ bytes, the inverse of raw_to_complex()
+
+    Values beyond the range of an integer format are clipped.
+
+    Args:
+        samples: Complex array, full scale at magnitude 1 per component
+        fmt: One of RAW_FORMATS
+
+    Returns:
+        bytes of len(samples) I/Q pairs
+    """
+    dtype, offset, scale = RAW_FORMATS[fmt]
+    dtype = np.dtype(dtype)
+    # complex64 memory is already interleaved I/Q, and float32 holds every 8/16-bit value exactly
+    raw = np.ascontiguousarray(samples, dtype=np.complex64).view(np.float32)
+    if dtype.kind == 'f':
+        return raw.astype(dtype).tobytes()
+    raw = raw / np.float32(scale)
+    if offset:
+        raw += np.float32(offset)
+    info = np.iinfo(dtype)
+    return np.clip(np.rint(raw, out=raw), info.min, info.max, out=raw).astype(dtype).tobytes()
+
+
+class Capture:
+    """
+    Memory-mapped sample source (WAV or raw interleaved IQ)
+
+    Samples are converted block by block, so only `block_samples` of them
+    exist as floats at any time whatever the length of the capture.
+
+    WAV files are scaled like MATLAB's audioread and, as in Receiver_Code.m,
+    multi-channel files are averaged to mono unless iq=True, which combines
+    a 2-channel file into I + jQ instead. Raw files are always complex.
+
+    Args:
+        path: Capture file
+        fmt: 'wav' or one of RAW_FORMATS (default: from the file extension)
+        fs: Sample rate in Hz, required for raw files
+        iq: Treat a 2-channel WAV as I/Q
+    """
+
+    def __init__(self, path, fmt=None, fs=None, iq=False):
+        self.path = path
+        fmt = fmt or ('wav' if path.lower().endswith('.wav') else path.rsplit('.', 1)[-1].lower())
+        if fmt == 'wav':
+            self.fs, dtype, offset, self._offset, self._scale, channels, count = read_wav_header(path)
+            if iq and channels != 2:
+                raise ValueError(f"I/Q mode needs a 2-channel WAV, {path} has {channels}")
+            self._complex = iq
+        elif fmt in RAW_FORMATS:
+            if not fs:
+                raise ValueError(f"Sample rate (--fs) is required for raw {fmt} captures")
+            dtype, self._offset, self._scale = RAW_FORMATS[fmt]
+            dtype = np.dtype(dtype)
+            self.fs = fs
+            channels, offset, self._complex = 2, 0, True
+            count = None
+        else:
+            raise ValueError(f"Unknown capture format '{fmt}', expected wav or one of {', '.join(RAW_FORMATS)}")
+
+        data = np.memmap(path, dtype=dtype, mode='r', offset=offset)
+        count = len(data) // channels if count is None else min(count, len(data) // channels)
+        self._data = data[:count * channels].reshape(count, channels)
+        self.fmt = fmt
+        self.channels = channels
+
+    @property
+    def is_complex(self):
+        return self._complex
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def duration(self):
+        return len(self) / self.fs
+
+    def _convert(self, raw):
+        if self._complex:
+            samples = np.empty(len(raw), dtype=np.complex128)
+            samples.real = raw[:, 0]
+            samples.imag = raw[:, 1]
+            if self._offset:
+                samples -= self._offset * (1 + 1j)
+            samples *= self._scale
+            return samples
+        # Channel mean as (sum - channels * offset) * scale / channels; np.add over the
+        # strided columns is several times faster than raw.sum(axis=1) on interleaved data
+        samples = raw[:, 0].astype(np.float64)
+        for channel in range(1, self.channels):
+            np.add(samples, raw[:, channel], out=samples)
+        if self._offset:
+            samples -= self.channels * self._offset
+        samples *= self._scale / self.channels
+        return samples
+
+    def blocks(self, block_samples, start=0):
+        """Yield consecutive float (or complex) blocks of up to `block_samples` samples"""
+        for offset in range(start, len(self), block_samples):
+            yield self._convert(self._data[offset:offset + block_samples])
+
+
+def read_wav_header(path):
+    """
+    Locate the sample data of a RIFF/WAVE file without reading it
+
+    Returns:
+        (fs, dtype, data offset, value offset, scale, channels, sample frames)
+    Raises:
+        ValueError for unsupported or malformed files
+    """
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12:
+            raise ValueError(f"{path} is not a WAV file")
+        riff, _, wave = struct.unpack('<4sI4s', header)
+        if riff not in (b'RIFF', b'RF64') or wave != b'WAVE':
+            raise ValueError(f"{path} is not a WAV file")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                body = f.read(size + (size & 1))
+                if len(body) < 16:
+                    raise ValueError(f"{path} has a truncated fmt chunk")
+                tag, channels, fs, _, block_align, bits = struct.unpack('<HHIIHH', body[:16])
+                if tag == 0xFFFE and size >= 26:  # WAVE_FORMAT_EXTENSIBLE, sub-format in the GUID
+                    tag = struct.unpack('<H', body[24:26])[0]
+                fmt = (tag, channels, fs, block_align, bits)
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise ValueError(f"{path} has its data chunk before the fmt chunk")
+                tag, channels, fs, block_align, bits = fmt
+                offset = f.tell()
+                break
+            else:
+                f.seek(size + (size & 1), 1)
+
+    if tag == 1 and bits == 8:
+        dtype, value_offset, scale = np.uint8, 128.0, 1 / 128
+    elif tag == 1 and bits in (16, 32):
+        dtype, value_offset, scale = np.dtype(f'<i{bits // 8}'), 0.0, 1 / (1 << (bits - 1))
+    elif tag == 3 and bits in (32, 64):
+        dtype, value_offset, scale = np.dtype(f'<f{bits // 8}'), 0.0, 1.0
+    else:
+        raise ValueError(f"Unsupported WAV encoding (format {tag}, {bits} bits)")
+    # RF64 and streamed files may carry a placeholder size, so the frame count comes from the file size
+    count = size // block_align if size not in (0, 0xFFFFFFFF) else None
+    return fs, np.dtype(dtype), offset, value_offset, scale, channels, count
+
+
+class FskDemodulator:
+    """
+    Streaming equivalent of the STFT threshold detector in Receiver_Code.m
+
+    Frames are M = round(dt_target * fs) samples with a periodic Hann window,
+    no overlap, and nfft = 2^nextpow2(2M), as passed to MATLAB's
+    spectrogram(). The bit of a frame is 1 when the largest power in dB,
+    10*log10(|S|^2 + eps), over the bins of [band_center +- bandwidth / 2]
+    (absolute frequency = bin frequency + center_freq) exceeds
+    trigger + epsilon. Real input uses the one-sided bins, complex input all
+    nfft bins like spectrogram(), with the upper half taken as the negative
+    frequencies it holds.
+
+    The "goertzel" detector evaluates only the band bins: each is the
+    Goertzel/DFT sum of the windowed frame against one complex exponential,
+    so the bins of all frames of a block are one matrix product of the
+    (F, M) frames with a precomputed (M, bins) kernel holding the window
+    and the cos/sin terms. This gives the same values as the nfft-point FFT
+    (zero padding adds no terms) at a fraction of the cost. "fft" computes
+    the full spectrum as spectrogram() does.
+
+    With space_band_mhz set, the band max of the space tone is computed too
+    (column 1 of the band powers). Bits are still decided on the mark band
+    unless ratio_db is given: then a frame is 1 when the mark band exceeds the
+    space band by more than ratio_db + epsilon dB. This noncoherent dual-tone
+    decision compares the two tones of the same frame, so a gain change
+    common to both cancels and no absolute trigger level is needed.
+
+    process() accepts blocks of any size and carries the samples of an
+    incomplete frame over to the next call, so block boundaries never change
+    the result.
+    """
+
+    def __init__(self, fs, is_complex=False, center_freq=CENTER_FREQ, band_center_mhz=BAND_CENTER_MHZ,
+                 bandwidth_mhz=BANDWIDTH_MHZ, dt_target=DT_TARGET, trigger=TRIGGER, epsilon=0.0,
+                 detector="goertzel", space_band_mhz=None, ratio_db=None):
+        if detector not in DETECTORS:
+            raise ValueError(f"Unknown detector '{detector}', expected one of {', '.join(DETECTORS)}")
+        if ratio_db is not None and space_band_mhz is None:
+            raise ValueError("The tone ratio decision needs the space band (space_band_mhz)")
+        self.fs = fs
+        self.is_complex = is_complex
+        self.frame_len = int(np.floor(dt_target * fs + 0.5))  # MATLAB round()
+        if self.frame_len < 2:
+            raise ValueError(f"Sample rate {fs} Hz is too low for {dt_target * 1000:g} ms frames")
+        self.nfft = 1 << (2 * self.frame_len - 1).bit_length()
+        self.window = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self.frame_len) / self.frame_len)
+        self.ratio_db = ratio_db
+        self.threshold = (trigger if ratio_db is None else ratio_db) + epsilon
+
+        bins = self.nfft if is_complex else self.nfft // 2 + 1
+        self.f_abs_mhz = (np.arange(bins) * fs / self.nfft + center_freq) / 1e6
+        if is_complex:
+            # spectrogram() labels the upper half of a two-sided spectrum fs/2..fs, i.e. above the
+            # captured span; label it with the negative offsets it holds so bands below center work
+            upper = np.arange(bins) >= (bins + 1) // 2
+            self.f_abs_mhz[upper] = ((np.arange(bins)[upper] - bins) * fs / self.nfft + center_freq) / 1e6
+        self.band_bins = [self._bins_of(band_center_mhz, bandwidth_mhz)]
+        if not len(self.band_bins[0]):
+            print(f"Warning: No FFT bin falls inside the {band_center_mhz} MHz band, every bit will be 0")
+        if space_band_mhz is not None:
+            self.band_bins.append(self._bins_of(space_band_mhz, bandwidth_mhz))
+            if not len(self.band_bins[1]):
+                span = f"+- {fs / 2e6:g}" if is_complex else f"+ [0, {fs / 2e6:g}]"
+                raise ValueError(f"Space band {space_band_mhz} MHz is outside the captured span "
+                                 f"{center_freq / 1e6:g} {span} MHz, use a wider capture or --space-band")
+        self.bins = self.band_bins[0]
+        self.detector = detector
+        self._kernel = self._goertzel_kernel() if detector == "goertzel" else None
+
+        self.frames = 0
+        self._carry = np.zeros(0, dtype=complex if is_complex else float)
+
+    def _bins_of(self, band_center_mhz, bandwidth_mhz):
+        lower, upper = band_center_mhz - bandwidth_mhz / 2, band_center_mhz + bandwidth_mhz / 2
+        return np.flatnonzero((self.f_abs_mhz >= lower) & (self.f_abs_mhz <= upper))
+
+    def _goertzel_kernel(self):
+        """
+        (M, bins) projection onto the band bins with the window folded in
+
+        Real input gets a real (M, 2 * bins) kernel of cos and -sin columns, so
+        the product stays in real arithmetic; complex input a complex one.
+        """
+        bins = np.concatenate(self.band_bins)
+        phase = 2 * np.pi * np.outer(np.arange(self.frame_len), bins) / self.nfft
+        if self.is_complex:
+            return self.window[:, None] * np.exp(-1j * phase)
+        return np.hstack((self.window[:, None] * np.cos(phase), -self.window[:, None] * np.sin(phase)))
+
+    def _bin_power(self, frames):
+        """|S|^2 of the band bins of every frame, shape (F, bins)"""
+        if self.detector == "goertzel":
+            projection = frames @ self._kernel
+            if self.is_complex:
+                return projection.real ** 2 + projection.imag ** 2
+            count = projection.shape[1] // 2
+            return projection[:, :count] ** 2 + projection[:, count:] ** 2
+        windowed = frames * self.window
+        spectrum = np.fft.fft(windowed, self.nfft) if self.is_complex else np.fft.rfft(windowed, self.nfft)
+        spectrum = spectrum[:, np.concatenate(self.band_bins)]
+        return spectrum.real ** 2 + spectrum.imag ** 2
+
+    def bin_power_db(self, frames):
+        """
+        Power in dB, 10*log10(|S|^2 + eps), of every band bin of every frame
+
+        Returns: (F, bins) array, columns in the order of the concatenated band_bins
+        """
+        return 10 * np.log10(self._bin_power(frames) + EPS)
+
+    def band_power_db(self, frames):
+        """
+        Largest power in dB of each band in each frame
+
+        Args:
+            frames: (F, M) array of samples
+
+        Returns:
+            (F, bands) array, column 0 the mark band and column 1 the space band
+            if configured; -inf when a band holds no bin
+        """
+        power = self._bin_power(frames)
+        result = np.full((len(frames), len(self.band_bins)), -np.inf)
+        start = 0
+        for band, bins in enumerate(self.band_bins):
+            if len(bins):
+                result[:, band] = 10 * np.log10(power[:, start:start + len(bins)].max(axis=1) + EPS)
+            start += len(bins)
+        return result
+
+    def decision_values(self, power_db):
+        """
+        Per-frame values compared with the threshold
+
+        Args:
+            power_db: (F, bands) band powers from band_power_db()
+
+        Returns:
+            The mark band power in dB, or the mark to space ratio in dB with ratio_db set
+        """
+        if self.ratio_db is None:
+            return power_db[:, 0]
+        return power_db[:, 0] - power_db[:, 1]
+
+    def reset(self):
+        """
+        Drop the carried partial frame, e.g. when the following samples are not contiguous
+
+        Returns: number of carried samples dropped
+        """
+        dropped = len(self._carry)
+        self._carry = self._carry[:0]
+        return dropped
+
+    def frames_of(self, samples):
+        """Prepend the carried samples and cut the complete frames, keeping the rest for next time"""
+        if len(self._carry):
+            samples = np.concatenate((self._carry, samples))
+        count = len(samples) // self.frame_len
+        self._carry = samples[count * self.frame_len:].copy()
+        self.frames += count
+        return samples[:count * self.frame_len].reshape(count, self.frame_len)
+
+    def process(self, samples):
+        """
+        Demodulate the complete frames of a block
+
+        Returns:
+            (bits, power_db) - uint8 array of bits and the (F, bands) band powers, see band_power_db()
+        """
+        power_db = self.band_power_db(self.frames_of(samples))
+        return (self.decision_values(power_db) > self.threshold).astype(np.uint8), power_db
+
+
+def demodulate(capture, demod, block_frames=None):
+    """
+    Lazily demodulate a capture
+
+    Memory use is bounded by `block_frames` frames (default: about
+    BLOCK_SAMPLES samples) whatever the capture length; the incomplete last
+    frame is dropped, as by spectrogram().
+
+    Yields: uint8 arrays of bits, one per block
+    """
+    if block_frames is None:
+        block_frames = max(1, BLOCK_SAMPLES // demod.frame_len)
+    for block in capture.blocks(block_frames * demod.frame_len):
+        bits, _ = demod.process(block)
+        if len(bits):
+            yield bits
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming FSK demodulator, Python port of receiver/Receiver_Code.m')
+    parser.add_argument('capture', help='WAV or raw interleaved IQ capture')
+    parser.add_argument('--format', choices=['wav'] + list(RAW_FORMATS), help='Capture format (default: from extension)')
+    parser.add_argument('--fs', type=float, help='Sample rate in Hz (raw captures)')
+    parser.add_argument('--iq', action='store_true', help='Use a 2-channel WAV as I/Q instead of averaging to mono')
+    parser.add_argument('--center-freq', type=float, default=CENTER_FREQ,
+                       help=f'SDR center frequency in Hz (default: {CENTER_FREQ:g})')
+    parser.add_argument('--band', type=float, default=BAND_CENTER_MHZ,
+                       help=f'Mark tone band center in MHz (default: {BAND_CENTER_MHZ})')
+    parser.add_argument('--bandwidth', type=float, default=BANDWIDTH_MHZ,
+                       help=f'Band width in MHz (default: {BANDWIDTH_MHZ})')
+    parser.add_argument('--trigger', type=float, default=TRIGGER, help=f'Threshold in dB (default: {TRIGGER})')
+    parser.add_argument('--epsilon', type=float, default=0.0, help='Offset added to the threshold in dB')
+    parser.add_argument('--ratio', type=float, nargs='?', const=RATIO_DB, default=None, metavar='DB',
+                       help=f'Decide on the mark/space band power ratio instead of --trigger; needs --space-band '
+                            f'(default when given: {RATIO_DB:g} dB)')
+    parser.add_argument('--detector', choices=DETECTORS, default="goertzel",
+                       help='Band power detector: goertzel (band bins only) or fft (full spectrum, as MATLAB)')
+    parser.add_argument('--space-band', type=float, nargs='?', const=SPACE_BAND_MHZ, default=None,
+                       help=f'Also measure the space tone band in MHz (default when given: {SPACE_BAND_MHZ})')
+    parser.add_argument('--block-frames', type=int, default=None,
+                       help=f'Frames per processing block (default: about {BLOCK_SAMPLES} samples)')
+    parser.add_argument('-o', '--output', help='Write the bitstream to this file instead of printing it')
+
+    args = parser.parse_args()
+
+    try:
+        capture = Capture(args.capture, args.format, args.fs, args.iq)
+        demod = FskDemodulator(capture.fs, capture.is_complex, args.center_freq, args.band, args.bandwidth,
+                               trigger=args.trigger, epsilon=args.epsilon, detector=args.detector,
+                               space_band_mhz=args.space_band, ratio_db=args.ratio)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"Capture: {args.capture}, {capture.fs:g} Hz, {capture.duration:.3f} seconds, "
+          f"{'complex' if capture.is_complex else 'real'}")
+    print(f"Frames of {demod.frame_len} samples, nfft {demod.nfft}, {len(demod.bins)} band bin(s), "
+          f"{demod.detector} detector")
+    if demod.ratio_db is not None:
+        print(f"Decision: mark/space ratio > {demod.threshold:g} dB (space band {args.space_band} MHz)")
+
+    start_time = time.perf_counter()
+    out = open(args.output, 'w') if args.output else None
+    ones = 0
+    pieces = []
+    try:
+        for bits in demodulate(capture, demod, args.block_frames):
+            ones += int(bits.sum())
+            text = (bits + ord('0')).tobytes().decode('ascii')
+            if out is not None:
+                out.write(text)
+            else:
+                pieces.append(text)
+    finally:
+        if out is not None:
+            out.close()
+    elapsed = time.perf_counter() - start_time
+
+    if out is None:
+        print(f"initial bit stream is: {''.join(pieces)}")
+    else:
+        print(f"Bitstream written to {args.output}")
+    print(f"Frames: {demod.frames}, ones: {ones}")
+    print(f"Elapsed time: {elapsed:.3f} seconds "
+          f"({capture.duration / elapsed if elapsed > 0 else float('inf'):.1f}x real time)")
+
+if __name__ == "__main__":
+    main()
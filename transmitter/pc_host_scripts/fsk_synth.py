@@ -0,0 +1,337 @@
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from fsk_decode import MESSAGE_BITS
+from fsk_demod import BAND_CENTER_MHZ, BLOCK_SAMPLES, CENTER_FREQ, RAW_FORMATS, SPACE_BAND_MHZ, complex_to_raw
+from fsk_timing import FPGA_CLOCK_HZ
+from payload_reader import iter_payload_lines, parse_payload, read_payloads
+
+MAX_SYMBOL_CYCLES = 65535  # 16-bit symbol_time register of modulator.v
+MAX_REPETITION = 15        # 4-bit repetition_factor register
+GAP_MS = 50.0              # wave off between packets: ack, host turnaround and UART time of the next packet
+LEAD_MS = 100.0            # noise before the first packet
+AMPLITUDE = 0.25           # tone amplitude relative to full scale
+FADING_PATHS = 16          # scatterers of the sum-of-sinusoids fading model
+FADING_OVERSAMPLE = 32     # fading gain evaluations per 1 / Doppler frequency, interpolated in between
+TABLE_BITS = 16            # tone and noise tables of 2^16 entries, indexed by 16-bit values
+PHASE_BITS = 64            # tone phase accumulators, whole turn = 2^64
+
+
+class SyntheticCapture:
+    """
+    Complex baseband of the key FSK modulator as seen by the SDR
+
+    modulator.v holds every bit for repetition_factor * symbol_time clock
+    cycles, MSB first, with freq_select = 1 (936 MHz PLL) for 1 and 0 (888
+    MHz PLL) for 0, and disables the wave once the 128 bits are sent. Each
+    packet sent by main_modulation_key.py is one such burst; bursts of
+    `repeat` packets per payload follow each other after `gap` seconds of
+    silence. The tones default to where Receiver_Code.m sees them relative
+    to the 935.5 MHz SDR center; a tone outside the sampled span +- fs / 2
+    is not generated, as the SDR would not receive it.
+
+    Samples are a pure function of their index (noise is drawn per block of
+    BLOCK_SAMPLES from a seed derived from the block number), so blocks can
+    be generated in any order and every block is computed with array
+    operations only. The bit boundaries of a block are computed once and
+    expanded to a tone code per sample. Tones come from a numerically
+    controlled oscillator: the phase of sample n is n * step (+ n^2 * the
+    drift step) in wrapping 64-bit integers, and its top 16 bits index a
+    table of the tone with the amplitude folded in (spurs below -90 dBc,
+    under the 16-bit output quantization). The noise is read from a table of
+    2^16 complex Gaussian values by raw 16-bit random numbers; it only
+    reaches the detector through sums of many samples, so its discrete tails
+    do not matter. Both are several times faster than complex exponentials
+    and ziggurat normals.
+
+    Args:
+        payloads: 128-bit integers, sent in order
+        fs: Sample rate in Hz
+        symbol_cycles: symbol_time in 12 MHz FPGA clock cycles
+        repetition: repetition_factor
+        repeat: Packets per payload
+        center_freq: SDR center frequency in Hz
+        mark_mhz, space_mhz: Tone frequencies in MHz (None: no tone)
+        amplitude: Tone amplitude relative to full scale
+        snr_db: Tone to noise power ratio over the sampled bandwidth, None for no noise
+        freq_offset_hz: Carrier frequency error of both tones
+        drift_hz_per_s: Linear carrier drift of both tones
+        clock_ppm: FPGA clock rate error against the SDR clock (positive: symbols are shorter)
+        fading_hz: Doppler frequency of flat fading, 0 for none
+        rician_k_db: Rician K factor of the fading (None: Rayleigh)
+        gap: Silence between packets in seconds
+        lead: Silence before the first packet in seconds
+        seed: Random seed of the noise and the fading paths
+    """
+
+    def __init__(self, payloads, fs, symbol_cycles, repetition, repeat=1, center_freq=CENTER_FREQ,
+                 mark_mhz=BAND_CENTER_MHZ, space_mhz=SPACE_BAND_MHZ, amplitude=AMPLITUDE, snr_db=None,
+                 freq_offset_hz=0.0, drift_hz_per_s=0.0, clock_ppm=0.0, fading_hz=0.0, rician_k_db=None,
+                 gap=GAP_MS / 1000, lead=LEAD_MS / 1000, seed=0):
+        if not 2 <= symbol_cycles <= MAX_SYMBOL_CYCLES:
+            raise ValueError(f"symbol_time must be 2-{MAX_SYMBOL_CYCLES} clock cycles, got {symbol_cycles}")
+        if not 1 <= repetition <= MAX_REPETITION:
+            raise ValueError(f"repetition_factor must be 1-{MAX_REPETITION}, got {repetition}")
+        if not len(payloads) or repeat < 1:
+            raise ValueError("Need at least one payload and one packet per payload")
+        self.fs = fs
+        self.symbol_cycles = symbol_cycles
+        self.repetition = repetition
+        self.repeat = repeat
+        self.bits = np.unpackbits(np.frombuffer(b''.join(p.to_bytes(MESSAGE_BITS // 8, 'big') for p in payloads),
+                                                dtype=np.uint8)).reshape(len(payloads), MESSAGE_BITS)
+        self.payloads = list(payloads)
+        # Every bit lasts repetition * symbol_time cycles of the FPGA clock, see modulator.v
+        self.bit_time = repetition * symbol_cycles / (FPGA_CLOCK_HZ * (1 + clock_ppm * 1e-6))
+        self.packet_time = MESSAGE_BITS * self.bit_time
+        self.period = self.packet_time + gap
+        self.lead = lead
+        self.packets = len(payloads) * repeat
+        self.amplitude = amplitude
+        self.noise_sigma = 0.0 if snr_db is None else amplitude * 10 ** (-snr_db / 20) / np.sqrt(2)
+        self.freq_offset_hz = freq_offset_hz
+        self.drift_hz_per_s = drift_hz_per_s
+        self.tones = {}  # bit value -> baseband offset in Hz, for tones inside the span
+        for bit, tone_mhz in ((1, mark_mhz), (0, space_mhz)):
+            if tone_mhz is not None and abs(tone_mhz * 1e6 - center_freq) < fs / 2:
+                self.tones[bit] = tone_mhz * 1e6 - center_freq
+        # Tone codes: 0 wave off, 1 mark, 2 space
+        self._codes = np.where(self.bits == 1, 1, 2).astype(np.uint8)
+        self._steps = np.array([0] + [self._phase_step((self.tones.get(bit, 0.0) + freq_offset_hz) / fs)
+                                      for bit in (1, 0)], dtype=np.uint64)
+        self._drift_step = np.uint64(self._phase_step(0.5 * drift_hz_per_s / fs ** 2))
+        turn = np.exp(2j * np.pi * np.arange(1 << TABLE_BITS) / (1 << TABLE_BITS))
+        self._tone_table = np.concatenate([np.zeros(1 << TABLE_BITS)] + [
+            turn * (amplitude if bit in self.tones else 0.0) for bit in (1, 0)]).astype(np.complex64)
+        self.seed = seed
+        rng = np.random.default_rng([seed, 0])
+        normal = rng.standard_normal((1 << TABLE_BITS, 2))
+        normal = (normal - normal.mean(axis=0)) / normal.std(axis=0) * self.noise_sigma
+        self._noise_table = (normal[:, 0] + 1j * normal[:, 1]).astype(np.complex64)
+        self.fading_hz = fading_hz
+        self._fading_k = None if rician_k_db is None else 10 ** (rician_k_db / 10)
+        self._fading_freqs = fading_hz * np.cos(rng.uniform(0, 2 * np.pi, FADING_PATHS))
+        self._fading_phases = rng.uniform(0, 2 * np.pi, FADING_PATHS)
+        self._length = int(np.ceil((lead + (self.packets - 1) * self.period + self.packet_time + gap) * fs))
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def duration(self):
+        return len(self) / self.fs
+
+    @staticmethod
+    def _phase_step(turns_per_sample):
+        """Phase accumulator increment of a frequency given in turns per sample"""
+        return int(round(turns_per_sample * 2.0 ** PHASE_BITS)) % (1 << PHASE_BITS)
+
+    def packet_starts(self):
+        """Start time in seconds of every packet"""
+        return self.lead + np.arange(self.packets) * self.period
+
+    def _fading(self, t):
+        """Complex flat fading gain with unit mean power at times t (sum of sinusoids, interpolated)"""
+        step = 1 / (FADING_OVERSAMPLE * self.fading_hz)
+        grid = np.arange(np.floor(t[0] / step), np.ceil(t[-1] / step) + 1) * step
+        phase = 2 * np.pi * np.outer(grid, self._fading_freqs) + self._fading_phases
+        scatter = np.exp(1j * phase).sum(axis=1) / np.sqrt(FADING_PATHS)
+        if self._fading_k is not None:
+            scatter = np.sqrt(self._fading_k / (self._fading_k + 1)) + scatter / np.sqrt(self._fading_k + 1)
+        return np.interp(t, grid, scatter.real) + 1j * np.interp(t, grid, scatter.imag)
+
+    def _tone_codes(self, start, count):
+        """
+        Tone code (0 off, 1 mark, 2 space) of samples [start, start + count)
+
+        Sample n carries bit b of packet k when lead + k * period + b * bit_time
+        <= n / fs < the next bit boundary. Only the boundaries of the packets
+        overlapping the block are computed; the codes between them are
+        expanded with np.repeat.
+        """
+        first = max(0, int(np.floor((start / self.fs - self.lead) / self.period)))
+        last = min(self.packets - 1, int(np.floor(((start + count) / self.fs - self.lead) / self.period)))
+        if last < first:
+            return np.zeros(count, dtype=np.uint8)
+        packets = np.arange(first, last + 1)
+        # Boundaries of the 128 bits and of the silence after each packet, as the first sample index at or after them
+        times = self.lead + packets[:, None] * self.period + np.arange(MESSAGE_BITS + 1) * self.bit_time
+        edges = np.clip(np.ceil(times.ravel() * self.fs).astype(np.int64), start, start + count) - start
+        codes = np.concatenate((self._codes[packets // self.repeat], np.zeros((len(packets), 1), np.uint8)), axis=1)
+        lengths = np.diff(np.concatenate(([0], edges, [count])))
+        return np.repeat(np.concatenate(([np.uint8(0)], codes.ravel())), lengths)
+
+    def samples(self, start, count):
+        """Samples [start, start + count) as complex64"""
+        count = max(0, min(count, len(self) - start))
+        n = np.arange(start, start + count, dtype=np.uint64)
+        code = self._tone_codes(start, count)
+        phase = n * self._steps[code]
+        if self._drift_step:
+            phase += n * n * self._drift_step
+        index = (phase >> np.uint64(PHASE_BITS - TABLE_BITS)).astype(np.intp)
+        index += code.astype(np.intp) << TABLE_BITS
+        signal = self._tone_table[index]
+        if self.fading_hz > 0 and count:
+            signal *= self._fading(n / self.fs).astype(np.complex64)
+
+        if self.noise_sigma > 0:
+            # One generator per block index keeps the noise independent of how the capture is chunked
+            for first in range(start // BLOCK_SAMPLES * BLOCK_SAMPLES, start + count, BLOCK_SAMPLES):
+                rng = np.random.default_rng([self.seed, 1, first // BLOCK_SAMPLES])
+                indices = rng.bit_generator.random_raw(BLOCK_SAMPLES // 4).view(np.uint16)
+                lo, hi = max(first, start), min(first + BLOCK_SAMPLES, start + count)
+                signal[lo - start:hi - start] += self._noise_table[indices[lo - first:hi - first]]
+        return signal
+
+    def blocks(self, block_samples=BLOCK_SAMPLES):
+        """Yield consecutive complex64 blocks of up to `block_samples` samples"""
+        for start in range(0, len(self), block_samples):
+            yield self.samples(start, block_samples)
+
+
+def wav_header(fs, frames, channels=2, bits=16):
+    """
+    RIFF/WAVE header of PCM data
+
+    Sizes beyond the 32-bit RIFF fields are written as 0xFFFFFFFF, which
+    fsk_demod.read_wav_header() (like most streaming readers) resolves from
+    the file size.
+    """
+    data_bytes = frames * channels * bits // 8
+    size = data_bytes if data_bytes + 36 <= 0xFFFFFFFF else 0xFFFFFFFF
+    return (b'RIFF' + struct.pack('<I', min(36 + size, 0xFFFFFFFF)) + b'WAVE'
+            + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, int(fs), int(fs) * channels * bits // 8,
+                                    channels * bits // 8, bits)
+            + b'data' + struct.pack('<I', size))
+
+
+def write_capture(path, capture, fmt):
+    """
+    Write a SyntheticCapture block by block
+
+    Args:
+        path: Output file
+        capture: SyntheticCapture
+        fmt: 'wav' (2-channel 16-bit I/Q, read with --iq) or one of RAW_FORMATS
+    """
+    with open(path, 'wb') as f:
+        if fmt == 'wav':
+            f.write(wav_header(capture.fs, len(capture)))
+        for block in capture.blocks():
+            f.write(complex_to_raw(block, 'cs16' if fmt == 'wav' else fmt))
+
+
+def write_truth(path, capture):
+    """Write the packets as JSON lines: payload, start and end time and bit time in seconds"""
+    with open(path, 'w') as f:
+        for packet, start in enumerate(capture.packet_starts()):
+            payload = capture.payloads[packet // capture.repeat]
+            f.write(json.dumps({"packet": packet, "payload": f"{payload:032X}", "start_s": round(float(start), 9),
+                                "end_s": round(float(start + capture.packet_time), 9),
+                                "bit_time_s": capture.bit_time}) + "\n")
+
+
+def first_payload(path):
+    """Payload sent by main_modulation_key.py without --campaign: the first record of the file"""
+    line_no, content = next(iter_payload_lines(path), (None, None))
+    if line_no is None:
+        raise ValueError(f"No bitstream found in '{path}'")
+    return parse_payload(content)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic SDR captures of the FSK modulator')
+    parser.add_argument('bitstream_file', help='Bitstream file (binary or hex), or payload queue with --campaign')
+    parser.add_argument('symbol_time_ms', type=float, help='Symbol time in milliseconds, as main_modulation_key.py')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='Packets per payload (default: 1)')
+    parser.add_argument('-f', '--repetition-factor', type=int, default=1,
+                       help=f'Repetition factor for each bit (1-{MAX_REPETITION}, default: 1)')
+    parser.add_argument('-c', '--campaign', action='store_true', help='Send every payload of the file in order')
+    parser.add_argument('--symbol-cycles', type=int, default=None,
+                       help='Symbol time in 12 MHz clock cycles, overriding symbol_time_ms')
+    parser.add_argument('-o', '--output', required=True, help='Output capture, .wav (I/Q) or a raw IQ format')
+    parser.add_argument('--format', choices=['wav'] + list(RAW_FORMATS), help='Output format (default: from extension)')
+    parser.add_argument('--fs', type=float, default=240_000, help='Sample rate in Hz (default: 240000)')
+    parser.add_argument('--center-freq', type=float, default=CENTER_FREQ,
+                       help=f'SDR center frequency in Hz (default: {CENTER_FREQ:g})')
+    parser.add_argument('--mark', type=float, default=BAND_CENTER_MHZ,
+                       help=f'Tone of 1 bits in MHz (default: {BAND_CENTER_MHZ}, as seen by Receiver_Code.m)')
+    parser.add_argument('--space', type=float, default=SPACE_BAND_MHZ,
+                       help=f'Tone of 0 bits in MHz (default: {SPACE_BAND_MHZ}); not generated outside the span')
+    parser.add_argument('--amplitude', type=float, default=AMPLITUDE,
+                       help=f'Tone amplitude relative to full scale (default: {AMPLITUDE})')
+    parser.add_argument('--snr', type=float, default=None,
+                       help='Tone to noise power ratio over the sampled bandwidth in dB (default: no noise)')
+    parser.add_argument('--freq-offset', type=float, default=0.0, help='Carrier frequency error in Hz')
+    parser.add_argument('--drift', type=float, default=0.0, help='Linear carrier drift in Hz per second')
+    parser.add_argument('--clock-ppm', type=float, default=0.0,
+                       help='FPGA clock error against the SDR clock in ppm (positive: shorter symbols)')
+    parser.add_argument('--fading-hz', type=float, default=0.0, help='Doppler frequency of flat fading (default: off)')
+    parser.add_argument('--rician-k', type=float, default=None,
+                       help='Rician K factor of the fading in dB (default: Rayleigh)')
+    parser.add_argument('--gap-ms', type=float, default=GAP_MS,
+                       help=f'Silence between packets in ms (default: {GAP_MS:g})')
+    parser.add_argument('--lead-ms', type=float, default=LEAD_MS,
+                       help=f'Silence before the first packet in ms (default: {LEAD_MS:g})')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--truth', help='Write the transmitted packets and their times as JSON lines to this file')
+
+    args = parser.parse_args()
+
+    fmt = args.format or ('wav' if args.output.lower().endswith('.wav') else args.output.rsplit('.', 1)[-1].lower())
+    if fmt != 'wav' and fmt not in RAW_FORMATS:
+        print(f"Error: Unknown output format '{fmt}', use --format")
+        sys.exit(1)
+    if args.fs <= 0 or args.amplitude <= 0 or args.gap_ms < 0 or args.lead_ms < 0 or args.fading_hz < 0:
+        print("Error: --fs and --amplitude must be positive, --gap-ms, --lead-ms and --fading-hz not negative")
+        sys.exit(1)
+    if not os.path.exists(args.bitstream_file):
+        print(f"Error: File '{args.bitstream_file}' not found")
+        sys.exit(1)
+    symbol_cycles = args.symbol_cycles or int(args.symbol_time_ms * 12000)  # as main_modulation_key.py
+
+    try:
+        # A queue with an invalid record is rejected as a whole (PayloadFormatError) instead of leaving a hole
+        payloads = list(read_payloads(args.bitstream_file)) if args.campaign else [first_payload(args.bitstream_file)]
+        capture = SyntheticCapture(payloads, args.fs, symbol_cycles, args.repetition_factor, args.repeat,
+                                   args.center_freq, args.mark, args.space, args.amplitude, args.snr,
+                                   args.freq_offset, args.drift, args.clock_ppm, args.fading_hz, args.rician_k,
+                                   args.gap_ms / 1000, args.lead_ms / 1000, args.seed)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"Payloads: {len(payloads)} x {args.repeat} packet(s), repetition factor {args.repetition_factor}")
+    print(f"Symbol time: {symbol_cycles} cycles ({symbol_cycles / FPGA_CLOCK_HZ * 1000:.6g} ms), "
+          f"bit time {capture.bit_time * 1000:.6g} ms, packet {capture.packet_time:.3f} s")
+    for bit, name, tone_mhz in ((1, "Mark", args.mark), (0, "Space", args.space)):
+        if bit in capture.tones:
+            print(f"{name} tone: {tone_mhz} MHz ({capture.tones[bit]:+.0f} Hz)")
+        else:
+            print(f"⚠️  {name} tone {tone_mhz} MHz is outside {args.center_freq / 1e6:g} +- {args.fs / 2e6:g} MHz, "
+                  f"not generated")
+
+    start_time = time.perf_counter()
+    try:
+        write_capture(args.output, capture, fmt)
+        if args.truth:
+            write_truth(args.truth, capture)
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    elapsed = time.perf_counter() - start_time
+
+    print(f"Capture: {args.output}, {fmt}, {args.fs:g} Hz, {capture.duration:.3f} seconds, {len(capture)} samples"
+          + (f", truth: {args.truth}" if args.truth else ""))
+    print(f"Elapsed time: {elapsed:.3f} seconds "
+          f"({capture.duration / elapsed if elapsed > 0 else float('inf'):.1f}x real time)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from fsk_acquire import MIN_SCORE, PREAMBLE, acquire, otsu_threshold, report_messages, soft_frames
+from fsk_demod import (CENTER_FREQ, BAND_CENTER_MHZ, BANDWIDTH_MHZ, BLOCK_SAMPLES, RATIO_DB, RAW_FORMATS,
+                       SPACE_BAND_MHZ, Capture, FskDemodulator)
+from payload_reader import parse_payload
+
+FPGA_CLOCK_HZ = 12_000_000  # symbol counter clock of the FPGA designs
+OVERSAMPLE = 4              # band power measurements per symbol
+LOOP_BANDWIDTH = 0.01       # timing loop noise bandwidth, normalized to the symbol rate
+DAMPING = 1 / np.sqrt(2)
+MAX_DRIFT = 0.02            # largest symbol period deviation the loop may track
+TED_SLOPE = 4.0             # Gardner detector output per symbol of timing error at a +/-1 transition
+
+
+def fpga_symbol_time(symbol_time_ms):
+    """Symbol time actually produced by the FPGA for a requested time (whole 12 MHz cycles, as main_modulation_key.py)"""
+    return int(symbol_time_ms * FPGA_CLOCK_HZ / 1000) / FPGA_CLOCK_HZ
+
+
+def band_envelope(capture, symbol_time, oversample=OVERSAMPLE, center_freq=CENTER_FREQ,
+                  band_center_mhz=BAND_CENTER_MHZ, bandwidth_mhz=None, space_band_mhz=None):
+    """
+    Measure the band power `oversample` times per symbol
+
+    Uses FskDemodulator with frames of symbol_time / oversample. Such short
+    frames resolve the tone to about fs / frame_len, so the band is widened to
+    that when `bandwidth_mhz` is None (or narrower). With `space_band_mhz`
+    the mark/space power ratio is measured instead of the mark power.
+
+    Returns:
+        (power_db (or ratio in dB) per subframe, subframes per symbol as a float, demodulator)
+    """
+    frame_len = int(np.floor(symbol_time / oversample * capture.fs + 0.5))
+    if frame_len < 2:
+        raise ValueError(f"Sample rate {capture.fs:g} Hz is too low for {oversample} measurements "
+                         f"per {symbol_time * 1000:g} ms symbol")
+    resolution_mhz = capture.fs / frame_len / 1e6
+    bandwidth_mhz = max(bandwidth_mhz or BANDWIDTH_MHZ, resolution_mhz)
+    demod = FskDemodulator(capture.fs, capture.is_complex, center_freq, band_center_mhz, bandwidth_mhz,
+                           dt_target=frame_len / capture.fs, space_band_mhz=space_band_mhz,
+                           ratio_db=None if space_band_mhz is None else RATIO_DB)
+    block_samples = max(1, BLOCK_SAMPLES // frame_len) * frame_len
+    power_db = np.concatenate([demod.decision_values(demod.process(block)[1]).astype(np.float32)
+                               for block in capture.blocks(block_samples)] or [np.zeros(0, np.float32)])
+    return power_db, symbol_time * capture.fs / frame_len, demod
+
+
+def matched_filter(soft, samples_per_symbol):
+    """Average over one symbol: out[i] is the mean of soft[i:i + round(samples_per_symbol)]"""
+    width = max(1, int(round(samples_per_symbol)))
+    sums = np.concatenate(([0.0], np.cumsum(soft, dtype=np.float64)))
+    return (sums[width:] - sums[:-width]) / width
+
+
+def initial_phase(filtered, samples_per_symbol, symbols=256):
+    """Subframe offset whose symbol-spaced samples have the largest mean magnitude over the first symbols"""
+    width = max(1, int(round(samples_per_symbol)))
+    count = int(min(symbols, (len(filtered) - width) // samples_per_symbol))
+    if count <= 0:
+        return 0
+    positions = np.arange(width)[:, None] + np.round(np.arange(count) * samples_per_symbol).astype(int)[None, :]
+    return int(np.argmax(np.abs(filtered[positions]).mean(axis=1)))
+
+
+def recover_symbols(filtered, samples_per_symbol, loop_bandwidth=LOOP_BANDWIDTH, damping=DAMPING,
+                    max_drift=MAX_DRIFT, transition_density=0.5):
+    """
+    Gardner timing recovery on the matched filter output
+
+    One strobe per symbol is interpolated (linearly) from the subframe series.
+    The Gardner detector, mid * (previous - current) with mid halfway between
+    the two strobes, is zero when the strobes sit on the symbol centers and
+    does not depend on the decisions. A proportional-integral loop corrects
+    the strobe phase and, through the integrator, the symbol period, so a
+    constant rate offset between the FPGA clock and the SDR clock (up to
+    `max_drift`) is tracked without a residual phase error.
+
+    Args:
+        filtered: matched_filter() output of the soft subframe values
+        samples_per_symbol: Nominal subframes per symbol
+        loop_bandwidth: Loop noise bandwidth normalized to the symbol rate
+        damping: Loop damping factor
+        max_drift: Limit of the relative period correction
+        transition_density: Expected share of symbols followed by a transition,
+            0.5 for random data; the detector only reacts to transitions, so
+            its mean gain and thus the loop bandwidth scale with it
+
+    Returns:
+        (soft symbols, strobe positions in subframes)
+    """
+    theta = loop_bandwidth / (damping + 1 / (4 * damping))
+    denominator = 1 + 2 * damping * theta + theta ** 2
+    detector_gain = TED_SLOPE * transition_density
+    kp = 4 * damping * theta / denominator / detector_gain
+    ki = 4 * theta ** 2 / denominator / detector_gain
+
+    # Plain Python floats: the loop is inherently sequential and NumPy scalars would dominate its cost
+    y = filtered.tolist()
+    last = len(y) - 1
+    t = float(initial_phase(filtered, samples_per_symbol))
+    half = samples_per_symbol / 2
+    integrator = 0.0
+    previous = None
+    symbols = []
+    strobes = []
+    while t < last:
+        i = int(t)
+        frac = t - i
+        current = y[i] + (y[i + 1] - y[i]) * frac
+        if previous is not None:
+            m = t - (1 + integrator) * half
+            j = int(m)
+            mid = y[j] + (y[j + 1] - y[j]) * (m - j)
+            error = mid * (previous - current)
+            integrator = min(max_drift, max(-max_drift, integrator + ki * error))
+            t += kp * error * samples_per_symbol
+        symbols.append(current)
+        strobes.append(t)
+        previous = current
+        t += (1 + integrator) * samples_per_symbol
+    return np.array(symbols), np.array(strobes)
+
+
+def measured_drift_ppm(strobes, samples_per_symbol):
+    """Relative symbol period error in ppm, from a straight-line fit of the strobe positions"""
+    if len(strobes) < 2:
+        return 0.0
+    slope = np.polyfit(np.arange(len(strobes)), strobes, 1)[0]
+    return (slope / samples_per_symbol - 1) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Symbol timing recovery and decoding for short FSK symbol times')
+    parser.add_argument('capture', help='WAV or raw interleaved IQ capture')
+    parser.add_argument('--symbol-time-ms', type=float, required=True,
+                       help='Symbol time requested from main_modulation_key.py in ms')
+    parser.add_argument('--format', choices=['wav'] + list(RAW_FORMATS), help='Capture format (default: from extension)')
+    parser.add_argument('--fs', type=float, help='Sample rate in Hz (raw captures)')
+    parser.add_argument('--iq', action='store_true', help='Use a 2-channel WAV as I/Q instead of averaging to mono')
+    parser.add_argument('--center-freq', type=float, default=CENTER_FREQ,
+                       help=f'SDR center frequency in Hz (default: {CENTER_FREQ:g})')
+    parser.add_argument('--band', type=float, default=BAND_CENTER_MHZ,
+                       help=f'Mark tone band center in MHz (default: {BAND_CENTER_MHZ})')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                       help='Band width in MHz (default: the frequency resolution of the subframes)')
+    parser.add_argument('--space-band', type=float, nargs='?', const=SPACE_BAND_MHZ, default=None,
+                       help=f'Decide on the mark/space tone power ratio, with the space band in MHz '
+                            f'(default when given: {SPACE_BAND_MHZ})')
+    parser.add_argument('--oversample', type=int, default=OVERSAMPLE,
+                       help=f'Band power measurements per symbol (default: {OVERSAMPLE})')
+    parser.add_argument('--loop-bandwidth', type=float, default=LOOP_BANDWIDTH,
+                       help=f'Timing loop bandwidth relative to the symbol rate (default: {LOOP_BANDWIDTH})')
+    parser.add_argument('--max-drift-ppm', type=float, default=MAX_DRIFT * 1e6,
+                       help=f'Largest clock rate offset tracked in ppm (default: {MAX_DRIFT * 1e6:g})')
+    parser.add_argument('--trigger', type=float, default=None,
+                       help='Fixed threshold in dB (of the mark/space ratio with --space-band) instead of the automatic one')
+    parser.add_argument('-n', '--repetition', type=int, default=5, help='Repetition factor (default: 5)')
+    parser.add_argument('--preamble', default=PREAMBLE, help=f'Message start pattern (default: {PREAMBLE})')
+    parser.add_argument('--min-score', type=float, default=MIN_SCORE,
+                       help=f'Normalized correlation needed to accept a preamble (default: {MIN_SCORE})')
+    parser.add_argument('--soft-decode', action='store_true',
+                       help='Weight each repeat by its distance from the threshold instead of majority voting')
+    parser.add_argument('--ref', help='Expected message (hex/binary) to count bit errors against')
+    parser.add_argument('-o', '--output', help='Write the messages as JSON lines to this file')
+    parser.add_argument('--packed', help='Write the messages as consecutive 16-byte records to this file')
+
+    args = parser.parse_args()
+
+    if args.oversample < 2:
+        print("Error: --oversample must be at least 2")
+        sys.exit(1)
+    if not args.preamble or args.preamble.strip('01'):
+        print("Error: --preamble must be a string of 0/1")
+        sys.exit(1)
+    symbol_time = fpga_symbol_time(args.symbol_time_ms)
+    if symbol_time <= 0:
+        print("Error: Symbol time is shorter than one FPGA clock cycle")
+        sys.exit(1)
+
+    start_time = time.perf_counter()
+    try:
+        reference = parse_payload(args.ref)[0] if args.ref else None
+        capture = Capture(args.capture, args.format, args.fs, args.iq)
+        power_db, samples_per_symbol, demod = band_envelope(capture, symbol_time, args.oversample,
+                                                            args.center_freq, args.band, args.bandwidth,
+                                                            args.space_band)
+        if args.trigger is None:
+            threshold, separability = otsu_threshold(power_db)
+        else:
+            threshold, separability = args.trigger, None
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    filtered = matched_filter(soft_frames(power_db, threshold), samples_per_symbol)
+    # Each bit is sent `repetition` times in a row, so random data has a transition every 2n symbols on average
+    symbols, strobes = recover_symbols(filtered, samples_per_symbol, args.loop_bandwidth,
+                                       max_drift=args.max_drift_ppm / 1e6,
+                                       transition_density=0.5 / args.repetition)
+    # The symbols are already centered on 0, so the hard decision threshold is 0
+    result = acquire(symbols, args.repetition, args.preamble, threshold=0.0, min_score=args.min_score)
+    elapsed = time.perf_counter() - start_time
+
+    print(f"Capture: {args.capture}, {capture.fs:g} Hz, {capture.duration:.3f} seconds")
+    print(f"Symbol time: {symbol_time * 1000:.6g} ms ({int(round(symbol_time * FPGA_CLOCK_HZ))} cycles), "
+          f"{args.oversample} subframes of {demod.frame_len} samples per symbol, "
+          f"band {args.band} MHz +- {(np.ptp(demod.f_abs_mhz[demod.bins]) if len(demod.bins) else 0) / 2 * 1e3:.1f} kHz"
+          + (f", space band {args.space_band} MHz" if args.space_band is not None else ""))
+    kind = "mark/space ratio, " if args.space_band is not None else ""
+    if separability is None:
+        print(f"Threshold: {threshold:.4f} dB ({kind}fixed)")
+    else:
+        print(f"Threshold: {threshold:.4f} dB ({kind}Otsu, separability {separability:.3f})")
+    print(f"Symbols: {len(symbols)}, clock rate offset {measured_drift_ppm(strobes, samples_per_symbol):+.0f} ppm "
+          f"(SDR samples per FPGA symbol vs nominal)")
+    print(f"Preamble {args.preamble} x{args.repetition}: {len(result['starts'])} complete message(s)")
+    report_messages(result, args.repetition, reference, args.output, args.soft_decode, args.packed)
+    print(f"Elapsed time: {elapsed:.3f} seconds "
+          f"({capture.duration / elapsed if elapsed > 0 else float('inf'):.1f}x real time)")
+
+if __name__ == "__main__":
+    main()
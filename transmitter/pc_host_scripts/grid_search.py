@@ -0,0 +1,318 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from aes_reference import RTL_KEY
+from fsk_acquire import otsu_threshold
+from fsk_decode import MESSAGE_BITS, majority_decode
+from fsk_demod import CENTER_FREQ, BAND_CENTER_MHZ, BANDWIDTH_MHZ, DT_TARGET, RAW_FORMATS, Capture
+from payload_reader import parse_payload
+from spectrogram_cache import DEFAULT_CACHE_DIR, SpectrogramCache, cached_spectrogram, spectrogram_blocks
+
+CHUNK_ELEMENTS = 1 << 25  # frame bits compared per step, bounds the temporary (thresholds, starts, frames) arrays
+KEEP = 1000               # best combinations kept per band and overall
+
+RESULT_DTYPE = np.dtype([("center_mhz", np.float64), ("bandwidth_mhz", np.float64), ("threshold_db", np.float32),
+                         ("start_index", np.int32), ("repetition", np.int16), ("hits", np.int16),
+                         ("prefix_len", np.int16), ("raw_errors", np.int32), ("raw_frames", np.int32)])
+
+RESULT_COLUMNS = ["rank", "center_mhz", "bandwidth_mhz", "threshold_db", "start_index", "repetition",
+                  "success_rate", "bit_errors", "prefix_len", "pct128", "raw_ber"]
+
+# Set in every worker by _attach_frames()
+_shared = {}
+
+
+def parse_grid(text, integer=False):
+    """
+    Parse a grid axis: 'start:stop:step' (stop included) or a comma-separated list
+
+    Returns: 1-D array of the values
+    """
+    convert = int if integer else float
+    if ':' in text:
+        parts = [convert(part) for part in text.split(':')]
+        if len(parts) != 3 or parts[2] <= 0 or parts[1] < parts[0]:
+            raise ValueError(f"'{text}' is not start:stop:step with start <= stop and step > 0")
+        start, stop, step = parts
+        count = int(np.floor((stop - start) / step + 1e-9)) + 1
+        values = start + step * np.arange(count)
+    else:
+        values = np.array([convert(part) for part in text.split(',') if part.strip()])
+    if not len(values):
+        raise ValueError(f"'{text}' has no values")
+    return values.astype(np.int64 if integer else np.float64)
+
+
+def zero_lead(ref_bits):
+    """Number of leading 0 bits of the reference; common prefixes that short count as empty (longest_prefix_bits)"""
+    ones = np.flatnonzero(ref_bits)
+    return int(ones[0]) if len(ones) else len(ref_bits)
+
+
+def score_messages(frames, ref_bits, repetition):
+    """
+    Compare candidate messages with the reference, as Receiver_Code.m
+
+    Args:
+        frames: (..., 128 * repetition) frame bits, one candidate message each
+        ref_bits: 128 reference bits (refBits)
+        repetition: Repetition factor
+
+    Returns:
+        (hits, prefix length per longest_prefix_bits(), raw frame errors against the repeated reference)
+    """
+    expected = np.repeat(ref_bits.astype(bool), repetition)
+    raw_errors = np.count_nonzero(frames != expected, axis=-1).astype(np.int32)
+    mismatch = majority_decode(frames, repetition).astype(bool) != ref_bits.astype(bool)
+    hits = (len(ref_bits) - np.count_nonzero(mismatch, axis=-1)).astype(np.int16)
+    prefix = np.where(mismatch.any(axis=-1), mismatch.argmax(axis=-1), len(ref_bits))
+    prefix[prefix <= zero_lead(ref_bits)] = 0
+    return hits, prefix.astype(np.int16), raw_errors
+
+
+def rank(results):
+    """Order results best first: success rate, then prefix length, then raw BER"""
+    raw_ber = results["raw_errors"] / np.maximum(results["raw_frames"], 1)
+    return results[np.lexsort((raw_ber, -results["prefix_len"].astype(np.int32),
+                               -results["hits"].astype(np.int32)))]
+
+
+def _attach_frames(name, shape, ref_bits, keep):
+    """Pool initializer: map the shared (frames, bins) power matrix into this worker"""
+    memory = shared_memory.SharedMemory(name=name)
+    _shared.update(memory=memory, power=np.ndarray(shape, dtype=np.float32, buffer=memory.buf),
+                   ref_bits=ref_bits, keep=keep)
+
+
+def evaluate_band(center_mhz, bandwidth_mhz, columns, thresholds, starts, repetitions):
+    """
+    Evaluate every (threshold, start, repetition) combination of one band
+
+    The band power (bandpass_filter() then max()) is taken once from the
+    shared matrix; all thresholds are applied at once by broadcasting, and the
+    candidate messages of a block of start offsets are read as one strided
+    window view, so the loops only run over repetitions and start blocks.
+
+    Args:
+        center_mhz, bandwidth_mhz: Band, for the result rows
+        columns: (first, last) column of the band in the shared matrix
+        thresholds: Thresholds (trigger + epsilon) in dB
+        starts: 0-based start frames (start_index - 1)
+        repetitions: Repetition factors
+
+    Returns:
+        (combinations evaluated, best combinations as a ranked RESULT_DTYPE array)
+    """
+    power = _shared["power"]
+    ref_bits = _shared["ref_bits"]
+    band = power[:, columns[0]:columns[1] + 1].max(axis=1)
+    bits = band[None, :] > np.asarray(thresholds, dtype=np.float32)[:, None]  # (thresholds, frames)
+    kept = []
+    evaluated = 0
+    for repetition in repetitions:
+        length = len(ref_bits) * repetition
+        valid = starts[starts + length <= len(band)]
+        if not len(valid):
+            continue
+        windows = np.lib.stride_tricks.sliding_window_view(bits, length, axis=1)
+        step = max(1, CHUNK_ELEMENTS // (len(thresholds) * length))
+        for first in range(0, len(valid), step):
+            block = valid[first:first + step]
+            hits, prefix, raw_errors = score_messages(windows[:, block], ref_bits, repetition)
+            rows = np.empty(hits.size, dtype=RESULT_DTYPE)
+            rows["center_mhz"] = center_mhz
+            rows["bandwidth_mhz"] = bandwidth_mhz
+            rows["threshold_db"] = np.repeat(thresholds, len(block))
+            rows["start_index"] = np.tile(block + 1, len(thresholds))
+            rows["repetition"] = repetition
+            rows["hits"] = hits.ravel()
+            rows["prefix_len"] = prefix.ravel()
+            rows["raw_errors"] = raw_errors.ravel()
+            rows["raw_frames"] = length
+            kept.append(rank(rows)[:_shared["keep"]])
+            evaluated += rows.size
+        kept = [rank(np.concatenate(kept))[:_shared["keep"]]]
+    return evaluated, kept[0] if kept else np.empty(0, dtype=RESULT_DTYPE)
+
+
+def band_columns(freqs_mhz, center_mhz, bandwidth_mhz):
+    """(first, last) column of the bins within [center +- bandwidth / 2], or None; bins are sorted by frequency"""
+    columns = np.flatnonzero((freqs_mhz >= center_mhz - bandwidth_mhz / 2) & (freqs_mhz <= center_mhz + bandwidth_mhz / 2))
+    return (int(columns[0]), int(columns[-1])) if len(columns) else None
+
+
+def write_results(path, results):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(RESULT_COLUMNS)
+        for index, row in enumerate(results, start=1):
+            writer.writerow([index, f"{row['center_mhz']:.6f}", f"{row['bandwidth_mhz']:.6f}",
+                             f"{row['threshold_db']:.4f}", row['start_index'], row['repetition'],
+                             f"{100 * row['hits'] / MESSAGE_BITS:.2f}", MESSAGE_BITS - row['hits'],
+                             row['prefix_len'], f"{100 * row['prefix_len'] / MESSAGE_BITS:.2f}",
+                             f"{row['raw_errors'] / row['raw_frames']:.6f}"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-core grid search of the Receiver_Code.m detector settings')
+    parser.add_argument('capture', help='WAV or raw interleaved IQ capture of the reference message')
+    parser.add_argument('--format', choices=['wav'] + list(RAW_FORMATS), help='Capture format (default: from extension)')
+    parser.add_argument('--fs', type=float, help='Sample rate in Hz (raw captures)')
+    parser.add_argument('--iq', action='store_true', help='Use a 2-channel WAV as I/Q instead of averaging to mono')
+    parser.add_argument('--center-freq', type=float, default=CENTER_FREQ,
+                       help=f'SDR center frequency in Hz (default: {CENTER_FREQ:g})')
+    parser.add_argument('--ref', default=RTL_KEY.hex().upper(),
+                       help='Transmitted message, refBits (hex/binary, default: the RTL key)')
+    parser.add_argument('--centers', default=f"{BAND_CENTER_MHZ - 0.001}:{BAND_CENTER_MHZ + 0.001}:0.0005",
+                       help='Band centers in MHz, start:stop:step or a list (default: the band center +- 1 kHz)')
+    parser.add_argument('--bandwidths', default=f"{BANDWIDTH_MHZ / 2}:{BANDWIDTH_MHZ * 2}:{BANDWIDTH_MHZ / 2}",
+                       help=f'Band widths in MHz (default: {BANDWIDTH_MHZ / 2}-{BANDWIDTH_MHZ * 2})')
+    parser.add_argument('--thresholds', default=None,
+                       help='Thresholds (trigger + epsilon) in dB, written as --thresholds=-40:-20:0.5 '
+                            '(default: Otsu threshold of the first band +- 10 dB)')
+    parser.add_argument('--threshold-step', type=float, default=0.25,
+                       help='Spacing of the default thresholds in dB (default: 0.25)')
+    parser.add_argument('--starts', default=None,
+                       help='start_index values, 1-based like Receiver_Code.m (default: every frame)')
+    parser.add_argument('--repetitions', default="5", help='Repetition factors (default: 5)')
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_DIR, default=None, metavar='DIR',
+                       help=f'Reuse the spectrogram from a persistent cache (default DIR: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                       help='Worker processes (default: number of CPUs)')
+    parser.add_argument('--top', type=int, default=10, help='Ranked settings to print (default: 10)')
+    parser.add_argument('--keep', type=int, default=KEEP, help=f'Ranked settings to keep and write (default: {KEEP})')
+    parser.add_argument('-o', '--output', help='Write the kept ranked settings as CSV to this file')
+
+    args = parser.parse_args()
+
+    if args.jobs <= 0 or args.top <= 0 or args.keep <= 0 or args.threshold_step <= 0:
+        print("Error: --jobs, --top, --keep and --threshold-step must be positive")
+        sys.exit(1)
+    try:
+        ref_bits = np.unpackbits(np.frombuffer(parse_payload(args.ref)[0].to_bytes(MESSAGE_BITS // 8, 'big'),
+                                               dtype=np.uint8))
+        centers = parse_grid(args.centers)
+        bandwidths = parse_grid(args.bandwidths)
+        repetitions = parse_grid(args.repetitions, integer=True)
+        if (bandwidths <= 0).any() or (repetitions <= 0).any():
+            raise ValueError("Band widths and repetition factors must be positive")
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    start_time = time.perf_counter()
+    # Only the bins the widest band can reach are kept
+    span_mhz = 2 * float(np.max(np.abs(centers - args.center_freq / 1e6) + bandwidths.max() / 2)) + 2 / DT_TARGET / 1e6
+    try:
+        capture = Capture(args.capture, args.format, args.fs, args.iq)
+        if args.cache:
+            power, freqs_mhz, hit = cached_spectrogram(SpectrogramCache(args.cache), capture,
+                                                       center_freq=args.center_freq, span_mhz=round(span_mhz, 6))
+            source = f"cache {'hit' if hit else 'miss'}"
+        else:
+            shape, blocks, freqs_mhz = spectrogram_blocks(capture, center_freq=args.center_freq, span_mhz=span_mhz)
+            power = np.concatenate(list(blocks) or [np.zeros((0, shape[1]), np.float32)])
+            source = "computed"
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    frames = power.shape[0]
+
+    bands = []
+    for center in centers:
+        for bandwidth in bandwidths:
+            columns = band_columns(freqs_mhz, center, bandwidth)
+            if columns is None:
+                print(f"⚠️  No bin within {center:.6f} MHz +- {bandwidth / 2 * 1e3:.3f} kHz, skipped")
+            else:
+                bands.append((float(center), float(bandwidth), columns))
+    if not bands:
+        print("Error: No band of the grid contains a spectrogram bin")
+        sys.exit(1)
+
+    try:
+        if args.thresholds:
+            thresholds = parse_grid(args.thresholds)
+        else:
+            first, last = bands[0][2]
+            middle, _ = otsu_threshold(np.asarray(power[:, first:last + 1]).max(axis=1))
+            thresholds = middle + args.threshold_step * np.arange(-int(10 / args.threshold_step),
+                                                                  int(10 / args.threshold_step) + 1)
+        starts = parse_grid(args.starts, integer=True) - 1 if args.starts else np.arange(frames)
+        if (starts < 0).any():
+            raise ValueError("start_index values start at 1")
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    thresholds = thresholds.astype(np.float32)
+
+    combinations = len(bands) * len(thresholds) * len(starts) * len(repetitions)
+    print(f"Capture: {args.capture}, {capture.fs:g} Hz, {capture.duration:.3f} seconds")
+    print(f"Spectrogram ({source}): {frames} frames x {power.shape[1]} bins, "
+          f"{freqs_mhz[0]:.6f}-{freqs_mhz[-1]:.6f} MHz, {power.shape[0] * power.shape[1] * 4 / 1e6:.1f} MB shared")
+    print(f"Grid: {len(bands)} bands x {len(thresholds)} thresholds x {len(starts)} starts x "
+          f"{len(repetitions)} repetition factor(s) = {combinations:,} combinations, {args.jobs} worker(s)")
+
+    # The power matrix is copied once into shared memory; workers map it instead of receiving copies
+    memory = shared_memory.SharedMemory(create=True, size=max(1, power.shape[0] * power.shape[1] * 4))
+    try:
+        np.ndarray(power.shape, dtype=np.float32, buffer=memory.buf)[:] = power
+        results = []
+        evaluated = 0
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=_attach_frames,
+                                 initargs=(memory.name, power.shape, ref_bits, args.keep)) as executor:
+            futures = {executor.submit(evaluate_band, center, bandwidth, columns, thresholds, starts, repetitions):
+                       (center, bandwidth) for center, bandwidth, columns in bands}
+            for done, future in enumerate(as_completed(futures), start=1):
+                center, bandwidth = futures[future]
+                count, best = future.result()
+                evaluated += count
+                results.append(best)
+                status = (f"best {100 * best[0]['hits'] / MESSAGE_BITS:.2f}% "
+                          f"(threshold {best[0]['threshold_db']:.2f} dB, start_index {best[0]['start_index']}, "
+                          f"n={best[0]['repetition']})" if len(best) else "no complete message")
+                print(f"[{done}/{len(bands)}] {center:.6f} MHz +- {bandwidth / 2 * 1e3:.3f} kHz: {status}")
+    finally:
+        memory.close()
+        memory.unlink()
+    results = rank(np.concatenate(results))[:args.keep]
+    elapsed = time.perf_counter() - start_time
+
+    if args.output:
+        try:
+            write_results(args.output, results)
+        except OSError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
+    print(f"\n{'='*60}")
+    print(f"DETECTOR GRID SEARCH SUMMARY")
+    print(f"{'='*60}")
+    if not len(results):
+        print("❌ No combination leaves room for a complete message; check --starts and --repetitions")
+        sys.exit(1)
+    print(f"{'rank':>4} {'center MHz':>11} {'bw kHz':>7} {'threshold':>9} {'start':>6} {'n':>2} "
+          f"{'success':>8} {'prefix':>6} {'raw BER':>8}")
+    for index, row in enumerate(results[:args.top], start=1):
+        print(f"{index:>4} {row['center_mhz']:>11.6f} {row['bandwidth_mhz'] * 1e3:>7.3f} {row['threshold_db']:>9.4f} "
+              f"{row['start_index']:>6} {row['repetition']:>2} {100 * row['hits'] / MESSAGE_BITS:>7.2f}% "
+              f"{row['prefix_len']:>6} {row['raw_errors'] / row['raw_frames']:>8.5f}")
+    best = results[0]
+    mark = "✅" if best["hits"] == MESSAGE_BITS else "⚠️ "
+    print(f"{mark} Receiver_Code.m: trigger={best['threshold_db']:.4f}; epsilon=0; start_index={best['start_index']}; "
+          f"bandpass_filter(f_abs_MHz, power_dB(:,k), {best['center_mhz']:.6f}, {best['bandwidth_mhz']:.6f}) "
+          f"with {best['repetition']}x repetition")
+    if args.output:
+        print(f"Ranked settings: {args.output}")
+    print(f"Evaluated {evaluated:,} combinations in {elapsed:.3f} seconds "
+          f"({evaluated / elapsed if elapsed > 0 else float('inf'):,.0f}/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+
+# Environment variables read by serial_transport.get_transport()
+JSONL_ENV = "FPGA_METRICS_JSONL"
+PROM_ENV = "FPGA_METRICS_PROM"
+
+# Phases derived from the four timestamps of a transaction
+PHASES = ("write", "first_byte", "response", "total")
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class LatencyHistogram:
+    """
+    HDR-style log-linear histogram of nanosecond values
+
+    Every power of two is split into 2**SUB_BITS linear sub-buckets, so any
+    recorded value is reproduced within 1/2**SUB_BITS (~1.6%) relative error
+    while memory stays proportional to the dynamic range, not the count.
+    """
+
+    SUB_BITS = 6
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def _index(cls, value):
+        if value < (1 << cls.SUB_BITS):
+            return value
+        shift = value.bit_length() - cls.SUB_BITS - 1
+        return ((shift + 1) << cls.SUB_BITS) + (value >> shift) - (1 << cls.SUB_BITS)
+
+    @classmethod
+    def _value(cls, index):
+        """Midpoint of the values falling into bucket `index`"""
+        if index < (1 << cls.SUB_BITS):
+            return index
+        shift = (index >> cls.SUB_BITS) - 1
+        mantissa = (index & ((1 << cls.SUB_BITS) - 1)) + (1 << cls.SUB_BITS)
+        return (mantissa << shift) + ((1 << shift) >> 1)
+
+    def record(self, value):
+        value = max(0, int(value))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        if not self.count:
+            return 0
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "min_ns": self.min or 0, "max_ns": self.max or 0,
+                "mean_ns": self.total / self.count if self.count else 0,
+                **{f"p{q * 100:g}_ns": self.percentile(q) for q in QUANTILES}}
+
+
+class TransactionRecorder:
+    """
+    Collects per-transaction timestamps from serial_transport
+
+    Each transaction carries monotonic nanosecond timestamps for write
+    start, write done, first response byte and full response (ack). They
+    are appended to a JSONL file as they complete and folded into one
+    LatencyHistogram per (kind, phase), which is exported as a Prometheus
+    textfile (summary metrics) every `prom_interval` seconds and on close.
+    """
+
+    def __init__(self, jsonl_path=None, prom_path=None, prom_interval=10.0):
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.prom_interval = prom_interval
+        self.histograms = {}
+        self.outcomes = {}
+        self._jsonl = open(jsonl_path, 'a', buffering=1 << 16) if jsonl_path else None
+        self._lock = threading.Lock()
+        self._last_export = time.monotonic()
+
+    def record(self, kind, port, write_start_ns, write_done_ns, first_byte_ns, ack_ns,
+               bytes_out, bytes_in, ok):
+        """Record one finished transaction; missing timestamps are None"""
+        phases = {"write": (write_start_ns, write_done_ns),
+                  "first_byte": (write_done_ns, first_byte_ns),
+                  "response": (first_byte_ns, ack_ns),
+                  "total": (write_start_ns, ack_ns)}
+        outcome = "ok" if ok else "timeout"
+        with self._lock:
+            for phase, (start, end) in phases.items():
+                if start is not None and end is not None:
+                    key = (kind, phase)
+                    if key not in self.histograms:
+                        self.histograms[key] = LatencyHistogram()
+                    self.histograms[key].record(end - start)
+            self.outcomes[(kind, outcome)] = self.outcomes.get((kind, outcome), 0) + 1
+            if self._jsonl is not None:
+                self._jsonl.write(json.dumps({
+                    "wall_time": time.time(), "kind": kind, "port": port,
+                    "write_start_ns": write_start_ns, "write_done_ns": write_done_ns,
+                    "first_byte_ns": first_byte_ns, "ack_ns": ack_ns,
+                    "bytes_out": bytes_out, "bytes_in": bytes_in, "outcome": outcome}) + "\n")
+        if self.prom_path and time.monotonic() - self._last_export >= self.prom_interval:
+            self.export_prometheus()
+
+    def export_prometheus(self):
+        """Atomically rewrite the Prometheus textfile (node_exporter textfile collector format)"""
+        if not self.prom_path:
+            return
+        with self._lock:
+            lines = ["# HELP fpga_host_latency_seconds Host-side serial transaction latency by phase",
+                     "# TYPE fpga_host_latency_seconds summary"]
+            for (kind, phase), histogram in sorted(self.histograms.items()):
+                labels = f'kind="{kind}",phase="{phase}"'
+                for q in QUANTILES:
+                    lines.append(f'fpga_host_latency_seconds{{{labels},quantile="{q}"}} '
+                                 f'{histogram.percentile(q) / 1e9:.9f}')
+                lines.append(f'fpga_host_latency_seconds_sum{{{labels}}} {histogram.total / 1e9:.9f}')
+                lines.append(f'fpga_host_latency_seconds_count{{{labels}}} {histogram.count}')
+            lines += ["# HELP fpga_host_transactions_total Serial transactions by outcome",
+                      "# TYPE fpga_host_transactions_total counter"]
+            for (kind, outcome), count in sorted(self.outcomes.items()):
+                lines.append(f'fpga_host_transactions_total{{kind="{kind}",outcome="{outcome}"}} {count}')
+            self._last_export = time.monotonic()
+        tmp_path = f"{self.prom_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prom_path)
+
+    def close(self):
+        self.export_prometheus()
+        if self._jsonl is not None:
+            self._jsonl.close()
+            self._jsonl = None
+
+
+def recorder_from_env():
+    """Build a recorder from FPGA_METRICS_JSONL / FPGA_METRICS_PROM, or None if both are unset"""
+    jsonl_path = os.environ.get(JSONL_ENV)
+    prom_path = os.environ.get(PROM_ENV)
+    if not jsonl_path and not prom_path:
+        return None
+    return TransactionRecorder(jsonl_path, prom_path)
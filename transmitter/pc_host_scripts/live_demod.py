@@ -0,0 +1,371 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from fsk_acquire import PREAMBLE
+from fsk_decode import MESSAGE_BITS, majority_decode
+from fsk_demod import (CENTER_FREQ, BAND_CENTER_MHZ, BANDWIDTH_MHZ, TRIGGER, RAW_FORMATS,
+                       Capture, FskDemodulator, raw_to_complex)
+from payload_reader import parse_payload
+
+RTL_TCP_MAGIC = b"RTL0"        # rtl_tcp sends a 12-byte dongle info header before the samples
+RTL_TCP_HEADER_SIZE = 12
+
+
+class MessageSync:
+    """
+    Find messages in the stream of frame bits and majority-decode them
+
+    The modulator repeats every bit `repetition` times in a row, one frame
+    per repeat. A message start is a frame position where the majority
+    decode of the next len(preamble) groups equals the preamble; of a run of
+    adjacent matching positions the middle one is taken, which centers the
+    groups on the repeats. Once 128 * repetition frames are in, the message
+    is decoded with ties resolving to 0, like repetition_code_decoder().
+    """
+
+    def __init__(self, repetition, preamble=PREAMBLE, message_bits=MESSAGE_BITS):
+        self.repetition = repetition
+        self.preamble = np.frombuffer(preamble.encode('ascii'), dtype=np.uint8) - ord('0')
+        self.message_frames = message_bits * repetition
+        self._buffer = np.zeros(0, dtype=np.uint8)
+        self._base = 0     # absolute frame index of _buffer[0]
+        self._start = None
+
+    def reset(self):
+        """Forget buffered frames, e.g. after samples were dropped"""
+        self._base += len(self._buffer)
+        self._buffer = np.zeros(0, dtype=np.uint8)
+        self._start = None
+
+    def skip(self, frames):
+        """Account for `frames` frames that were never demodulated"""
+        self.reset()
+        self._base += frames
+
+    def _find_start(self):
+        n, length = self.repetition, len(self.preamble) * self.repetition
+        positions = len(self._buffer) - length + 1
+        if positions <= 0:
+            return None
+        ones = np.concatenate(([0], np.cumsum(self._buffer, dtype=np.int32)))
+        starts = np.arange(positions)
+        match = np.ones(positions, dtype=bool)
+        for j, bit in enumerate(self.preamble):
+            count = ones[starts + (j + 1) * n] - ones[starts + j * n]
+            match &= (2 * count > n) == bool(bit)
+        candidates = np.flatnonzero(match)
+        if not len(candidates):
+            # Keep only the frames that could still begin a preamble
+            drop = positions
+            self._buffer = self._buffer[drop:]
+            self._base += drop
+            return None
+        first = candidates[0]
+        run_end = first
+        while run_end + 1 < positions and match[run_end + 1]:
+            run_end += 1
+        if run_end == positions - 1:
+            return None  # the run may continue into frames not received yet
+        return (first + run_end) // 2
+
+    def feed(self, bits):
+        """
+        Add frame bits
+
+        Returns: list of (start frame index, 128-bit message as uint8 bits)
+        """
+        self._buffer = np.concatenate((self._buffer, bits))
+        messages = []
+        while True:
+            if self._start is None:
+                self._start = self._find_start()
+                if self._start is None:
+                    return messages
+            end = self._start + self.message_frames
+            if len(self._buffer) < end:
+                return messages
+            message = majority_decode(self._buffer[self._start:end], self.repetition)
+            messages.append((self._base + self._start, message))
+            self._buffer = self._buffer[end:]
+            self._base += end
+            self._start = None
+
+
+class LiveStats:
+    def __init__(self):
+        self.chunks = 0
+        self.dropped_chunks = 0
+        self.dropped_samples = 0
+        self.frames = 0
+        self.messages = 0
+        self.latencies = []
+        self.start_time = time.monotonic()
+
+
+async def read_source(source, fmt, chunk_bytes, queue, stats, executor):
+    """
+    Read the IQ source in fixed-size chunks and queue them with their arrival time
+
+    The queue is bounded: when the demodulator falls behind, new chunks are
+    dropped (and counted) instead of piling up, which bounds the latency.
+    A (None, dropped samples) entry marks a gap left by dropped chunks, None the end of the stream.
+    """
+    loop = asyncio.get_running_loop()
+    if source.startswith('tcp://'):
+        host, _, port = source[len('tcp://'):].rpartition(':')
+        reader, writer = await asyncio.open_connection(host or 'localhost', int(port))
+        header = await reader.readexactly(len(RTL_TCP_MAGIC))
+        if header == RTL_TCP_MAGIC:
+            await reader.readexactly(RTL_TCP_HEADER_SIZE - len(RTL_TCP_MAGIC))
+            pending = b''
+        else:
+            pending = header
+
+        async def read_chunk():
+            nonlocal pending
+            data, pending = pending, b''
+            try:
+                return data + await reader.readexactly(chunk_bytes - len(data))
+            except asyncio.IncompleteReadError as e:
+                return e.partial
+
+        close = writer.close
+    else:
+        f = sys.stdin.buffer if source == '-' else open(source, 'rb')  # a FIFO blocks here until a writer opens it
+
+        def read_exact():
+            data = b''
+            while len(data) < chunk_bytes:
+                piece = f.read(chunk_bytes - len(data))
+                if not piece:
+                    break
+                data += piece
+            return data
+
+        async def read_chunk():
+            return await loop.run_in_executor(executor, read_exact)
+
+        close = (lambda: None) if source == '-' else f.close
+
+    sample_size = 2 * np.dtype(RAW_FORMATS[fmt][0]).itemsize
+    gap = 0  # samples dropped since the last queued chunk
+    try:
+        while True:
+            data = await read_chunk()
+            data = data[:len(data) // sample_size * sample_size]
+            if not data:
+                break
+            stats.chunks += 1
+            try:
+                if gap:
+                    queue.put_nowait((None, gap))
+                    gap = 0
+                queue.put_nowait((time.monotonic(), data))
+            except asyncio.QueueFull:
+                gap += len(data) // sample_size
+                stats.dropped_chunks += 1
+                stats.dropped_samples += len(data) // sample_size
+                print(f"⚠️  Demodulator behind, dropped {len(data) // sample_size} samples "
+                      f"({stats.dropped_chunks} chunks so far)", flush=True)
+    finally:
+        close()
+        await queue.put(None)
+
+
+async def demodulate_stream(queue, demod, sync, fmt, stats, executor, args, out):
+    """Demodulate queued chunks off the event loop and emit every completed message"""
+    loop = asyncio.get_running_loop()
+    reference = parse_payload(args.ref)[0] if args.ref else None
+
+    def process(data):
+        bits, _ = demod.process(raw_to_complex(data, fmt))
+        return bits, sync.feed(bits)
+
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        arrival, data = item
+        if arrival is None:
+            # Samples were dropped: restart framing and sync on the next chunk, and move the frame
+            # index past the dropped samples and the discarded partial frame
+            skipped = data + demod.reset()
+            sync.skip(int(np.floor(skipped / demod.frame_len + 0.5)))
+            continue
+        bits, messages = await loop.run_in_executor(executor, process, data)
+        stats.frames += len(bits)
+        for start_frame, message in messages:
+            latency = time.monotonic() - arrival
+            stats.messages += 1
+            stats.latencies.append(latency)
+            value = int.from_bytes(np.packbits(message).tobytes(), byteorder='big')
+            record = {"time": datetime.now().isoformat(timespec='milliseconds'), "frame": int(start_frame),
+                      "message": f"{value:032X}", "latency_ms": round(latency * 1000, 3)}
+            line = f"[{record['time']}] frame {start_frame}: {record['message']} (latency {latency * 1000:.1f} ms)"
+            if reference is not None:
+                errors = bin(value ^ reference).count('1')
+                record["bit_errors"] = errors
+                line += " ✅" if errors == 0 else f" ❌ {errors} bit errors"
+            print(line, flush=True)
+            if out is not None:
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+
+
+async def report_status(stats, queue, interval):
+    while True:
+        await asyncio.sleep(interval)
+        elapsed = time.monotonic() - stats.start_time
+        print(f"[status {elapsed:8.1f} s] frames {stats.frames}, messages {stats.messages}, "
+              f"queue {queue.qsize()}/{queue.maxsize}, dropped {stats.dropped_chunks} chunks "
+              f"({stats.dropped_samples} samples)", flush=True)
+
+
+def print_summary(stats):
+    print(f"\n{'='*60}")
+    print(f"LIVE DEMODULATION SUMMARY")
+    print(f"{'='*60}")
+    elapsed = time.monotonic() - stats.start_time
+    print(f"Run time: {elapsed:.3f} seconds, chunks {stats.chunks}, frames {stats.frames}")
+    print(f"Messages: {stats.messages}")
+    print(f"Dropped: {stats.dropped_chunks} chunks ({stats.dropped_samples} samples)")
+    if stats.latencies:
+        latencies = sorted(stats.latencies)
+        p99 = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]
+        print(f"Latency: mean {sum(latencies) / len(latencies) * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms, "
+              f"max {latencies[-1] * 1000:.1f} ms")
+
+
+async def receive(args):
+    if args.format not in RAW_FORMATS:
+        print(f"Error: Unknown format '{args.format}'")
+        sys.exit(1)
+    if args.ref:
+        try:
+            parse_payload(args.ref)
+        except ValueError as e:
+            print(f"Error: Invalid --ref: {e}")
+            sys.exit(1)
+    if args.preamble.strip('01') or not args.preamble:
+        print("Error: --preamble must be a string of 0/1")
+        sys.exit(1)
+    try:
+        demod = FskDemodulator(args.fs, True, args.center_freq, args.band, args.bandwidth,
+                               trigger=args.trigger, epsilon=args.epsilon)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    sync = MessageSync(args.repetition, args.preamble)
+    stats = LiveStats()
+
+    chunk_samples = max(1, int(args.chunk_ms / 1000 * args.fs))
+    chunk_bytes = chunk_samples * 2 * np.dtype(RAW_FORMATS[args.format][0]).itemsize
+    queue = asyncio.Queue(maxsize=args.queue)
+    print(f"Receiving {args.format} IQ at {args.fs:g} Hz from {args.source}: chunks of {args.chunk_ms:g} ms, "
+          f"queue of {args.queue} chunks (latency bound ~{args.queue * args.chunk_ms:g} ms + processing)",
+          flush=True)
+
+    out = open(args.output, 'a') if args.output else None
+    # One thread blocks on the source, the other runs NumPy, so neither stalls the event loop
+    reader_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="iq-reader")
+    demod_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="demod")
+    status = asyncio.create_task(report_status(stats, queue, args.status_interval))
+    try:
+        await asyncio.gather(read_source(args.source, args.format, chunk_bytes, queue, stats, reader_executor),
+                             demodulate_stream(queue, demod, sync, args.format, stats, demod_executor, args, out))
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        status.cancel()
+        reader_executor.shutdown(wait=False)
+        demod_executor.shutdown(wait=False)
+        if out is not None:
+            out.close()
+        print_summary(stats)
+
+
+async def serve(args):
+    """Replay a capture as an rtl_tcp-style cu8 stream, paced at `rate` times real time"""
+    try:
+        capture = Capture(args.capture, args.format, args.fs, args.iq)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    chunk_samples = max(1, int(args.chunk_ms / 1000 * capture.fs))
+
+    async def handle(reader, writer):
+        peer = writer.get_extra_info('peername')
+        print(f"Client {peer} connected, streaming {capture.duration:.3f} seconds of samples", flush=True)
+        writer.write(RTL_TCP_MAGIC + bytes(RTL_TCP_HEADER_SIZE - len(RTL_TCP_MAGIC)))
+        start = time.monotonic()
+        sent = 0
+        try:
+            for block in capture.blocks(chunk_samples):
+                iq = np.empty((len(block), 2))
+                iq[:, 0] = block.real
+                iq[:, 1] = block.imag if np.iscomplexobj(block) else 0.0
+                writer.write(np.clip(np.round(iq * 127.5 + 127.5), 0, 255).astype(np.uint8).tobytes())
+                await writer.drain()
+                sent += len(block)
+                if args.rate > 0:
+                    await asyncio.sleep(max(0.0, start + sent / capture.fs / args.rate - time.monotonic()))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+        print(f"Client {peer} done, {sent} samples sent", flush=True)
+
+    server = await asyncio.start_server(handle, args.host, args.port)
+    print(f"Serving {args.capture} ({capture.fs:g} Hz) as cu8 IQ on tcp://{args.host}:{args.port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Real-time FSK demodulation of a streaming IQ source')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    rx = subparsers.add_parser('rx', help='Demodulate a live IQ stream and print the decoded messages')
+    rx.add_argument('source', help="'-' for stdin, a FIFO/file path, or tcp://HOST:PORT (rtl_tcp)")
+    rx.add_argument('--fs', type=float, required=True, help='Sample rate in Hz')
+    rx.add_argument('--format', default='cu8', choices=list(RAW_FORMATS), help='Sample format (default: cu8)')
+    rx.add_argument('-n', '--repetition', type=int, default=5, help='Repetition factor of the transmitter (default: 5)')
+    rx.add_argument('--preamble', default=PREAMBLE, help=f'Message start pattern (default: {PREAMBLE})')
+    rx.add_argument('--ref', help='Expected message (hex/binary) to count bit errors against')
+    rx.add_argument('--center-freq', type=float, default=CENTER_FREQ, help='SDR center frequency in Hz')
+    rx.add_argument('--band', type=float, default=BAND_CENTER_MHZ, help='Mark tone band center in MHz')
+    rx.add_argument('--bandwidth', type=float, default=BANDWIDTH_MHZ, help='Band width in MHz')
+    rx.add_argument('--trigger', type=float, default=TRIGGER, help=f'Threshold in dB (default: {TRIGGER})')
+    rx.add_argument('--epsilon', type=float, default=0.0, help='Offset added to the threshold in dB')
+    rx.add_argument('--chunk-ms', type=float, default=20.0, help='Samples per read in ms (default: 20)')
+    rx.add_argument('--queue', type=int, default=10,
+                    help='Chunks buffered before new ones are dropped (default: 10)')
+    rx.add_argument('--status-interval', type=float, default=5.0, help='Status line interval in seconds')
+    rx.add_argument('-o', '--output', help='Append decoded messages as JSON lines to this file')
+
+    srv = subparsers.add_parser('serve', help='Replay a capture as an rtl_tcp-style stream (local stand-in)')
+    srv.add_argument('capture', help='WAV or raw IQ capture')
+    srv.add_argument('--format', choices=['wav'] + list(RAW_FORMATS), help='Capture format (default: from extension)')
+    srv.add_argument('--fs', type=float, help='Sample rate in Hz (raw captures)')
+    srv.add_argument('--iq', action='store_true', help='Use a 2-channel WAV as I/Q')
+    srv.add_argument('--host', default='127.0.0.1', help='Listen address (default: 127.0.0.1)')
+    srv.add_argument('--port', type=int, default=1234, help='Listen port (default: 1234, as rtl_tcp)')
+    srv.add_argument('--rate', type=float, default=1.0, help='Replay speed, 0 for as fast as possible (default: 1)')
+    srv.add_argument('--chunk-ms', type=float, default=10.0, help='Samples per write in ms (default: 10)')
+
+    args = parser.parse_args()
+    try:
+        asyncio.run(receive(args) if args.command == 'rx' else serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
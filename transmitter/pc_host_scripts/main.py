@@ -1,7 +1,8 @@
-import serial
-import time
+import asyncio
 import sys
 
+from serial_transport import get_transport, close_all
+
 # Check command line arguments
 if len(sys.argv) < 2 or len(sys.argv) > 3:
     print("Usage: python main.py <on/off> [frequency]")
@@ -26,31 +27,30 @@ frequency_map = {
     "360m"   : "07"
 }
 
-p_ser = serial.Serial(port="COM9", baudrate=57600, bytesize=serial.EIGHTBITS, parity=serial.PARITY_NONE,
-                           stopbits=serial.STOPBITS_ONE, timeout=30, xonxoff=0, rtscts=0, dsrdtr=0)
+async def run():
+    transport = await get_transport()
+    try:
+        if command == "off":
+            read_data = await transport.send_conf("0000")
+            print(read_data, "OFF")
 
-if command == "off":
-    conf_byte = "0000"
-    p_ser.write(bytes.fromhex(conf_byte))
-    read_data = p_ser.read(2)
-    print(read_data, "OFF")
-    
-elif command == "on":
-    if len(sys.argv) != 3:
-        print("Error: 'on' command requires a frequency argument")
-        print("Available frequencies: 12k, 50k, 120k, 12m, 55.386m, 120m, 360m")
-        sys.exit(1)
-    
-    frequency = sys.argv[2].lower()
-    
-    if frequency not in frequency_map:
-        print(f"Invalid frequency: {frequency}")
-        print("Available frequencies: 12k, 50k, 120k, 12m, 55.386m, 120m, 360m")
-        sys.exit(1)
-    
-    conf_byte = "FF" + frequency_map[frequency]
-    p_ser.write(bytes.fromhex(conf_byte))
-    read_data = p_ser.read(2)
-    print(read_data, f"ON - {frequency.upper()}")
+        elif command == "on":
+            if len(sys.argv) != 3:
+                print("Error: 'on' command requires a frequency argument")
+                print("Available frequencies: 12k, 50k, 120k, 12m, 55.386m, 120m, 360m")
+                sys.exit(1)
+
+            frequency = sys.argv[2].lower()
+
+            if frequency not in frequency_map:
+                print(f"Invalid frequency: {frequency}")
+                print("Available frequencies: 12k, 50k, 120k, 12m, 55.386m, 120m, 360m")
+                sys.exit(1)
+
+            conf_byte = "FF" + frequency_map[frequency]
+            read_data = await transport.send_conf(conf_byte)
+            print(read_data, f"ON - {frequency.upper()}")
+    finally:
+        await close_all()
 
-p_ser.close()
\ No newline at end of file
+asyncio.run(run())
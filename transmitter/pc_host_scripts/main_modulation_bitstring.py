@@ -1,80 +1,248 @@
-import serial
+import asyncio
 import sys
 import time
 
-# Check command line arguments
-if len(sys.argv) < 2 or len(sys.argv) > 3:
-    print("Usage: python main_modulation.py <on/off> [frequency/bitstring]")
-    print("For 'on': python main_modulation.py on <0/1/bitstring>")
+from serial_transport import ACK_SIZE, build_packet, get_transport, close_all
+
+FRAME_BITS = 128
+DEFAULT_SYMBOL_PERIOD_MS = 100
+
+def print_usage():
+    print("Usage: python main_modulation.py <on/off/frame> [frequency/bitstring] [symbol_time_ms] [repetition_factor]")
+    print("For 'on': python main_modulation.py on <0/1/bitstring> [symbol_period_ms]")
     print("  0 = 888 MHz frequency (always on)")
     print("  1 = 936 MHz frequency (always on)")
-    print("  bitstring = sequence of 0s and 1s (transmitted with 0.5s delay)")
+    print("  bitstring = sequence of 0s and 1s, one conf write per bit")
+    print("  symbol_period_ms = software symbol period for bitstrings (default: 100 ms)")
+    print("For 'frame': python main_modulation.py frame <bitstring|@file> <symbol_time_ms> [repetition_factor]")
+    print("  bitstring is packed into 128-bit frames timed by the FPGA (requires the key FSK bitstream)")
     print("For 'off': python main_modulation.py off")
+
+class SymbolClock:
+    """
+    Drift-free software symbol clock for the per-bit conf path
+    
+    Symbol k is released at start + k * period on the monotonic nanosecond
+    clock, so the serial round trip of each conf write is absorbed into the
+    period instead of adding to it, and errors never accumulate. The coarse
+    part of each wait is an asyncio sleep, the last SPIN_NS are busy-waited.
+    """
+    
+    SPIN_NS = 2_000_000
+    
+    def __init__(self, period_ms):
+        self.period_ns = int(period_ms * 1_000_000)
+        self.start_ns = None
+        self.index = 0
+        self.release_ns = None
+        self.errors_ns = []      # actual - target release time for every symbol
+        self.round_trips_ns = [] # conf write + echo duration for every symbol
+    
+    async def wait_next(self):
+        """Wait until the next symbol deadline, or return at once if it has passed"""
+        now = time.monotonic_ns()
+        if self.start_ns is None:
+            self.start_ns = now
+        target = self.start_ns + self.index * self.period_ns
+        self.index += 1
+        
+        remaining = target - now - self.SPIN_NS
+        if remaining > 0:
+            await asyncio.sleep(remaining / 1e9)
+        while time.monotonic_ns() < target:
+            pass
+        
+        self.release_ns = time.monotonic_ns()
+        self.errors_ns.append(self.release_ns - target)
+    
+    def mark_round_trip(self):
+        self.round_trips_ns.append(time.monotonic_ns() - self.release_ns)
+    
+    def print_report(self):
+        if not self.errors_ns:
+            return
+        errors = sorted(self.errors_ns)
+        p99 = errors[min(len(errors) - 1, int(0.99 * len(errors)))]
+        overruns = sum(1 for rtt in self.round_trips_ns if rtt > self.period_ns)
+        print(f"Target symbol period: {self.period_ns / 1e6:.3f} ms")
+        if len(self.errors_ns) > 1:
+            span = (self.errors_ns[-1] - self.errors_ns[0]) + (len(self.errors_ns) - 1) * self.period_ns
+            print(f"Actual symbol period: {span / (len(self.errors_ns) - 1) / 1e6:.3f} ms (mean)")
+        print(f"Release jitter: mean {sum(errors) / len(errors) / 1e3:.1f} us, "
+              f"p99 {p99 / 1e3:.1f} us, max {errors[-1] / 1e3:.1f} us")
+        if self.round_trips_ns:
+            rtts = sorted(self.round_trips_ns)
+            print(f"Conf round trip: min {rtts[0] / 1e6:.3f} ms, max {rtts[-1] / 1e6:.3f} ms "
+                  f"({overruns} overrun(s) of the symbol period)")
+
+def frame_bitstring(bit_data):
+    """
+    Pack an arbitrary-length bitstring into 128-bit frames
+    
+    A single '1' length marker is appended after the last data bit and the
+    final frame is zero-padded, so the receiver recovers the exact length by
+    stripping the trailing zeros and the marker. A bitstring whose length is
+    a multiple of 128 therefore gets one extra frame holding only the marker.
+    
+    Returns: list of 128-bit integers, first bit sent in the MSB
+    """
+    marked = bit_data + "1"
+    padded_length = -(-len(marked) // FRAME_BITS) * FRAME_BITS
+    marked = marked.ljust(padded_length, "0")
+    return [int(marked[i:i + FRAME_BITS], 2) for i in range(0, padded_length, FRAME_BITS)]
+
+def unframe_bitstring(frames):
+    """
+    Inverse of frame_bitstring(): recover the original bitstring from frames
+    Raises: ValueError if no length marker is present
+    """
+    bits = "".join(f"{frame:0{FRAME_BITS}b}" for frame in frames).rstrip("0")
+    if not bits:
+        raise ValueError("No length marker found in frames")
+    return bits[:-1]
+
+# Check command line arguments
+if len(sys.argv) < 2 or len(sys.argv) > 5:
+    print_usage()
     sys.exit(1)
     
 command = sys.argv[1].lower()
 
-if command not in ["on", "off"]:
-    print("Invalid command. Use 'on' or 'off'.")
+if command not in ["on", "off", "frame"]:
+    print("Invalid command. Use 'on', 'off' or 'frame'.")
     sys.exit(1)
 
-p_ser = serial.Serial(port="COM9", baudrate=57600, bytesize=serial.EIGHTBITS, parity=serial.PARITY_NONE,
-                           stopbits=serial.STOPBITS_ONE, timeout=30, xonxoff=0, rtscts=0, dsrdtr=0)
+if command == "off" and len(sys.argv) > 2:
+    print_usage()
+    sys.exit(1)
 
-if command == "off":
-    conf_byte = "0000"
-    p_ser.write(bytes.fromhex(conf_byte))
-    read_data = p_ser.read(2)
-    print(read_data, "OFF - Wave disabled")
-    
-elif command == "on":
-    if len(sys.argv) != 3:
-        print("Error: 'on' command requires a frequency/bitstring argument")
-        print("Usage: python main_modulation.py on <0/1/bitstring>")
-        print("  0 = 888 MHz frequency (always on)")
-        print("  1 = 936 MHz frequency (always on)")
-        print("  bitstring = sequence of 0s and 1s (transmitted with 0.5s delay)")
-        sys.exit(1)
+async def send_frames(transport, bit_data, symbol_time_ms, repetition_factor):
+    """
+    Send a bitstring as back-to-back 19-byte packets and let the FPGA's
+    12 MHz symbol counter time every bit
+    """
+    symbol_time_cycles = int(symbol_time_ms * 12000)  # 12000 cycles per ms at 12MHz
+    frames = frame_bitstring(bit_data)
+    airtime = symbol_time_cycles * FRAME_BITS * repetition_factor / 12_000_000
     
-    bit_data = sys.argv[2]
+    print(f"Transmitting {len(bit_data)} bits in {len(frames)} frame(s) of {FRAME_BITS} bits")
+    print(f"Symbol time: {symbol_time_ms} ms ({symbol_time_cycles} cycles), repetition factor: {repetition_factor}")
     
-    # Check if it's a valid bit string (only 0s and 1s)
-    if not all(c in '01' for c in bit_data):
-        print("Error: Input must contain only 0s and 1s")
-        print("Usage: python main_modulation.py on <0/1/bitstring>")
-        sys.exit(1)
+    start_time = time.perf_counter()
+    for i, frame in enumerate(frames):
+        await transport.send_packet(build_packet(frame, symbol_time_cycles, repetition_factor))
+        response, _ = await transport.wait_completion(ACK_SIZE, airtime + 10)  # Add 10 second buffer
+        if response is None:
+            print(f"❌ Frame {i+1}/{len(frames)} timed out!")
+            return False
+        print(f"Frame {i+1}/{len(frames)}: 0x{frame:032X} ✅")
+    elapsed = time.perf_counter() - start_time
     
-    if len(bit_data) == 1:
-        # Single bit - always on mode (original behavior)
-        freq_select = int(bit_data)
-        conf_byte = f"FFF{freq_select}"
-        p_ser.write(bytes.fromhex(conf_byte))
-        read_data = p_ser.read(2)
-        
-        freq_mhz = "888 MHz" if freq_select == 0 else "936 MHz"
-        print(read_data, f"ON - Frequency: {freq_mhz} (freq_select = {freq_select}) - ALWAYS ON")
-        
-    else:
-        # Multiple bits - transmit with delay
-        print(f"Transmitting bit sequence: {bit_data}")
-        print("Each bit transmitted for 0.5 seconds")
-        
-        for i, bit in enumerate(bit_data):
-            freq_select = int(bit)
-            conf_byte = f"FFF{freq_select}"
-            p_ser.write(bytes.fromhex(conf_byte))
-            read_data = p_ser.read(2)
-            
-            freq_mhz = "888 MHz" if freq_select == 0 else "936 MHz"
-            print(f"Bit {i+1}/{len(bit_data)}: {bit} → {freq_mhz}")
-            
-            # Wait 0.5 seconds before next bit
-            time.sleep(0.1)
-                
-        conf_byte = "0000"
-        p_ser.write(bytes.fromhex(conf_byte))
-        read_data = p_ser.read(2)
-        print(read_data, "OFF - Wave disabled")
-        print("Bit sequence transmission complete")
-
-p_ser.close()
\ No newline at end of file
+    print(f"Frame transmission complete in {elapsed:.3f} seconds "
+          f"({len(bit_data) / elapsed:.1f} payload bps, {len(frames) * airtime:.3f} s on air)")
+    return True
+
+async def run():
+    transport = await get_transport()
+    try:
+        if command == "off":
+            read_data = await transport.send_conf("0000")
+            print(read_data, "OFF - Wave disabled")
+
+        elif command == "frame":
+            if len(sys.argv) < 4:
+                print("Error: 'frame' command requires a bitstring and a symbol time")
+                print_usage()
+                sys.exit(1)
+
+            bit_data = sys.argv[2]
+            if bit_data.startswith("@"):
+                try:
+                    with open(bit_data[1:], 'r') as f:
+                        bit_data = "".join(f.read().split())
+                except OSError as e:
+                    print(f"Error: Cannot read bitstring file: {e}")
+                    sys.exit(1)
+
+            if not bit_data or not all(c in '01' for c in bit_data):
+                print("Error: Input must contain only 0s and 1s")
+                sys.exit(1)
+
+            try:
+                symbol_time_ms = float(sys.argv[3])
+                repetition_factor = int(sys.argv[4]) if len(sys.argv) == 5 else 1
+            except ValueError:
+                print("Error: Invalid symbol time or repetition factor")
+                sys.exit(1)
+
+            if not 0 < symbol_time_ms * 12000 <= 65535:
+                print(f"Error: Symbol time must be between 1/12000 and {65535/12000:.1f} ms")
+                sys.exit(1)
+
+            if repetition_factor < 1 or repetition_factor > 15:
+                print("Error: Repetition factor must be between 1 and 15")
+                sys.exit(1)
+
+            if not await send_frames(transport, bit_data, symbol_time_ms, repetition_factor):
+                sys.exit(1)
+
+        elif command == "on":
+            if len(sys.argv) not in (3, 4):
+                print("Error: 'on' command requires a frequency/bitstring argument")
+                print("Usage: python main_modulation.py on <0/1/bitstring>")
+                print("  0 = 888 MHz frequency (always on)")
+                print("  1 = 936 MHz frequency (always on)")
+                print("  bitstring = sequence of 0s and 1s (transmitted with 0.5s delay)")
+                sys.exit(1)
+
+            bit_data = sys.argv[2]
+
+            try:
+                symbol_period_ms = float(sys.argv[3]) if len(sys.argv) == 4 else DEFAULT_SYMBOL_PERIOD_MS
+            except ValueError:
+                print("Error: Invalid symbol period")
+                sys.exit(1)
+
+            if symbol_period_ms <= 0:
+                print("Error: Symbol period must be positive")
+                sys.exit(1)
+
+            # Check if it's a valid bit string (only 0s and 1s)
+            if not all(c in '01' for c in bit_data):
+                print("Error: Input must contain only 0s and 1s")
+                print("Usage: python main_modulation.py on <0/1/bitstring>")
+                sys.exit(1)
+
+            if len(bit_data) == 1:
+                # Single bit - always on mode (original behavior)
+                freq_select = int(bit_data)
+                read_data = await transport.send_conf(f"FFF{freq_select}")
+
+                freq_mhz = "888 MHz" if freq_select == 0 else "936 MHz"
+                print(read_data, f"ON - Frequency: {freq_mhz} (freq_select = {freq_select}) - ALWAYS ON")
+
+            else:
+                # Multiple bits - each conf write is issued at an absolute deadline
+                print(f"Transmitting bit sequence: {bit_data}")
+                print(f"Each bit transmitted for {symbol_period_ms} ms")
+
+                clock = SymbolClock(symbol_period_ms)
+                for i, bit in enumerate(bit_data):
+                    freq_select = int(bit)
+                    await clock.wait_next()
+                    read_data = await transport.send_conf(f"FFF{freq_select}")
+                    clock.mark_round_trip()
+
+                    freq_mhz = "888 MHz" if freq_select == 0 else "936 MHz"
+                    print(f"Bit {i+1}/{len(bit_data)}: {bit} → {freq_mhz}")
+
+                # Let the last bit last a full symbol period before switching off
+                await clock.wait_next()
+                read_data = await transport.send_conf("0000")
+                print(read_data, "OFF - Wave disabled")
+                print("Bit sequence transmission complete")
+                clock.print_report()
+    finally:
+        await close_all()
+
+asyncio.run(run())
@@ -1,41 +1,51 @@
+import asyncio
 import serial
 import sys
 import time
 import os
 import argparse
 
+from serial_transport import (DEFAULT_PORT, ACK_SIZE, AES_RESPONSE_SIZE, build_packet,
+                              get_transport, close_all)
+from payload_reader import PAYLOAD_BITS, parse_payload, iter_payload_lines, iter_payloads
+
+# Longest single payload that may be wrapped over several lines: 0b prefix and 128 binary digits
+MAX_WRAPPED_CHARS = 2 + PAYLOAD_BITS
+
+def parse_bitstream(content):
+    """
+    Parse one bitstream value in binary or hex format
+    Returns: (128-bit integer value, description of the detected format)
+    Raises: ValueError if the content is not a valid 128-bit value
+    """
+    bitstream, kind = parse_payload(content)
+    return bitstream, f"{kind} format"
+
 def read_bitstream_file(file_path):
     """
-    Read bitstream from file supporting binary or hex format
+    Read the bitstream of a file supporting binary or hex format
+    A payload may be wrapped over several lines, which are joined; a file
+    holding several payloads is rejected (they are sent with --campaign).
+    The file is streamed, so only the lines that can form one payload are read
     Returns: 128-bit integer value
     """
     try:
-        with open(file_path, 'r') as f:
-            content = f.read().strip()
-        
-        # Remove any whitespace and newlines
-        content = ''.join(content.split())
-        
-        # Detect format and convert to integer
-        if content.startswith('0x') or content.startswith('0X'):
-            # Hex format
-            print("Detected hex format with 0x prefix")
-            bitstream = int(content, 16)
-        elif all(c in '01' for c in content) and len(content) == 128:
-            # Binary format
-            print("Detected binary format")
-            bitstream = int(content, 2)
-        elif all(c in '0123456789ABCDEFabcdef' for c in content):
-            # Hex format without 0x prefix
-            print("Detected hex format without 0x prefix")
-            bitstream = int(content, 16)
-        else:
-            raise ValueError("Invalid format. File must contain binary (0/1) or hex data")
-        
-        # Ensure it fits in 128 bits
-        if bitstream >= (1 << 128):
-            raise ValueError("Bitstream too large. Must be 128 bits or less")
-            
+        lines = []
+        for _, content in iter_payload_lines(file_path):
+            lines.append(content)
+            if sum(map(len, lines)) > MAX_WRAPPED_CHARS:
+                break
+        if not lines:
+            print(f"Error reading file: No bitstream found in '{file_path}'")
+            sys.exit(1)
+        try:
+            bitstream, fmt = parse_bitstream(''.join(lines))
+        except ValueError as e:
+            if len(lines) == 1:
+                raise
+            print(f"Error: '{file_path}' holds more than one payload (use -c to send them all): {e}")
+            sys.exit(1)
+        print(f"Detected {fmt}" + (f" (joined from {len(lines)} lines)" if len(lines) > 1 else ""))
         return bitstream
         
     except FileNotFoundError:
@@ -45,21 +55,103 @@ def read_bitstream_file(file_path):
         print(f"Error reading file: {e}")
         sys.exit(1)
 
-def main():
+async def run_campaign(args, transport, symbol_time_cycles):
+    """
+    Stream a queue of payloads to the FPGA back-to-back
+    
+    The next packet is built while the current one is on air and is written
+    the moment the 0xAAAA ack of the previous one arrives, so the modulator
+    only idles for the UART turnaround between messages.
+    
+    Returns: True if every queued message was acknowledged
+    """
+    response_size = AES_RESPONSE_SIZE if args.aes_decrypt else ACK_SIZE
+    airtime = symbol_time_cycles * 128 * args.repetition_factor / 12_000_000
+    timeout_seconds = airtime + 10  # Add 10 second buffer
+    
+    stats = {'sent': 0, 'acked': 0, 'timeouts': 0, 'skipped': 0}
+    
+    def packets():
+        for line_no, bitstream, error in iter_payloads(args.bitstream_file):
+            if error is not None:
+                print(f"Line {line_no}: {error} (skipped)")
+                stats['skipped'] += 1
+                continue
+            packet = build_packet(bitstream, symbol_time_cycles, args.repetition_factor)
+            for _ in range(args.repeat):
+                yield line_no, packet
+    
+    start_time = time.perf_counter()
+    last_report = start_time
+    
+    queue = packets()
+    pending = next(queue, None)
+    while pending is not None:
+        line_no, packet = pending
+        await transport.send_packet(packet)
+        stats['sent'] += 1
+        
+        # Prepare the next packet while this one is being modulated
+        pending = next(queue, None)
+        
+        response, rejected = await transport.wait_completion(response_size, timeout_seconds)
+        for bad_response in rejected:
+            status_bytes = (bad_response[-2] << 8) | bad_response[-1]
+            print(f"Line {line_no}: unexpected status 0x{status_bytes:04X} (expected 0xAAAA)")
+        if response is None:
+            stats['timeouts'] += 1
+            print(f"❌ Line {line_no}: transmission timed out!")
+            continue
+        stats['acked'] += 1
+        if args.aes_decrypt:
+            print(f"Line {line_no}: plaintext 0x{int.from_bytes(response[:16], byteorder='big'):032X}")
+        
+        now = time.perf_counter()
+        if now - last_report >= 5:
+            last_report = now
+            print(f"[{now - start_time:8.1f} s] {stats['acked']} messages, "
+                  f"{stats['acked'] / (now - start_time):.2f} msg/s")
+    
+    elapsed = time.perf_counter() - start_time
+    msg_rate = stats['acked'] / elapsed if elapsed > 0 else 0.0
+    bound = 1 / airtime if airtime > 0 else float('inf')
+    
+    print(f"\n{'='*60}")
+    print(f"CAMPAIGN SUMMARY")
+    print(f"{'='*60}")
+    print(f"Queue: {args.bitstream_file}")
+    print(f"Symbol time: {args.symbol_time_ms} ms per bit, {symbol_time_cycles} clock cycles")
+    print(f"Repetition factor: {args.repetition_factor}x per bit")
+    print(f"Messages sent: {stats['sent']}, acknowledged: {stats['acked']}, "
+          f"timed out: {stats['timeouts']}, skipped lines: {stats['skipped']}")
+    print(f"Elapsed time: {elapsed:.3f} seconds")
+    print(f"Sustained rate: {msg_rate:.2f} msg/s, {msg_rate * 128:.1f} bps")
+    print(f"Theoretical bound: {bound:.2f} msg/s, {bound * 128:.1f} bps "
+          f"(symbol_time_ms * 128 * repetition_factor = {airtime * 1000:.3f} ms)")
+    print(f"Modulator utilization: {100 * msg_rate / bound:.1f}%")
+    
+    return stats['timeouts'] == 0 and stats['skipped'] == 0
+
+async def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(description='FSK Modulation Control Script')
-    parser.add_argument('bitstream_file', help='Path to bitstream file (binary or hex format)')
+    parser.add_argument('bitstream_file', help='Path to bitstream file (binary or hex format), '
+                       'or payload queue with --campaign (- for stdin)')
     parser.add_argument('symbol_time_ms', type=float, help='Symbol time in milliseconds')
     parser.add_argument('-r', '--repeat', type=int, default=1, 
                        help='Number of times to send the message (default: 1)')
     parser.add_argument('-f', '--repetition-factor', type=int, default=1, 
                        help='Repetition factor for each bit (1-15, default: 1)')
     parser.add_argument('-aes', '--aes-decrypt', action='store_true', help='Use when interacting with AES key leaking architecture')
+    parser.add_argument('-p', '--port', default=DEFAULT_PORT,
+                       help=f'Serial port of the FPGA board (default: {DEFAULT_PORT})')
+    parser.add_argument('-c', '--campaign', action='store_true',
+                       help='Treat bitstream_file as a queue of payloads (one per line) and send them back-to-back')
     
     args = parser.parse_args()
     
     # Validate arguments
-    if not os.path.exists(args.bitstream_file):
+    if not (args.campaign and args.bitstream_file == '-') and not os.path.exists(args.bitstream_file):
         print(f"Error: File '{args.bitstream_file}' not found")
         sys.exit(1)
     
@@ -78,6 +170,18 @@ def main():
         print(f"Error: Symbol time too large. Maximum is {65535/12000:.1f} ms")
         sys.exit(1)
     
+    if args.campaign:
+        try:
+            transport = await get_transport(args.port, timeout=10)
+        except serial.SerialException as e:
+            print(f"Error opening serial port: {e}")
+            sys.exit(1)
+        try:
+            success = await run_campaign(args, transport, symbol_time_cycles)
+        finally:
+            await close_all()
+        sys.exit(0 if success else 1)
+    
     # Read bitstream from file
     print(f"Reading bitstream from: {args.bitstream_file}")
     bitstream = read_bitstream_file(args.bitstream_file)
@@ -93,122 +197,97 @@ def main():
     
     # Open serial connection
     try:
-        p_ser = serial.Serial(port="COM9", baudrate=57600, bytesize=serial.EIGHTBITS, 
-                             parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, 
-                             timeout=10, xonxoff=0, rtscts=0, dsrdtr=0)
+        transport = await get_transport(args.port, timeout=10)
     except serial.SerialException as e:
         print(f"Error opening serial port: {e}")
         sys.exit(1)
     
-    # Prepare 19-byte packet
-    packet = bytearray(19)
-    
-    # Pack bitstream FIRST (16 bytes, big-endian)
-    for i in range(16):
-        byte_val = (bitstream >> (8 * (15 - i))) & 0xFF
-        packet[i] = byte_val
-
-    # Pack symbol time (2 bytes, big-endian)
-    packet[16] = (symbol_time_cycles >> 8) & 0xFF
-    packet[17] = symbol_time_cycles & 0xFF
-    
-    # Pack repetition factor LAST (1 byte)
-    packet[18] = args.repetition_factor & 0xFF
+    try:
+        # Prepare 19-byte packet: bitstream (16 bytes) | symbol time (2 bytes) | repetition factor (1 byte)
+        packet = build_packet(bitstream, symbol_time_cycles, args.repetition_factor)
     
-    print(f"\nPacket: {packet.hex().upper()}")
+        print(f"\nPacket: {packet.hex().upper()}")
     
-    # Send packet multiple times (repeat is for Python loop only)
-    total_start_time = time.time()
-    successful_transmissions = 0
+        # Send packet multiple times (repeat is for Python loop only)
+        total_start_time = time.time()
+        successful_transmissions = 0
+        ack_latencies = []
+        expected_airtime = symbol_time_cycles * 128 * args.repetition_factor / 12_000_000
     
-    for transmission in range(args.repeat):
-        print(f"\n{'='*50}")
-        print(f"Transmission {transmission + 1} of {args.repeat}")
-        print(f"{'='*50}")
+        for transmission in range(args.repeat):
+            print(f"\n{'='*50}")
+            print(f"Transmission {transmission + 1} of {args.repeat}")
+            print(f"{'='*50}")
         
-        # Send packet
-        p_ser.write(packet)
-        print("Data packet sent, waiting for completion...")
+            # Send packet
+            await transport.send_packet(packet)
+            print("Data packet sent, waiting for completion...")
         
-        # Wait for completion signal
-        start_time = time.time()
-        timeout_seconds = (args.symbol_time_ms * 128 * args.repetition_factor / 1000) + 10  # Add 10 second buffer
+            # Block on the completion signal: the read wakes up as soon as the response arrives
+            start_time = time.perf_counter()
+            timeout_seconds = (args.symbol_time_ms * 128 * args.repetition_factor / 1000) + 10  # Add 10 second buffer
         
-        transmission_successful = False
+            # AES mode: 18 bytes (16 bytes plaintext + 2 bytes status), normal mode: 2 bytes (0xAAAA)
+            response_size = AES_RESPONSE_SIZE if args.aes_decrypt else ACK_SIZE
+            response, rejected = await transport.wait_completion(response_size, timeout_seconds)
+            ack_latency = time.perf_counter() - start_time
         
-        if args.aes_decrypt:
-            # AES mode: Wait for 18 bytes (16 bytes plaintext + 2 bytes status)
-            while time.time() - start_time < timeout_seconds:
-                if p_ser.in_waiting >= 18:
-                    response = p_ser.read(18)
-                    # print(response)
-                    if len(response) == 18:
-                        # Check if last 2 bytes are 0xAAAA
-                        status_bytes = (response[16] << 8) | response[17]
-                        if status_bytes == 0xAAAA:
-                            # Extract plaintext (first 16 bytes)
-                            plaintext_bytes = response[:16]
-                            plaintext_int = int.from_bytes(plaintext_bytes, byteorder='big')
-                            plaintext_bin = f"{plaintext_int:0128b}"
-                            
-                            print(f"✅ Transmission {transmission + 1} completed successfully!")
-                            print(f"Transmission time: {time.time() - start_time:.3f} seconds")
-                            print(f"Plaintext (hex): 0x{plaintext_int:032X}")
-                            # print(f"Plaintext (bin): {plaintext_bin}")
-                            # print(f"Plaintext (bytes): {plaintext_bytes.hex().upper()}")
-                            
-                            successful_transmissions += 1
-                            transmission_successful = True
-                            break
-                        else:
-                            print(f"Unexpected status: 0x{status_bytes:04X} (expected 0xAAAA)")
-                time.sleep(0.5)
-        else:
-            # Normal mode: Wait for 2 bytes (0xAAAA)
-            while time.time() - start_time < timeout_seconds:
-                if p_ser.in_waiting >= 2:
-                    response = p_ser.read(2)
-                    if len(response) == 2:
-                        response_val = (response[0] << 8) | response[1]
-                        if response_val == 0xAAAA:
-                            print(f"✅ Transmission {transmission + 1} completed successfully!")
-                            print(f"Transmission time: {time.time() - start_time:.3f} seconds")
-                            successful_transmissions += 1
-                            transmission_successful = True
-                            break
-                        else:
-                            print(f"Unexpected response: 0x{response_val:04X}")
-                time.sleep(0.1)
+            for bad_response in rejected:
+                status_bytes = (bad_response[-2] << 8) | bad_response[-1]
+                print(f"Unexpected status: 0x{status_bytes:04X} (expected 0xAAAA)")
+        
+            if response is None:
+                print(f"❌ Transmission {transmission + 1} timed out!")
+                continue
+        
+            ack_latencies.append(ack_latency)
+            successful_transmissions += 1
+            print(f"✅ Transmission {transmission + 1} completed successfully!")
+            print(f"Transmission time: {ack_latency:.3f} seconds")
         
-        if not transmission_successful:
-            print(f"❌ Transmission {transmission + 1} timed out!")
+            if not args.aes_decrypt:
+                print(f"Ack latency: {ack_latency * 1000:.3f} ms "
+                      f"(airtime {expected_airtime * 1000:.3f} ms, overhead {(ack_latency - expected_airtime) * 1000:+.3f} ms)")
+            else:
+                # The AES top level answers as soon as the block is decrypted
+                print(f"Ack latency: {ack_latency * 1000:.3f} ms")
+                # Extract plaintext (first 16 bytes)
+                plaintext_bytes = response[:16]
+                plaintext_int = int.from_bytes(plaintext_bytes, byteorder='big')
+                print(f"Plaintext (hex): 0x{plaintext_int:032X}")
 
     
-    total_time = time.time() - total_start_time
+        total_time = time.time() - total_start_time
     
-    # Display final summary
-    print(f"\n{'='*60}")
-    print(f"FINAL SUMMARY")
-    print(f"{'='*60}")
-    print(f"File: {args.bitstream_file}")
-    print(f"Bitstream: 0x{bitstream:032X}")
-    print(f"Bitstream (bin): {bitstream_bin}")
-    print(f"Symbol time: {args.symbol_time_ms} ms per bit, {symbol_time_cycles} clock cycles")
-    print(f"Repetition factor: {args.repetition_factor}x per bit")
-    print(f"Effective bit time: {args.symbol_time_ms * args.repetition_factor:.3f} ms per logical bit")
-    print(f"Data rate: {1000 / (args.symbol_time_ms * args.repetition_factor):.2f} bps, {1/(args.symbol_time_ms * args.repetition_factor):.3f} kbps")
-    print(f"Total bits per message: 128")
-    print(f"Repeat count: {args.repeat}")
-    print(f"Successful transmissions: {successful_transmissions}/{args.repeat}")
-    print(f"Expected duration per message: {args.symbol_time_ms * 128 * args.repetition_factor:.3f} ms")
-    print(f"Total execution time: {total_time:.3f} seconds")
+        # Display final summary
+        print(f"\n{'='*60}")
+        print(f"FINAL SUMMARY")
+        print(f"{'='*60}")
+        print(f"File: {args.bitstream_file}")
+        print(f"Bitstream: 0x{bitstream:032X}")
+        print(f"Bitstream (bin): {bitstream_bin}")
+        print(f"Symbol time: {args.symbol_time_ms} ms per bit, {symbol_time_cycles} clock cycles")
+        print(f"Repetition factor: {args.repetition_factor}x per bit")
+        print(f"Effective bit time: {args.symbol_time_ms * args.repetition_factor:.3f} ms per logical bit")
+        print(f"Data rate: {1000 / (args.symbol_time_ms * args.repetition_factor):.2f} bps, {1/(args.symbol_time_ms * args.repetition_factor):.3f} kbps")
+        print(f"Total bits per message: 128")
+        print(f"Repeat count: {args.repeat}")
+        print(f"Successful transmissions: {successful_transmissions}/{args.repeat}")
+        print(f"Expected duration per message: {args.symbol_time_ms * 128 * args.repetition_factor:.3f} ms")
+        print(f"Total execution time: {total_time:.3f} seconds")
+        if ack_latencies:
+            ack_latencies.sort()
+            p99 = ack_latencies[min(len(ack_latencies) - 1, int(0.99 * len(ack_latencies)))]
+            print(f"Ack latency: min {ack_latencies[0] * 1000:.3f} ms, "
+                  f"mean {sum(ack_latencies) / len(ack_latencies) * 1000:.3f} ms, "
+                  f"p99 {p99 * 1000:.3f} ms, max {ack_latencies[-1] * 1000:.3f} ms")
     
-    if successful_transmissions == args.repeat:
-        print("🎉 All transmissions completed successfully! 🎉")
-    else:
-        print(f"⚠️  {args.repeat - successful_transmissions} transmission(s) failed")
-    
-    p_ser.close()
+        if successful_transmissions == args.repeat:
+            print("🎉 All transmissions completed successfully! 🎉")
+        else:
+            print(f"⚠️  {args.repeat - successful_transmissions} transmission(s) failed")
+    finally:
+        await close_all()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
@@ -1,12 +1,162 @@
-import serial
-import time
+import argparse
+import asyncio
+import csv
 import sys
+import time
+from datetime import datetime, timezone
+
+from serial_transport import DEFAULT_PORT, get_transport, close_all
+
+BYPASS_VALUE = 0xFFFF
+PLL_FREQUENCIES_MHZ = (936, 648, 600)
+
+def output_frequencies(value):
+    """
+    Output frequencies (MHz) for a divider value, one per PLL frequency
+    The square wave generator divides by 2*(value+1); 0xFFFF bypasses the divider
+    """
+    if value == BYPASS_VALUE:
+        return tuple(float(f) for f in PLL_FREQUENCIES_MHZ)
+    return tuple(f / (2 * (value + 1)) for f in PLL_FREQUENCIES_MHZ)
+
+def divider_for_frequency(freq_mhz, pll_mhz=936):
+    """Nearest divider value producing `freq_mhz` from the `pll_mhz` PLL"""
+    return min(65534, max(0, round(pll_mhz / (2 * freq_mhz) - 1)))
+
+def build_sweep_values(args):
+    """
+    Expand the sweep arguments into the ordered list of divider values
+    
+    --values takes an explicit list, --log-points N spaces N points
+    logarithmically in output frequency between --start and --stop,
+    otherwise start/stop/step is a linear (inclusive) divider range.
+    """
+    if args.values:
+        values = [int(v, 0) for v in args.values.split(",") if v.strip()]
+    elif args.log_points:
+        f_start = output_frequencies(args.start)[0]
+        f_stop = output_frequencies(args.stop)[0]
+        if args.log_points == 1:
+            values = [args.start]
+        else:
+            ratio = (f_stop / f_start) ** (1 / (args.log_points - 1))
+            values = [divider_for_frequency(f_start * ratio ** i) for i in range(args.log_points)]
+        # Neighbouring points collapse onto the same divider at high frequencies
+        values = list(dict.fromkeys(values))
+    else:
+        step = args.step if args.stop >= args.start else -abs(args.step)
+        values = list(range(args.start, args.stop + (1 if step > 0 else -1), step))
+    
+    for value in values:
+        if value < 0 or value > 65535:
+            raise ValueError(f"Divider value {value} is outside the 16-bit range")
+    return values
+
+def parse_sweep_args(argv):
+    parser = argparse.ArgumentParser(prog='main_sweep.py sweep',
+                                     description='Sweep the square wave divider over one persistent connection')
+    parser.add_argument('--start', type=int, default=0, help='First divider value (default: 0)')
+    parser.add_argument('--stop', type=int, default=65534, help='Last divider value, inclusive (default: 65534)')
+    parser.add_argument('--step', type=int, default=1, help='Divider step for linear sweeps (default: 1)')
+    parser.add_argument('--values', help='Explicit comma-separated divider list (overrides start/stop/step)')
+    parser.add_argument('--log-points', type=int, default=0,
+                        help='Number of log-spaced points in output frequency between start and stop')
+    parser.add_argument('--dwell-ms', type=float, default=0.0,
+                        help='Time each divider stays on, measured from the start of the step (default: 0)')
+    parser.add_argument('--csv', default=None, help='CSV output file (default: sweep_<timestamp>.csv)')
+    parser.add_argument('--keep-on', action='store_true', help='Leave the last divider running at the end')
+    parser.add_argument('-p', '--port', default=DEFAULT_PORT,
+                        help=f'Serial port of the FPGA board (default: {DEFAULT_PORT})')
+    args = parser.parse_args(argv)
+    if args.step == 0:
+        parser.error("--step must not be 0")
+    if args.log_points < 0:
+        parser.error("--log-points must be positive")
+    return args
+
+async def run_sweep(args):
+    """
+    Step through the divider values on one connection and log every step
+    
+    The sweep FPGA design ignores the value of a frame received while the
+    wave is running (the frame only stops it), so every step after the first
+    sends the stop word before the new divider.
+    
+    Returns: True if every step was echoed by the board
+    """
+    try:
+        values = build_sweep_values(args)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return False
+    
+    csv_path = args.csv or datetime.now().strftime("sweep_%Y%m%d_%H%M%S.csv")
+    dwell_ns = int(args.dwell_ms * 1_000_000)
+    print(f"Sweeping {len(values)} divider value(s), dwell {args.dwell_ms} ms, logging to {csv_path}")
+    
+    transport = await get_transport(args.port)
+    failures = 0
+    wave_running = False
+    start_ns = time.monotonic_ns()
+    
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["timestamp", "elapsed_s", "divider", "divide_by",
+                         "f_936_mhz", "f_648_mhz", "f_600_mhz", "echo", "ack_ms"])
+        try:
+            for i, value in enumerate(values):
+                step_start_ns = time.monotonic_ns()
+                if wave_running:
+                    await transport.send_conf("0000")
+                
+                conf_byte = f"{value:04X}"
+                write_ns = time.monotonic_ns()
+                read_data = await transport.send_conf(conf_byte)
+                ack_ms = (time.monotonic_ns() - write_ns) / 1e6
+                wave_running = True
+                
+                if len(read_data) != 2:
+                    failures += 1
+                    print(f"❌ Divider {value}: no echo from board")
+                
+                frequencies = output_frequencies(value)
+                writer.writerow([datetime.now(timezone.utc).isoformat(),
+                                 f"{(write_ns - start_ns) / 1e9:.6f}", value,
+                                 1 if value == BYPASS_VALUE else 2 * (value + 1),
+                                 *(f"{freq:.9g}" for freq in frequencies),
+                                 read_data.hex().upper(), f"{ack_ms:.3f}"])
+                
+                if (i + 1) % 1000 == 0 or i + 1 == len(values):
+                    f.flush()
+                    elapsed = (time.monotonic_ns() - start_ns) / 1e9
+                    print(f"[{elapsed:8.1f} s] {i + 1}/{len(values)} steps, divider {value} "
+                          f"-> {frequencies[0]:.6f} MHz")
+                
+                # Dwell is measured from the start of the step, so the serial round trip is included
+                remaining_ns = step_start_ns + dwell_ns - time.monotonic_ns()
+                if remaining_ns > 0:
+                    await asyncio.sleep(remaining_ns / 1e9)
+            
+            if wave_running and not args.keep_on:
+                await transport.send_conf("0000")
+                print("OFF - sweep finished")
+        finally:
+            await close_all()
+    
+    elapsed = (time.monotonic_ns() - start_ns) / 1e9
+    print(f"Sweep complete: {len(values)} steps in {elapsed:.3f} seconds "
+          f"({len(values) / elapsed:.1f} steps/s), {failures} failure(s)")
+    return failures == 0
+
+if len(sys.argv) >= 2 and sys.argv[1].lower() == "sweep":
+    sys.exit(0 if asyncio.run(run_sweep(parse_sweep_args(sys.argv[2:]))) else 1)
 
 # Check command line arguments
 if len(sys.argv) < 2 or len(sys.argv) > 3:
     print("Usage: python main.py <on/off> [value]")
     print("For 'on': python main.py on <integer_value> or python main.py on bypass")
     print("For 'off': python main.py off")
+    print("For 'sweep': python main_sweep.py sweep --help")
     sys.exit(1)
     
 command = sys.argv[1].lower()
@@ -15,50 +165,47 @@ if command not in ["on", "off"]:
     print("Invalid command. Use 'on' or 'off'.")
     sys.exit(1)
 
-p_ser = serial.Serial(port="COM9", baudrate=57600, bytesize=serial.EIGHTBITS, parity=serial.PARITY_NONE,
-                           stopbits=serial.STOPBITS_ONE, timeout=30, xonxoff=0, rtscts=0, dsrdtr=0)
+async def run():
+    transport = await get_transport()
+    try:
+        if command == "off":
+            read_data = await transport.send_conf("0000")
+            print(read_data, "OFF")
 
-if command == "off":
-    conf_byte = "0000"
-    p_ser.write(bytes.fromhex(conf_byte))
-    read_data = p_ser.read(2)
-    print(read_data, "OFF")
-    
-elif command == "on":
-    if len(sys.argv) != 3:
-        print("Error: 'on' command requires an argument")
-        print("Usage: python main.py on <integer_value> or python main.py on bypass")
-        sys.exit(1)
-    
-    argument = sys.argv[2].lower()
-    
-    # Check for bypass command
-    if argument == "bypass":
-        conf_byte = "FFFF"
-        p_ser.write(bytes.fromhex(conf_byte))
-        read_data = p_ser.read(2)
-        print(read_data, "ON - BYPASS (0xFFFF)")
-        print("Output frequency: 936 MHz, 648 MHz, Or 600 MHz")
-    else:
-        # Try to parse as integer
-        try:
-            value = int(sys.argv[2])
-            
-            # Convert integer to 4-digit hex string (16-bit value)
-            if value < 0 or value > 65535:
-                print("Error: Value must be between 0 and 65535 (16-bit range)")
+        elif command == "on":
+            if len(sys.argv) != 3:
+                print("Error: 'on' command requires an argument")
+                print("Usage: python main.py on <integer_value> or python main.py on bypass")
                 sys.exit(1)
-                
-            conf_byte = f"{value:04X}"
-            p_ser.write(bytes.fromhex(conf_byte))
-            read_data = p_ser.read(2)
-            print(read_data, f"ON - Value: {value} (0x{conf_byte}) - divide frequency by {2*(value+1)}")
-            print(f"Output frequency for 936 MHz: {936 / (2 * (value + 1))} MHz")
-            print(f"Output frequency for 648 MHz: {648 / (2 * (value + 1))} MHz")
-            print(f"Output frequency for 600 MHz: {600 / (2 * (value + 1))} MHz")
-        except ValueError:
-            print("Error: Invalid argument. Use an integer value or 'bypass'")
-            print("Usage: python main.py on <integer_value> or python main.py on bypass")
-            sys.exit(1)
-
-p_ser.close()
\ No newline at end of file
+
+            argument = sys.argv[2].lower()
+
+            # Check for bypass command
+            if argument == "bypass":
+                read_data = await transport.send_conf("FFFF")
+                print(read_data, "ON - BYPASS (0xFFFF)")
+                print("Output frequency: 936 MHz, 648 MHz, Or 600 MHz")
+            else:
+                # Try to parse as integer
+                try:
+                    value = int(sys.argv[2])
+                except ValueError:
+                    print("Error: Invalid argument. Use an integer value or 'bypass'")
+                    print("Usage: python main.py on <integer_value> or python main.py on bypass")
+                    sys.exit(1)
+
+                # Convert integer to 4-digit hex string (16-bit value)
+                if value < 0 or value > 65535:
+                    print("Error: Value must be between 0 and 65535 (16-bit range)")
+                    sys.exit(1)
+
+                conf_byte = f"{value:04X}"
+                read_data = await transport.send_conf(conf_byte)
+                print(read_data, f"ON - Value: {value} (0x{conf_byte}) - divide frequency by {2*(value+1)}")
+                print(f"Output frequency for 936 MHz: {936 / (2 * (value + 1))} MHz")
+                print(f"Output frequency for 648 MHz: {648 / (2 * (value + 1))} MHz")
+                print(f"Output frequency for 600 MHz: {600 / (2 * (value + 1))} MHz")
+    finally:
+        await close_all()
+
+asyncio.run(run())
@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import serial
+import sys
+import time
+
+from host_metrics import LatencyHistogram
+from serial_transport import ACK_SIZE, AES_RESPONSE_SIZE, build_packet, get_transport, close_all
+from payload_reader import iter_payloads
+
+
+class BoardStats:
+    """Per-board connection state and throughput/latency counters"""
+
+    def __init__(self, port, payload_file):
+        self.port = port
+        self.payload_file = payload_file
+        self.state = "pending"   # pending -> running -> done | failed
+        self.error = None
+        self.sent = 0
+        self.acked = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.latencies = LatencyHistogram()  # ack latencies in ns, constant memory
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time or time.perf_counter()) - self.start_time
+
+    @property
+    def msg_rate(self):
+        return self.acked / self.elapsed if self.elapsed > 0 else 0.0
+
+
+async def drive_board(stats, args, symbol_time_cycles):
+    """
+    Stream one board's payload queue back-to-back
+
+    Every failure (port not opening, I/O errors, too many consecutive
+    timeouts) is recorded in `stats` and ends only this board's task.
+    """
+    response_size = AES_RESPONSE_SIZE if args.aes_decrypt else ACK_SIZE
+    airtime = symbol_time_cycles * 128 * args.repetition_factor / 12_000_000
+    consecutive_timeouts = 0
+
+    stats.start_time = time.perf_counter()
+    try:
+        transport = await get_transport(stats.port, timeout=10)
+        stats.state = "running"
+        for line_no, bitstream, error in iter_payloads(stats.payload_file):
+            if error is not None:
+                print(f"[{stats.port}] Line {line_no}: {error} (skipped)")
+                stats.skipped += 1
+                continue
+            packet = build_packet(bitstream, symbol_time_cycles, args.repetition_factor)
+            for _ in range(args.repeat):
+                await transport.send_packet(packet)
+                stats.sent += 1
+                sent_ns = time.perf_counter_ns()
+                response, _ = await transport.wait_completion(response_size, airtime + args.ack_timeout)
+                if response is None:
+                    stats.timeouts += 1
+                    consecutive_timeouts += 1
+                    print(f"❌ [{stats.port}] Line {line_no}: transmission timed out!")
+                    if consecutive_timeouts >= args.max_timeouts:
+                        raise TimeoutError(f"{consecutive_timeouts} consecutive timeouts, board considered hung")
+                    continue
+                consecutive_timeouts = 0
+                stats.acked += 1
+                stats.latencies.record(time.perf_counter_ns() - sent_ns)
+        stats.state = "done"
+    except (serial.SerialException, OSError, TimeoutError) as e:
+        stats.state = "failed"
+        stats.error = str(e)
+        print(f"⚠️  [{stats.port}] board failed: {e}")
+    finally:
+        stats.end_time = time.perf_counter()
+
+
+def positive_float(value):
+    """argparse type for strictly positive intervals"""
+    number = float(value)
+    if not number > 0:  # also rejects nan
+        raise argparse.ArgumentTypeError(f"must be positive, got {value}")
+    return number
+
+
+async def report_progress(boards, interval):
+    while True:
+        await asyncio.sleep(interval)
+        total_rate = sum(board.msg_rate for board in boards)
+        per_board = ", ".join(f"{board.port}: {board.acked} ({board.state})" for board in boards)
+        print(f"[progress] {total_rate:.2f} msg/s aggregate - {per_board}")
+
+
+def print_summary(boards, airtime):
+    print(f"\n{'='*60}")
+    print(f"MULTI-BOARD SUMMARY")
+    print(f"{'='*60}")
+    for board in boards:
+        line = (f"{board.port:>12}: {board.state:<7} sent {board.sent}, acked {board.acked}, "
+                f"timeouts {board.timeouts}, skipped {board.skipped}, {board.msg_rate:.2f} msg/s")
+        if board.latencies.count:
+            latency = board.latencies.summary()
+            line += (f", ack mean {latency['mean_ns'] / 1e6:.3f} ms"
+                     f" p99 {latency['p99_ns'] / 1e6:.3f} ms max {latency['max_ns'] / 1e6:.3f} ms")
+        if board.error:
+            line += f" - {board.error}"
+        print(line)
+
+    elapsed = max((board.elapsed for board in boards), default=0.0)
+    acked = sum(board.acked for board in boards)
+    rate = acked / elapsed if elapsed > 0 else 0.0
+    bound = len(boards) / airtime if airtime > 0 else float('inf')
+    print(f"Aggregate: {acked} messages in {elapsed:.3f} seconds, {rate:.2f} msg/s, {rate * 128:.1f} bps")
+    print(f"Theoretical bound for {len(boards)} board(s): {bound:.2f} msg/s, {bound * 128:.1f} bps")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Drive several FSK modulation boards concurrently')
+    parser.add_argument('symbol_time_ms', type=float, help='Symbol time in milliseconds')
+    parser.add_argument('--ports', nargs='+', default=[], help='Serial ports that all receive --payload')
+    parser.add_argument('--payload', help='Payload queue (one binary/hex value per line) shared by --ports')
+    parser.add_argument('--board', action='append', default=[], metavar='PORT=FILE',
+                       help='Per-board payload queue, may be given several times')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                       help='Number of times to send each payload (default: 1)')
+    parser.add_argument('-f', '--repetition-factor', type=int, default=1,
+                       help='Repetition factor for each bit (1-15, default: 1)')
+    parser.add_argument('-aes', '--aes-decrypt', action='store_true', help='Boards run the AES key leaking architecture')
+    parser.add_argument('--ack-timeout', type=float, default=10.0,
+                       help='Seconds to wait for an ack beyond the message airtime (default: 10)')
+    parser.add_argument('--max-timeouts', type=int, default=3,
+                       help='Consecutive timeouts after which a board is dropped (default: 3)')
+    parser.add_argument('--progress', type=positive_float, default=5.0, help='Progress report interval in seconds')
+
+    args = parser.parse_args()
+
+    boards = []
+    if args.ports:
+        if not args.payload or args.payload == '-':
+            print("Error: --ports requires a --payload file")
+            sys.exit(1)
+        boards += [BoardStats(port, args.payload) for port in args.ports]
+    for spec in args.board:
+        port, sep, payload_file = spec.partition('=')
+        if not sep or not port or not payload_file:
+            print(f"Error: Invalid --board '{spec}', expected PORT=FILE")
+            sys.exit(1)
+        boards.append(BoardStats(port, payload_file))
+
+    if not boards:
+        print("Error: No boards given, use --ports and/or --board")
+        sys.exit(1)
+    if len({board.port for board in boards}) != len(boards):
+        print("Error: Each port may only be driven once")
+        sys.exit(1)
+    if args.repeat < 1:
+        print("Error: Repeat count must be at least 1")
+        sys.exit(1)
+    if args.repetition_factor < 1 or args.repetition_factor > 15:
+        print("Error: Repetition factor must be between 1 and 15")
+        sys.exit(1)
+
+    symbol_time_cycles = int(args.symbol_time_ms * 12000)  # 12000 cycles per ms at 12MHz
+    if symbol_time_cycles > 65535:
+        print(f"Error: Symbol time too large. Maximum is {65535/12000:.1f} ms")
+        sys.exit(1)
+    airtime = symbol_time_cycles * 128 * args.repetition_factor / 12_000_000
+
+    print(f"Driving {len(boards)} board(s): {', '.join(board.port for board in boards)}")
+    progress = asyncio.create_task(report_progress(boards, args.progress))
+    try:
+        # Each board owns its transport and worker thread, so a hung board only blocks its own task
+        await asyncio.gather(*(drive_board(board, args, symbol_time_cycles) for board in boards))
+    finally:
+        progress.cancel()
+        await close_all()
+
+    print_summary(boards, airtime)
+    if any(board.state != "done" or board.timeouts for board in boards):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
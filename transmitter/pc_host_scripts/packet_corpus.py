@@ -0,0 +1,316 @@
+import argparse
+import asyncio
+import itertools
+import mmap
+import os
+import serial
+import sys
+import time
+
+import numpy as np
+
+from payload_reader import HEX_DIGITS, PAYLOAD_BITS, PayloadFormatError, classify_payload, iter_payload_lines
+from serial_transport import (DEFAULT_PORT, PACKET_SIZE, ACK_SIZE, AES_RESPONSE_SIZE,
+                              packet_airtime, get_transport, close_all)
+
+CHUNK_LINES = 1 << 20
+
+
+# Digit value of every byte (255 for non-hex characters), to validate and convert whole chunks at once
+HEX_VALUE = np.full(256, 255, dtype=np.uint8)
+HEX_VALUE[np.frombuffer(b'0123456789', dtype=np.uint8)] = np.arange(10)
+HEX_VALUE[np.frombuffer(b'abcdef', dtype=np.uint8)] = np.arange(10, 16)
+HEX_VALUE[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16)
+
+
+def _pack_rows(rows):
+    """
+    Validate and convert an (N, L) uint8 matrix of records of one length L
+
+    Returns: ((N,) bool array, True where the record is valid; (N, 16) uint8 payloads)
+    """
+    count, length = rows.shape
+    zero = ord('0')
+    if length >= 2:
+        second = rows[:, 1] | 0x20  # lower case
+        hex_prefix = (rows[:, 0] == zero) & (second == ord('x'))
+        bin_prefix = (rows[:, 0] == zero) & (second == ord('b'))
+    else:
+        hex_prefix = bin_prefix = np.zeros(count, dtype=bool)
+    prefixed = hex_prefix | bin_prefix
+    digit_start = 2 * prefixed
+    digits = length - digit_start
+
+    # Digit values (255 for non-hex characters); the two prefix columns only count for unprefixed records
+    values = HEX_VALUE[rows]
+    head = slice(0, min(2, length))
+    hex_ok = (values[:, 2:] != 255).all(axis=1) & ((values[:, head] != 255).all(axis=1) | hex_prefix)
+    # Digits after the leading zeros, the prefix excluded; records of up to 32 characters need no
+    # count, as every comparison below is against 32 or more
+    if length > HEX_DIGITS:
+        nonzero = (rows != zero) & (np.arange(length) >= digit_start[:, None])
+        significant = np.where(nonzero.any(axis=1), length - nonzero.argmax(axis=1), 0)
+    else:
+        significant = digits
+
+    # 0x always means hex, 0b only binary when the record cannot be hex (read as hex, its
+    # significant digits start at the 'b'); bare 0/1 is binary at 128 digits or when too long for hex
+    binary = ((bin_prefix & (digits + 1 > HEX_DIGITS))
+              | (~prefixed & ((length == PAYLOAD_BITS) | (significant > HEX_DIGITS))))
+    if binary.any():
+        is_binary = values[binary] <= 1
+        binary[binary] = is_binary[:, 2:].all(axis=1) & (is_binary[:, head].all(axis=1) | prefixed[binary])
+    hex_significant = np.where(bin_prefix, digits + 1, significant)
+    hex_start = np.where(hex_prefix, 2, 0)
+    valid = np.where(binary, significant <= PAYLOAD_BITS,
+                     hex_ok & (hex_significant <= HEX_DIGITS) & (length > hex_start))
+
+    payloads = np.zeros((count, 16), dtype=np.uint8)
+    if not valid.all():
+        return valid, payloads
+    if binary.any():
+        payloads[binary] = np.packbits(_last_digits(values[binary], digit_start[binary], PAYLOAD_BITS), axis=1)
+    if not binary.all():
+        hex_rows = ~binary
+        nibbles = _last_digits(values if not binary.any() else values[hex_rows],
+                               hex_start[hex_rows], HEX_DIGITS)
+        payloads[hex_rows] = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+    return valid, payloads
+
+
+def _last_digits(values, digit_start, width):
+    """The last `width` digit values of every row, with the prefix and missing columns as 0"""
+    count, length = values.shape
+    first_col = length - width  # column of the window start, negative when the rows are narrower
+    if first_col >= 0:
+        window = values[:, first_col:]
+    else:
+        window = np.concatenate((np.zeros((count, -first_col), dtype=np.uint8), values), axis=1)
+    if (digit_start > first_col).any():
+        window = np.where(first_col + np.arange(width) >= digit_start[:, None], window, 0).astype(np.uint8)
+    return window
+
+
+def pack_payloads(chunk):
+    """
+    Vectorized validation and conversion of a chunk of payload lines into an (N, 16) uint8 array
+
+    All records are joined into one byte array and handled per record
+    length: the records of one length form an (n, L) matrix (a plain reshape
+    when they all have the same length, as in a key list), on which the
+    format rules of payload_reader.classify_payload() are evaluated for every
+    record at once with lookup tables, and the digits are converted to
+    bytes. classify_payload() itself only runs on the first invalid line, to
+    report why it was rejected.
+
+    Args:
+        chunk: list of (line number, stripped text) tuples
+
+    Returns:
+        (N, 16) uint8 array in chunk order
+    Raises:
+        PayloadFormatError naming the first invalid line
+    """
+    texts = [text for _, text in chunk]
+    chars = np.frombuffer(''.join(texts).encode('ascii', errors='replace'), dtype=np.uint8)
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    payloads = np.empty((len(chunk), 16), dtype=np.uint8)
+    valid = np.ones(len(chunk), dtype=bool)
+    if len(chunk) and (lengths == lengths[0]).all():
+        valid, payloads = _pack_rows(chars.reshape(len(chunk), lengths[0]))
+    else:
+        starts = np.cumsum(lengths) - lengths
+        for length in np.unique(lengths).tolist():
+            members = np.flatnonzero(lengths == length)
+            valid[members], payloads[members] = _pack_rows(chars[starts[members, None] + np.arange(length)])
+    if not valid.all():
+        line_no, text = chunk[int(np.argmin(valid))]
+        try:
+            classify_payload(text)
+        except ValueError as e:
+            raise PayloadFormatError(line_no, str(e))
+        raise PayloadFormatError(line_no, "Invalid record")
+    return payloads
+
+
+def build_records(payloads, symbol_time_cycles, repetition_factor):
+    """Vectorized 19-byte packet layout: payload[16] | symbol_time[2] (big-endian) | rep_factor[1]"""
+    records = np.empty((len(payloads), PACKET_SIZE), dtype=np.uint8)
+    records[:, :16] = payloads
+    records[:, 16] = (symbol_time_cycles >> 8) & 0xFF
+    records[:, 17] = symbol_time_cycles & 0xFF
+    records[:, 18] = repetition_factor & 0xFF
+    return records
+
+
+def encode_corpus(input_path, output_path, symbol_time_cycles, repetition_factor, chunk_lines=CHUNK_LINES):
+    """
+    Stream a key list into a flat file of fixed-size 19-byte packets
+
+    The input is memory-mapped and read lazily `chunk_lines` lines at a time, each chunk is
+    validated and packed with NumPy, and the records are appended to the
+    output, so memory use is bounded by the chunk size.
+
+    Returns: number of packets written
+    """
+    total = 0
+    with open(output_path, 'wb') as f_out:
+        lines = iter_payload_lines(input_path)
+        while True:
+            chunk = list(itertools.islice(lines, chunk_lines))
+            if not chunk:
+                break
+            build_records(pack_payloads(chunk), symbol_time_cycles, repetition_factor).tofile(f_out)
+            total += len(chunk)
+    return total
+
+
+class PacketCorpus:
+    """
+    Read-only memory-mapped view of a packet file
+
+    Indexing returns a memoryview of the 19 bytes of the packet, without
+    copying, that can be handed straight to SerialTransport.send_packet().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size % PACKET_SIZE:
+            self._file.close()
+            raise ValueError(f"{path}: size {size} is not a multiple of {PACKET_SIZE} bytes")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._view = memoryview(self._mmap) if size else memoryview(b'')
+        self.count = size // PACKET_SIZE
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self._view[index * PACKET_SIZE:(index + 1) * PACKET_SIZE]
+
+    def array(self):
+        """(N, 19) uint8 NumPy array sharing the mapping"""
+        return np.frombuffer(self._view, dtype=np.uint8).reshape(-1, PACKET_SIZE)
+
+    def close(self):
+        self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def replay_corpus(corpus, transport, start=0, count=None, aes_decrypt=False, ack_timeout=10.0):
+    """
+    Send the packets of a corpus back-to-back, each on the ack of the previous one
+
+    Returns: dict of sent/acked/timeouts counters and elapsed seconds
+    """
+    response_size = AES_RESPONSE_SIZE if aes_decrypt else ACK_SIZE
+    stop = len(corpus) if count is None else min(len(corpus), start + count)
+    stats = {'sent': 0, 'acked': 0, 'timeouts': 0, 'airtime': 0.0}
+    start_time = time.perf_counter()
+    last_report = start_time
+
+    for index in range(start, stop):
+        packet = corpus[index]
+        airtime = packet_airtime(packet)
+        await transport.send_packet(packet)
+        stats['sent'] += 1
+        response, _ = await transport.wait_completion(response_size, airtime + ack_timeout)
+        if response is None:
+            stats['timeouts'] += 1
+            print(f"❌ Packet {index}: transmission timed out!")
+            continue
+        stats['acked'] += 1
+        stats['airtime'] += airtime
+
+        now = time.perf_counter()
+        if now - last_report >= 5:
+            last_report = now
+            print(f"[{now - start_time:8.1f} s] packet {index + 1}/{stop}, "
+                  f"{stats['acked'] / (now - start_time):.2f} msg/s")
+
+    stats['elapsed'] = time.perf_counter() - start_time
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Encode and replay flat files of 19-byte modulation packets')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    encode = subparsers.add_parser('encode', help='Encode a key list (hex/0x/binary per line) into a packet file')
+    encode.add_argument('input', help='Key list, one payload per line (- for stdin)')
+    encode.add_argument('output', help='Packet file to write')
+    encode.add_argument('symbol_time_ms', type=float, help='Symbol time in milliseconds')
+    encode.add_argument('-f', '--repetition-factor', type=int, default=1,
+                       help='Repetition factor for each bit (1-15, default: 1)')
+    encode.add_argument('--chunk-lines', type=int, default=CHUNK_LINES,
+                       help=f'Lines packed per vectorized chunk (default: {CHUNK_LINES})')
+
+    replay = subparsers.add_parser('replay', help='Send a packet file to the board back-to-back')
+    replay.add_argument('corpus', help='Packet file written by encode')
+    replay.add_argument('-p', '--port', default=DEFAULT_PORT,
+                       help=f'Serial port of the FPGA board (default: {DEFAULT_PORT})')
+    replay.add_argument('--start', type=int, default=0, help='Index of the first packet to send (default: 0)')
+    replay.add_argument('--count', type=int, default=None, help='Number of packets to send (default: all)')
+    replay.add_argument('-aes', '--aes-decrypt', action='store_true',
+                       help='Use when interacting with AES key leaking architecture')
+
+    args = parser.parse_args()
+
+    if args.command == 'encode':
+        if args.repetition_factor < 1 or args.repetition_factor > 15:
+            print("Error: Repetition factor must be between 1 and 15")
+            sys.exit(1)
+        symbol_time_cycles = int(args.symbol_time_ms * 12000)  # 12000 cycles per ms at 12MHz
+        if symbol_time_cycles > 65535:
+            print(f"Error: Symbol time too large. Maximum is {65535/12000:.1f} ms")
+            sys.exit(1)
+        start_time = time.perf_counter()
+        try:
+            total = encode_corpus(args.input, args.output, symbol_time_cycles, args.repetition_factor,
+                                  args.chunk_lines)
+        except (PayloadFormatError, OSError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        elapsed = time.perf_counter() - start_time
+        print(f"Encoded {total} packets into {args.output} in {elapsed:.3f} seconds "
+              f"({total / elapsed if elapsed > 0 else 0:.0f} packets/s)")
+        return
+
+    with PacketCorpus(args.corpus) as corpus:
+        print(f"Replaying {args.corpus}: {len(corpus)} packets, starting at {args.start}")
+
+        async def run():
+            try:
+                transport = await get_transport(args.port, timeout=10)
+            except serial.SerialException as e:
+                print(f"Error opening serial port: {e}")
+                sys.exit(1)
+            try:
+                return await replay_corpus(corpus, transport, args.start, args.count, args.aes_decrypt)
+            finally:
+                await close_all()
+
+        stats = asyncio.run(run())
+
+    rate = stats['acked'] / stats['elapsed'] if stats['elapsed'] > 0 else 0.0
+    print(f"Sent {stats['sent']} packets, acknowledged {stats['acked']}, timed out {stats['timeouts']}")
+    print(f"Elapsed time: {stats['elapsed']:.3f} seconds, {rate:.2f} msg/s, {rate * 128:.1f} bps")
+    if stats['elapsed'] > 0:
+        print(f"Modulator utilization: {100 * stats['airtime'] / stats['elapsed']:.1f}%")
+    if stats['timeouts']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
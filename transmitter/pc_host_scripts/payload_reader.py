@@ -0,0 +1,138 @@
+import mmap
+import os
+import re
+import sys
+
+PAYLOAD_BITS = 128
+HEX_DIGITS = PAYLOAD_BITS // 4
+HEX_CHARS = frozenset('0123456789ABCDEFabcdef')
+FULL_HEX_RECORD = re.compile(rb'[0-9A-Fa-f]{32}')
+
+
+class PayloadFormatError(ValueError):
+    """Invalid payload record, carrying its 1-based line number"""
+
+    def __init__(self, line_no, message):
+        super().__init__(f"Line {line_no}: {message}")
+        self.line_no = line_no
+
+
+def classify_payload(text):
+    """
+    Detect the format of one payload record
+
+    - 0x prefix: hex
+    - only 0/1 and exactly 128 digits: binary
+    - 0/1 digits, with or without a 0b prefix, that are too long for 128-bit
+      hex: binary
+    - otherwise: hex, so a short record such as "0B10" keeps its hex value
+
+    Args:
+        text: Record with all whitespace removed
+
+    Returns:
+        ('hex' or 'binary', digits without prefix)
+    Raises:
+        ValueError if the record is empty, has invalid digits or exceeds 128 bits
+    """
+    prefix = text[:2]
+    # Binary is only chosen where reading the record as hex would be impossible (or it is exactly 128 bits)
+    fits_hex = len(text.lstrip('0')) <= HEX_DIGITS
+    if prefix in ('0x', '0X'):
+        kind, digits = 'hex', text[2:]
+    elif prefix in ('0b', '0B') and not fits_hex and not text[2:].strip('01'):
+        kind, digits = 'binary', text[2:]
+    elif (len(text) == PAYLOAD_BITS or not fits_hex) and not text.strip('01'):
+        kind, digits = 'binary', text
+    else:
+        kind, digits = 'hex', text
+
+    if not digits:
+        raise ValueError("Empty record")
+    if kind == 'binary':
+        if digits.strip('01'):
+            raise ValueError("Invalid format. Binary record must contain only 0/1")
+        if len(digits.lstrip('0')) > PAYLOAD_BITS:
+            raise ValueError("Bitstream too large. Must be 128 bits or less")
+    else:
+        if not HEX_CHARS.issuperset(digits):
+            raise ValueError("Invalid format. File must contain binary (0/1) or hex data")
+        if len(digits.lstrip('0')) > HEX_DIGITS:
+            raise ValueError("Bitstream too large. Must be 128 bits or less")
+    return kind, digits
+
+
+def parse_payload(text):
+    """
+    Parse one payload record
+
+    Returns: (128-bit integer value, 'hex' or 'binary')
+    Raises: ValueError if the record is not a valid 128-bit value
+    """
+    kind, digits = classify_payload(''.join(text.split()))
+    return int(digits, 2 if kind == 'binary' else 16), kind
+
+
+def _raw_lines(path):
+    """Yield the raw lines of a file through a read-only memory map, or of stdin for '-'"""
+    if path == '-':
+        yield from sys.stdin.buffer
+        return
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if hasattr(m, 'madvise'):
+                m.madvise(mmap.MADV_SEQUENTIAL)
+            yield from iter(m.readline, b'')
+
+
+def iter_payload_lines(path):
+    """
+    Lazily yield the records of a payload file, one per line
+
+    The file is memory-mapped and scanned line by line, so memory use does not
+    depend on the file size. Blank lines and lines starting with '#' are skipped.
+
+    Yields: (line number, record text with whitespace removed)
+    """
+    for line_no, line in enumerate(_raw_lines(path), start=1):
+        text = line.strip()
+        if not text or text.startswith(b'#'):
+            continue
+        yield line_no, ''.join(text.decode('ascii', errors='replace').split())
+
+
+def iter_payloads(path):
+    """
+    Lazily parse a payload file (mixed hex, 0x hex, 0b binary and binary lines)
+
+    Yields: (line number, 128-bit integer value or None, error message or None)
+    """
+    for line_no, line in enumerate(_raw_lines(path), start=1):
+        text = line.strip()
+        # Fast path for the common full-width hex key
+        if len(text) == HEX_DIGITS and FULL_HEX_RECORD.fullmatch(text):
+            yield line_no, int(text, 16), None
+            continue
+        if not text or text.startswith(b'#'):
+            continue
+        try:
+            kind, digits = classify_payload(''.join(text.decode('ascii', errors='replace').split()))
+        except ValueError as e:
+            yield line_no, None, str(e)
+            continue
+        yield line_no, int(digits, 2 if kind == 'binary' else 16), None
+
+
+def read_payloads(path):
+    """
+    Like iter_payloads(), but stop at the first invalid record
+
+    Yields: 128-bit integer values
+    Raises: PayloadFormatError naming the invalid line
+    """
+    for line_no, value, error in iter_payloads(path):
+        if error is not None:
+            raise PayloadFormatError(line_no, error)
+        yield value
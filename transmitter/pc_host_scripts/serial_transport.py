@@ -0,0 +1,297 @@
+import asyncio
+import os
+import serial
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import host_metrics
+
+# FPGA_PORT overrides the default board, e.g. to point the scripts at fpga_emulator.py
+DEFAULT_PORT = os.environ.get("FPGA_PORT", "COM9")
+BAUDRATE = 57600
+
+# Default read timeout used by the 2-byte conf protocol (seconds)
+CONF_TIMEOUT = 30
+
+# Status word sent back by the FPGA when a transmission is complete
+ACK_WORD = 0xAAAA
+
+CLOCK_HZ = 12_000_000  # FPGA symbol counter clock
+
+PACKET_SIZE = 19       # bitstream[16] + symbol_time[2] + rep_factor[1]
+CONF_SIZE = 2
+ACK_SIZE = 2
+AES_RESPONSE_SIZE = 18  # plaintext[16] + status[2]
+
+
+def build_packet(bitstream, symbol_time_cycles, repetition_factor):
+    """
+    Build the 19-byte packet understood by the key/AES FSK top levels
+
+    Args:
+        bitstream: 128-bit integer, sent first (big-endian)
+        symbol_time_cycles: Number of 12 MHz clock cycles per symbol (16 bits)
+        repetition_factor: Number of times each bit is repeated (1-15)
+
+    Returns:
+        bytes object of length 19
+    """
+    return (bitstream.to_bytes(16, byteorder='big')
+            + (symbol_time_cycles & 0xFFFF).to_bytes(2, byteorder='big')
+            + bytes([repetition_factor & 0xFF]))
+
+
+def packet_airtime(packet):
+    """Seconds the modulator needs for a 19-byte packet: symbol_cycles / 12 MHz * 128 * rep"""
+    symbol_cycles = (packet[16] << 8) | packet[17]
+    repetition_factor = packet[18] & 0x0F
+    return symbol_cycles * 128 * repetition_factor / CLOCK_HZ
+
+
+class SerialTransport:
+    """
+    Long-lived connection to one FPGA board
+
+    All blocking pyserial calls run on a single worker thread owned by the
+    transport, so transactions on one port stay ordered while the event loop
+    remains free to drive other ports.
+
+    When `metrics` is a host_metrics.TransactionRecorder, every conf
+    transaction and every packet/response pair is recorded with its write
+    start, write done, first response byte and ack timestamps, all taken on
+    the worker thread. With metrics set to None the only cost is one
+    attribute check per transaction.
+    """
+
+    def __init__(self, port=DEFAULT_PORT, baudrate=BAUDRATE, timeout=CONF_TIMEOUT, metrics=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.metrics = metrics
+        self._ser = None
+        self._pending_write = None  # (write start ns, write done ns, bytes) of the last packet
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"serial-{port}")
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_open(self):
+        return self._ser is not None and self._ser.is_open
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        self._ser = serial.Serial(port=self.port, baudrate=self.baudrate, bytesize=serial.EIGHTBITS,
+                                  parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE,
+                                  timeout=self.timeout, xonxoff=0, rtscts=0, dsrdtr=0)
+
+    def _write(self, data):
+        start_ns = time.monotonic_ns()
+        self._ser.write(data)
+        self._ser.flush()
+        return start_ns, time.monotonic_ns()
+
+    def _read(self, size, timeout):
+        self._ser.timeout = timeout
+        return self._ser.read(size)
+
+    def _read_timed(self, size, timeout):
+        """Like _read(), also returning the arrival time of the first byte and of the last one"""
+        deadline = time.monotonic() + timeout
+        self._ser.timeout = timeout
+        data = self._ser.read(1)
+        if not data:
+            return data, None, None
+        first_byte_ns = time.monotonic_ns()
+        if size > 1:
+            self._ser.timeout = max(0.0, deadline - time.monotonic())
+            data += self._ser.read(size - 1)
+        return data, first_byte_ns, time.monotonic_ns()
+
+    def _in_waiting(self):
+        return self._ser.in_waiting
+
+    def _close(self):
+        if self._ser is not None:
+            self._ser.close()
+            self._ser = None
+
+    async def open(self):
+        if not self.is_open:
+            await self._run(self._open)
+        return self
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+
+    async def write(self, data):
+        """
+        Write and flush `data`, returning (write start ns, write done ns)
+        Any bytes-like object is passed through without copying (e.g. a memoryview of an mmap)
+        """
+        return await self._run(self._write, data)
+
+    async def in_waiting(self):
+        return await self._run(self._in_waiting)
+
+    async def read(self, size, timeout=None):
+        """Read up to `size` bytes, returning early only on timeout"""
+        if timeout is None:
+            timeout = self.timeout
+        return await self._run(self._read, size, timeout)
+
+    async def wait_ack(self, size=ACK_SIZE, timeout=None):
+        """
+        Wait for a `size`-byte response from the board
+
+        Returns:
+            The bytes read; shorter than `size` if the timeout expired
+        """
+        return await self.read(size, timeout)
+
+    async def wait_completion(self, size=ACK_SIZE, timeout=None):
+        """
+        Block until a `size`-byte response ending in the 0xAAAA status word arrives
+
+        The read returns as soon as the bytes are in, so there is no polling
+        delay between the board finishing and the caller being woken up.
+        Responses carrying any other status word are collected and skipped.
+        After one, the window slides a byte at a time until its last two bytes
+        are 0xAAAA, so stray bytes on the line cannot push a real response out
+        of alignment; only the first rejected window is reported.
+
+        Args:
+            size: Response length (2 for key mode, 18 for AES mode)
+            timeout: Deadline in seconds from now (default: transport timeout)
+
+        Returns:
+            (response, rejected) - response is None if the deadline expired,
+            rejected is the list of responses with an unexpected status word
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if self.metrics is not None:
+            return await self._wait_completion_timed(size, timeout)
+        deadline = time.perf_counter() + timeout
+        window = bytearray()
+        rejected = []
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None, rejected
+            window += await self.read(size - len(window), remaining)
+            if len(window) < size:
+                continue
+            if int.from_bytes(window[-2:], byteorder='big') == ACK_WORD:
+                return bytes(window), rejected
+            if not rejected:
+                rejected.append(bytes(window))
+            del window[0]
+
+    async def _wait_completion_timed(self, size, timeout):
+        deadline = time.perf_counter() + timeout
+        write_start_ns, write_done_ns, bytes_out = self._pending_write or (None, None, 0)
+        self._pending_write = None
+        first_byte_ns = ack_ns = None
+        bytes_in = 0
+        window = bytearray()
+        rejected = []
+        response = None
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            data, first_ns, done_ns = await self._run(self._read_timed, size - len(window), remaining)
+            bytes_in += len(data)
+            window += data
+            if first_byte_ns is None:
+                first_byte_ns = first_ns
+            if len(window) < size:
+                continue
+            if int.from_bytes(window[-2:], byteorder='big') == ACK_WORD:
+                response, ack_ns = bytes(window), done_ns
+                break
+            if not rejected:
+                rejected.append(bytes(window))
+            del window[0]
+        self.metrics.record("packet", self.port, write_start_ns, write_done_ns, first_byte_ns, ack_ns,
+                            bytes_out, bytes_in, response is not None)
+        return response, rejected
+
+    async def send_conf(self, conf, timeout=None):
+        """
+        Send a 2-byte configuration word and return the 2-byte echo
+
+        Args:
+            conf: Hex string (e.g. "FF03") or bytes
+            timeout: Read timeout in seconds (default: transport timeout)
+        """
+        data = bytes.fromhex(conf) if isinstance(conf, str) else bytes(conf)
+        if len(data) != CONF_SIZE:
+            raise ValueError(f"Conf word must be {CONF_SIZE} bytes, got {len(data)}")
+        async with self._lock:
+            write_start_ns, write_done_ns = await self.write(data)
+            if self.metrics is None:
+                return await self.wait_ack(CONF_SIZE, timeout)
+            if timeout is None:
+                timeout = self.timeout
+            echo, first_byte_ns, ack_ns = await self._run(self._read_timed, CONF_SIZE, timeout)
+            self.metrics.record("conf", self.port, write_start_ns, write_done_ns, first_byte_ns,
+                                ack_ns if len(echo) == CONF_SIZE else None,
+                                len(data), len(echo), len(echo) == CONF_SIZE)
+            return echo
+
+    async def send_packet(self, packet):
+        """
+        Send a 19-byte modulation packet (does not wait for the ack)
+        Returns: (write start ns, write done ns)
+        """
+        if len(packet) != PACKET_SIZE:
+            raise ValueError(f"Packet must be {PACKET_SIZE} bytes, got {len(packet)}")
+        write_start_ns, write_done_ns = await self.write(packet)
+        if self.metrics is not None:
+            self._pending_write = (write_start_ns, write_done_ns, len(packet))
+        return write_start_ns, write_done_ns
+
+
+# One transport per port, shared by everything running in this process
+_transports = {}
+
+# Recorder shared by all transports, False until first looked up in the environment
+_metrics = False
+
+
+def get_metrics():
+    """Return the shared recorder, creating it from FPGA_METRICS_JSONL / FPGA_METRICS_PROM on first use"""
+    global _metrics
+    if _metrics is False:
+        _metrics = host_metrics.recorder_from_env()
+    return _metrics
+
+
+async def get_transport(port=DEFAULT_PORT, baudrate=BAUDRATE, timeout=CONF_TIMEOUT):
+    """
+    Return the open transport for `port`, opening it on first use
+
+    Raises:
+        serial.SerialException if the port cannot be opened
+    """
+    transport = _transports.get(port)
+    if transport is None or not transport.is_open:
+        transport = SerialTransport(port, baudrate, timeout, get_metrics())
+        await transport.open()
+        _transports[port] = transport
+    return transport
+
+
+async def close_all():
+    """Close every transport opened through get_transport() and the shared recorder"""
+    global _metrics
+    while _transports:
+        _, transport = _transports.popitem()
+        await transport.close()
+    if _metrics:
+        _metrics.close()
+    _metrics = False
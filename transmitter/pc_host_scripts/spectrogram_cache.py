@@ -0,0 +1,279 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from fsk_demod import BLOCK_SAMPLES, CENTER_FREQ, DT_TARGET, RAW_FORMATS, Capture, FskDemodulator
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "fsk_spectrogram")
+DEFAULT_MAX_BYTES = 4 << 30
+CACHE_VERSION = 1
+HASH_CHUNK = 1 << 24
+INDEX_FILE = "content_index.json"  # (path, size, mtime) -> content hash, so unchanged captures are not re-read
+
+
+class SpectrogramCache:
+    """
+    On-disk cache of spectrogram power matrices
+
+    Each entry is a float32 (frames, bins) .npy of power in dB plus a JSON
+    sidecar with the parameters and bin frequencies. Entries are keyed by a
+    BLAKE2b hash of the capture content and the STFT parameters, written
+    under a temporary name and renamed into place, and loaded as read-only
+    memory maps. Using an entry bumps its modification time; when the total
+    size exceeds max_bytes the least recently used entries are deleted.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def content_hash(self, path):
+        """BLAKE2b of the file content, remembered per (path, size, mtime) so that reuse costs one stat()"""
+        info = os.stat(path)
+        real_path = os.path.realpath(path)
+        ident = f"{real_path}|{info.st_size}|{info.st_mtime_ns}"
+        index_path = self._path(INDEX_FILE, "")
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        if ident in index:
+            return index[ident]
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+        # Forget the hashes of earlier versions of this file
+        index = {k: v for k, v in index.items() if k.rpartition('|')[0].rpartition('|')[0] != real_path}
+        index[ident] = digest.hexdigest()
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+        return index[ident]
+
+    @staticmethod
+    def key(content_hash, params):
+        """Entry key of a capture content hash and the STFT parameters"""
+        text = json.dumps({"content": content_hash, "version": CACHE_VERSION, **params}, sort_keys=True)
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    def get(self, key):
+        """
+        Look up an entry
+
+        Returns: (read-only memory-mapped power matrix, metadata dict), or None
+        """
+        try:
+            with open(self._path(key, ".json")) as f:
+                meta = json.load(f)
+            power = np.load(self._path(key, ".npy"), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        now = time.time()
+        for suffix in (".npy", ".json"):
+            os.utime(self._path(key, suffix), (now, now))
+        return power, meta
+
+    def put(self, key, shape, blocks, meta):
+        """
+        Store an entry from blocks of rows
+
+        Args:
+            key: Entry key
+            shape: (frames, bins) of the whole matrix
+            blocks: Iterable of (rows, bins) arrays filling the matrix in order
+            meta: JSON-serializable metadata
+
+        Returns: (read-only memory-mapped power matrix, metadata dict)
+        """
+        tmp_path = self._path(key, f".{os.getpid()}.tmp.npy")
+        power = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=shape)
+        row = 0
+        try:
+            for block in blocks:
+                power[row:row + len(block)] = block
+                row += len(block)
+            power.flush()
+            del power
+            meta = dict(meta, shape=[row, shape[1]])
+            if row != shape[0]:
+                raise ValueError(f"Expected {shape[0]} frames, got {row}")
+            with open(self._path(key, ".json.tmp"), 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self._path(key, ".npy"))
+            os.replace(self._path(key, ".json.tmp"), self._path(key, ".json"))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict(keep=key)
+        return self.get(key)
+
+    def entries(self):
+        """List (key, total bytes, last use time, metadata) of all entries, least recently used first"""
+        result = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name == INDEX_FILE:
+                continue
+            key = name[:-len(".json")]
+            try:
+                with open(self._path(key, ".json")) as f:
+                    meta = json.load(f)
+                data = os.stat(self._path(key, ".npy"))
+                size = data.st_size + os.path.getsize(self._path(key, ".json"))
+            except (OSError, ValueError):
+                continue
+            result.append((key, size, data.st_mtime, meta))
+        return sorted(result, key=lambda entry: entry[2])
+
+    def remove(self, key):
+        for suffix in (".npy", ".json"):
+            try:
+                os.remove(self._path(key, suffix))
+            except FileNotFoundError:
+                pass
+
+    def evict(self, keep=None):
+        """Delete least recently used entries until the cache fits max_bytes; returns the deleted keys"""
+        entries = self.entries()
+        total = sum(size for _, size, _, _ in entries)
+        removed = []
+        for key, size, _, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self.remove(key)
+            total -= size
+            removed.append(key)
+        return removed
+
+    def clear(self):
+        for key, _, _, _ in self.entries():
+            self.remove(key)
+
+
+def spectrogram_params(capture, dt_target=DT_TARGET, center_freq=CENTER_FREQ, span_mhz=None):
+    """STFT parameters that determine the cached matrix (besides the capture content)"""
+    frame_len = int(np.floor(dt_target * capture.fs + 0.5))  # MATLAB round(), as FskDemodulator
+    return {"fs": capture.fs, "M": frame_len, "hop": frame_len, "nfft": 1 << (2 * frame_len - 1).bit_length(),
+            "window": "hann-periodic", "input": "complex" if capture.is_complex else "mono",
+            "center_freq": center_freq, "span_mhz": span_mhz}
+
+
+def spectrogram_blocks(capture, dt_target=DT_TARGET, center_freq=CENTER_FREQ, span_mhz=None):
+    """
+    Spectrogram power of a capture in dB, computed in blocks of about BLOCK_SAMPLES
+
+    Returns:
+        ((frames, bins) shape, generator of (rows, bins) float32 blocks, absolute bin frequencies in MHz)
+    """
+    bandwidth = span_mhz if span_mhz else 2 * capture.fs / 1e6  # wider than the captured span
+    demod = FskDemodulator(capture.fs, capture.is_complex, center_freq, center_freq / 1e6, bandwidth,
+                           dt_target=dt_target, detector="fft")
+    # Order the columns by frequency (complex input holds the negative frequencies in the upper half)
+    bins = demod.band_bins[0][np.argsort(demod.f_abs_mhz[demod.band_bins[0]], kind='stable')]
+    if not len(bins):
+        raise ValueError(f"No FFT bin within the {span_mhz} MHz span")
+    demod.band_bins = [bins]
+    demod.bins = bins
+    block_samples = max(1, BLOCK_SAMPLES // demod.frame_len) * demod.frame_len
+    blocks = (demod.bin_power_db(demod.frames_of(block)).astype(np.float32)
+              for block in capture.blocks(block_samples))
+    return (len(capture) // demod.frame_len, len(bins)), blocks, demod.f_abs_mhz[bins]
+
+
+def cached_spectrogram(cache, capture, dt_target=DT_TARGET, center_freq=CENTER_FREQ, span_mhz=None):
+    """
+    Spectrogram power of a capture in dB, computed once and then served from the cache
+
+    Args:
+        cache: SpectrogramCache
+        capture: fsk_demod.Capture
+        dt_target: Frame length in seconds (frames do not overlap, as Receiver_Code.m)
+        center_freq: SDR center frequency in Hz
+        span_mhz: Keep only the bins within +- span_mhz / 2 of center_freq, or None for all
+
+    Returns:
+        (power_db (frames, bins) float32 memory map, absolute bin frequencies in MHz, cache hit)
+    """
+    params = spectrogram_params(capture, dt_target, center_freq, span_mhz)
+    key = cache.key(cache.content_hash(capture.path), params)
+    entry = cache.get(key)
+    hit = entry is not None
+    if not hit:
+        shape, blocks, freqs_mhz = spectrogram_blocks(capture, dt_target, center_freq, span_mhz)
+        meta = {"capture": os.path.abspath(capture.path), "params": params, "freqs_mhz": freqs_mhz.tolist()}
+        entry = cache.put(key, shape, blocks, meta)
+    power, meta = entry
+    return power, np.array(meta["freqs_mhz"]), hit
+
+
+def band_power_from_spectrogram(power_db, freqs_mhz, band_center_mhz, bandwidth_mhz):
+    """Largest power in dB within [band_center +- bandwidth / 2] of each frame, as bandpass_filter() then max()"""
+    lower, upper = band_center_mhz - bandwidth_mhz / 2, band_center_mhz + bandwidth_mhz / 2
+    columns = np.flatnonzero((freqs_mhz >= lower) & (freqs_mhz <= upper))
+    if not len(columns):
+        raise ValueError(f"No cached bin falls inside the {band_center_mhz} MHz band")
+    # Contiguous columns (bins are sorted by frequency), so this reads a slice of the memory map
+    return np.asarray(power_db[:, columns[0]:columns[-1] + 1].max(axis=1), dtype=np.float64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Persistent spectrogram cache for the FSK demodulator')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f'Cache directory (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--max-gb', type=float, default=DEFAULT_MAX_BYTES / (1 << 30),
+                       help=f'Cache size bound in GiB (default: {DEFAULT_MAX_BYTES / (1 << 30):g})')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Compute (or look up) the spectrogram of captures')
+    build.add_argument('captures', nargs='+', help='WAV or raw IQ captures')
+    build.add_argument('--format', choices=['wav'] + list(RAW_FORMATS), help='Capture format (default: from extension)')
+    build.add_argument('--fs', type=float, help='Sample rate in Hz (raw captures)')
+    build.add_argument('--iq', action='store_true', help='Use 2-channel WAVs as I/Q instead of averaging to mono')
+    build.add_argument('--center-freq', type=float, default=CENTER_FREQ,
+                       help=f'SDR center frequency in Hz (default: {CENTER_FREQ:g})')
+    build.add_argument('--span', type=float, default=None,
+                       help='Keep only bins within +- SPAN/2 MHz of the center frequency (default: all)')
+    subparsers.add_parser('list', help='List the cache entries, least recently used first')
+    subparsers.add_parser('clear', help='Delete all entries')
+
+    args = parser.parse_args()
+    cache = SpectrogramCache(args.cache_dir, int(args.max_gb * (1 << 30)))
+
+    if args.command == 'list':
+        entries = cache.entries()
+        for key, size, used, meta in entries:
+            p = meta["params"]
+            print(f"{key}  {size / 1e6:10.1f} MB  {time.strftime('%Y-%m-%d %H:%M', time.localtime(used))}  "
+                  f"{meta['shape'][0]}x{meta['shape'][1]}  fs {p['fs']:g} M {p['M']} nfft {p['nfft']}  {meta['capture']}")
+        print(f"{len(entries)} entries, {sum(e[1] for e in entries) / 1e6:.1f} MB of {cache.max_bytes / 1e6:.0f} MB")
+        return
+    if args.command == 'clear':
+        cache.clear()
+        print(f"Cleared {args.cache_dir}")
+        return
+
+    for path in args.captures:
+        start_time = time.perf_counter()
+        try:
+            capture = Capture(path, args.format, args.fs, args.iq)
+            power, freqs, hit = cached_spectrogram(cache, capture, center_freq=args.center_freq, span_mhz=args.span)
+        except (OSError, ValueError) as e:
+            print(f"❌ {path}: {e}")
+            continue
+        elapsed = time.perf_counter() - start_time
+        print(f"{'✅ hit ' if hit else '✅ built'} {path}: {power.shape[0]} frames x {power.shape[1]} bins "
+              f"({freqs[0]:.6f}-{freqs[-1]:.6f} MHz, {power.nbytes / 1e6:.1f} MB) in {elapsed * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
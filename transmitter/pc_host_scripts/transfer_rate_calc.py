@@ -1,5 +1,15 @@
 import sys
 import argparse
+import csv
+import math
+
+import numpy as np
+
+MESSAGE_BITS = 128        # one 19-byte packet carries a 128-bit payload
+MAX_SYMBOL_CYCLES = 65535  # 16-bit symbol_time field
+MAX_REPETITION = 15        # 4-bit rep_factor field
+# UART turnaround per message: 19-byte packet + 2-byte ack at 57600 baud, 10 bits per byte
+DEFAULT_OVERHEAD_MS = (19 + 2) * 10 / 57600 * 1000
 
 def calculate_transfer_rate(symbol_time, clock_freq_mhz=12):
     """
@@ -26,15 +36,203 @@ def calculate_transfer_rate(symbol_time, clock_freq_mhz=12):
     
     return transfer_rate_kbps
 
+def load_ber_curve(csv_file, clock_freq_mhz=12):
+    """
+    Read a measured BER-vs-symbol-time curve
+
+    The CSV needs a 'ber' column and either 'symbol_cycles' or 'symbol_time_ms'.
+
+    Returns:
+        (symbol cycles, ber) arrays sorted by symbol time
+    """
+    cycles, ber = [], []
+    with open(csv_file, newline='') as f:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        if 'ber' not in fields or not ('symbol_cycles' in fields or 'symbol_time_ms' in fields):
+            raise ValueError(f"{csv_file} needs a 'ber' column and a 'symbol_cycles' or 'symbol_time_ms' column")
+        for line_no, row in enumerate(reader, start=2):
+            try:
+                if row.get('symbol_cycles'):
+                    cycles.append(float(row['symbol_cycles']))
+                else:
+                    cycles.append(float(row['symbol_time_ms']) * clock_freq_mhz * 1000)
+                ber.append(float(row['ber']))
+            except (TypeError, ValueError):
+                raise ValueError(f"{csv_file} line {line_no}: invalid number")
+    if not cycles:
+        raise ValueError(f"{csv_file} holds no data points")
+    order = np.argsort(cycles)
+    return np.asarray(cycles)[order], np.clip(np.asarray(ber)[order], 0.0, 0.5)
+
+
+def majority_error_rate(p, repetitions):
+    """
+    Bit error rate after n-fold repetition with majority voting
+
+    A bit is wrong when more than half of its n copies flip (binomial tail).
+    For even n a tie is decided as 0, as in the receiver's
+    repetition_code_decoder, which is wrong for half of the random bits.
+
+    Args:
+        p: Raw bit error rate, array of shape (C, 1)
+        repetitions: Repetition factors, array of shape (R,)
+
+    Returns:
+        (C, R) array of decoded bit error rates
+    """
+    result = np.zeros(np.broadcast_shapes(p.shape, repetitions.shape))
+    q = 1.0 - p
+    for k in range(1, int(repetitions.max()) + 1):
+        weight = np.where(2 * k > repetitions, 1.0, np.where(2 * k == repetitions, 0.5, 0.0))
+        weight = weight * np.array([math.comb(int(n), k) for n in repetitions])
+        result += weight * p ** k * q ** np.maximum(repetitions - k, 0)
+    return result
+
+
+def plan_operating_points(ber, clock_freq_mhz=12, overhead_ms=DEFAULT_OVERHEAD_MS, cycle_range=None):
+    """
+    Evaluate every (symbol cycles, repetition factor) pair in one vectorized pass
+
+    Args:
+        ber: Raw channel BER, a float or a (symbol cycles, ber) curve from
+             load_ber_curve(), interpolated in log-BER over the symbol time
+        clock_freq_mhz: Symbol counter clock
+        overhead_ms: Fixed per-message time on top of the airtime (UART turnaround)
+        cycle_range: (min, max) symbol cycles to consider (default: 1..65535,
+                     or the measured span for a curve)
+
+    Returns:
+        dict of (C, R) arrays: cycles, repetition, bit_error, success,
+        message_time_s, raw_bps and goodput_bps
+    """
+    if isinstance(ber, tuple):
+        curve_cycles, curve_ber = ber
+        low, high = cycle_range or (curve_cycles[0], curve_cycles[-1])
+    else:
+        low, high = cycle_range or (1, MAX_SYMBOL_CYCLES)
+    cycles = np.arange(max(1, int(math.ceil(low))), min(MAX_SYMBOL_CYCLES, int(high)) + 1)
+    if not len(cycles):
+        raise ValueError("Empty symbol time range")
+    repetitions = np.arange(1, MAX_REPETITION + 1)
+
+    if isinstance(ber, tuple):
+        log_ber = np.interp(cycles, curve_cycles, np.log(np.maximum(curve_ber, 1e-300)))
+        p = np.exp(log_ber)[:, None]
+    else:
+        p = np.full((len(cycles), 1), min(max(float(ber), 0.0), 0.5))
+
+    bit_error = majority_error_rate(p, repetitions)
+    success = (1.0 - bit_error) ** MESSAGE_BITS
+    message_time = (cycles[:, None] * MESSAGE_BITS * repetitions / (clock_freq_mhz * 1e6)
+                    + overhead_ms / 1000)
+    raw_bps = MESSAGE_BITS / message_time
+    return {'cycles': np.broadcast_to(cycles[:, None], success.shape),
+            'repetition': np.broadcast_to(repetitions, success.shape),
+            'bit_error': bit_error, 'success': success, 'message_time_s': message_time,
+            'raw_bps': raw_bps, 'goodput_bps': raw_bps * success}
+
+
+def pareto_frontier(plan):
+    """
+    Operating points not beaten on both goodput and message success
+
+    Returns:
+        Flat indices into the plan arrays, ordered by decreasing success
+    """
+    success = plan['success'].ravel()
+    goodput = plan['goodput_bps'].ravel()
+    order = np.lexsort((-goodput, -success))
+    best_so_far = np.maximum.accumulate(goodput[order])
+    keep = np.empty(len(order), dtype=bool)
+    keep[0] = True
+    keep[1:] = goodput[order][1:] > best_so_far[:-1]
+    return order[keep]
+
+
+def print_plan(plan, frontier, top, min_success, clock_freq_mhz):
+    def row(index):
+        cycles = plan['cycles'].flat[index]
+        return (f"{cycles:>7} {cycles / (clock_freq_mhz * 1000):>9.4f} {plan['repetition'].flat[index]:>4} "
+                f"{plan['bit_error'].flat[index]:>10.3e} {plan['success'].flat[index]:>9.5f} "
+                f"{plan['raw_bps'].flat[index]:>10.1f} {plan['goodput_bps'].flat[index]:>10.1f}")
+
+    header = f"{'cycles':>7} {'symbol_ms':>9} {'rep':>4} {'bit_err':>10} {'success':>9} {'raw_bps':>10} {'goodput':>10}"
+    print(f"\n{'='*60}")
+    print(f"GOODPUT PLAN ({plan['success'].size} operating points, {len(frontier)} on the Pareto frontier)")
+    print(f"{'='*60}")
+    print(header)
+    shown = frontier if len(frontier) <= top else frontier[np.linspace(0, len(frontier) - 1, top).astype(int)]
+    for index in shown:
+        print(row(index))
+
+    best = int(np.argmax(plan['goodput_bps']))
+    print(f"\nMaximum goodput:\n{header}\n{row(best)}")
+    eligible = np.flatnonzero(plan['success'].ravel() >= min_success)
+    if len(eligible):
+        best_reliable = eligible[np.argmax(plan['goodput_bps'].ravel()[eligible])]
+        print(f"\nMaximum goodput with message success >= {min_success}:\n{header}\n{row(best_reliable)}")
+    else:
+        print(f"\n⚠️  No operating point reaches message success >= {min_success}")
+
+
+def write_frontier_csv(csv_file, plan, frontier, clock_freq_mhz):
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['symbol_cycles', 'symbol_time_ms', 'repetition_factor', 'bit_error_rate',
+                         'message_success', 'raw_bps', 'goodput_bps'])
+        for index in frontier:
+            cycles = int(plan['cycles'].flat[index])
+            writer.writerow([cycles, f"{cycles / (clock_freq_mhz * 1000):.6f}", int(plan['repetition'].flat[index]),
+                             f"{plan['bit_error'].flat[index]:.6e}", f"{plan['success'].flat[index]:.6f}",
+                             f"{plan['raw_bps'].flat[index]:.3f}", f"{plan['goodput_bps'].flat[index]:.3f}"])
+
+
 def main():
     parser = argparse.ArgumentParser(description='Calculate FSK transfer rate from symbol time')
-    parser.add_argument('symbol_time', type=int, help='Symbol time in clock cycles')
+    parser.add_argument('symbol_time', type=int, nargs='?', help='Symbol time in clock cycles')
     parser.add_argument('-f', '--freq', type=float, default=12.0, 
                        help='Clock frequency in MHz (default: 12.0)')
     parser.add_argument('-v', '--verbose', action='store_true',
                        help='Show detailed output')
+    planner = parser.add_argument_group('planner mode', 'Rank every (symbol time, repetition factor) pair by goodput')
+    planner.add_argument('--ber', type=float, help='Measured raw bit error rate')
+    planner.add_argument('--ber-csv', help='CSV of BER vs symbol time (columns: symbol_cycles or symbol_time_ms, ber)')
+    planner.add_argument('--overhead-ms', type=float, default=DEFAULT_OVERHEAD_MS,
+                       help=f'Per-message UART turnaround in ms (default: {DEFAULT_OVERHEAD_MS:.3f})')
+    planner.add_argument('--min-success', type=float, default=0.99,
+                       help='Message success required for the recommended point (default: 0.99)')
+    planner.add_argument('--top', type=int, default=20, help='Frontier rows to print (default: 20)')
+    planner.add_argument('--csv', help='Write the whole Pareto frontier to this CSV file')
     
     args = parser.parse_args()
+
+    if args.ber is not None or args.ber_csv:
+        if args.ber is not None and args.ber_csv:
+            print("Error: Use either --ber or --ber-csv")
+            sys.exit(1)
+        if args.ber is not None and not 0.0 <= args.ber <= 0.5:
+            print("Error: BER must be between 0 and 0.5")
+            sys.exit(1)
+        try:
+            ber = load_ber_curve(args.ber_csv, args.freq) if args.ber_csv else args.ber
+            cycle_range = (args.symbol_time, args.symbol_time) if args.symbol_time else None
+            plan = plan_operating_points(ber, args.freq, args.overhead_ms, cycle_range)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        if args.ber is not None and not args.symbol_time:
+            print("Note: A single --ber is assumed to hold at every symbol time; pass symbol_time to pin it "
+                  "or --ber-csv for a measured curve")
+        frontier = pareto_frontier(plan)
+        print_plan(plan, frontier, args.top, args.min_success, args.freq)
+        if args.csv:
+            write_frontier_csv(args.csv, plan, frontier, args.freq)
+            print(f"\nPareto frontier written to {args.csv}")
+        return
+
+    if args.symbol_time is None:
+        parser.error("symbol_time is required unless --ber or --ber-csv is given")
     
     try:
         transfer_rate = calculate_transfer_rate(args.symbol_time, args.freq)